@@ -0,0 +1,270 @@
+"""
+Write-behind queue for attendance marks sent to the main Node.js server
+Recognition requests enqueue their mark and answer "pending" straight away; a
+background thread delivers queued marks in batches to the bulk endpoint.
+Marks are appended to an on-disk spool before they are acknowledged, so marks
+not yet delivered are resent after a restart
+"""
+
+import json
+import logging
+import os
+import threading
+import uuid
+from collections import OrderedDict, deque
+import requests
+
+logger = logging.getLogger(__name__)
+
+
+class AttendanceQueue:
+    """
+    Batches attendance marks into POSTs to the main system's bulk route
+
+    Each item of the bulk reply carries the HTTP status the single-mark route
+    would have returned. Statuses below 500 are final (marked or rejected);
+    5xx items, failed requests and non-200 replies are retried with
+    exponential backoff until `max_attempts`. Resending a mark that was
+    already recorded is harmless: the main system answers `already_present`.
+
+    The spool is an append-only JSON-lines file of `add` and `done` records.
+    `add` records are fsynced before enqueue returns; it is emptied whenever
+    the queue drains and rewritten to the undelivered marks on start.
+    """
+
+    def __init__(self, client, spool_file, bulk_path='/attendance/face-recognition/bulk',
+                 batch_size=50, flush_interval=0.2, max_attempts=8, backoff_base=0.5,
+                 backoff_max=30.0, on_result=None, result_cache_size=10000):
+        """
+        Args:
+            client: PooledHTTPClient for the main system
+            spool_file: Path of the on-disk spool
+            bulk_path: Bulk attendance route on the main system
+            batch_size: Most marks sent in one request
+            flush_interval: Seconds to wait for a batch to fill before sending
+            max_attempts: Deliveries tried before a mark is given up as failed
+            backoff_base: First retry delay in seconds, doubled per failure
+            backoff_max: Longest retry delay in seconds
+            on_result: Callback (mark, result) run on the worker thread once a
+                       mark is marked, rejected or failed
+            result_cache_size: Finished marks whose outcome stays queryable
+        """
+        self.client = client
+        self.spool_file = spool_file
+        self.bulk_path = bulk_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.on_result = on_result
+        self.result_cache_size = result_cache_size
+        self._ready = threading.Condition()
+        self._closing = threading.Event()
+        self._pending = deque()
+        self._in_flight = []
+        self._results = OrderedDict()
+        self._spool = None
+        self._failures = 0
+        self._worker = None
+        self.counters = {'enqueued': 0, 'batches': 0, 'sent': 0, 'marked': 0,
+                         'rejected': 0, 'failed': 0, 'retries': 0}
+        self.last_error = None
+
+    def start(self):
+        """Reload undelivered marks from the spool and start the sender thread"""
+        with self._ready:
+            self._replay_locked()
+        self._worker = threading.Thread(target=self._run, name='attendance-queue', daemon=True)
+        self._worker.start()
+        return self
+
+    def enqueue(self, mark):
+        """
+        Spool a mark and queue it for delivery
+
+        Args:
+            mark: Body of a single /attendance/face-recognition call
+
+        Returns:
+            str: Mark id for status()
+        """
+        mark_id = uuid.uuid4().hex
+        with self._ready:
+            self._spool_locked({'op': 'add', 'id': mark_id, 'mark': mark}, sync=True)
+            self._pending.append({'id': mark_id, 'mark': mark, 'attempts': 0})
+            self.counters['enqueued'] += 1
+            self._ready.notify()
+        return mark_id
+
+    def status(self, mark_id):
+        """Outcome of a mark: pending, marked, rejected or failed (None if unknown)"""
+        with self._ready:
+            if mark_id in self._results:
+                return self._results[mark_id]
+            if any(entry['id'] == mark_id for entry in (*self._pending, *self._in_flight)):
+                return {'id': mark_id, 'status': 'pending'}
+        return None
+
+    def stats(self):
+        with self._ready:
+            return dict(
+                self.counters,
+                pending=len(self._pending),
+                in_flight=len(self._in_flight),
+                mean_batch_size=round(self.counters['sent'] / self.counters['batches'], 2)
+                if self.counters['batches'] else 0.0,
+                last_error=self.last_error
+            )
+
+    def close(self, timeout=5.0):
+        """Send what can be sent within `timeout`; the rest stays spooled"""
+        self._closing.set()
+        with self._ready:
+            self._ready.notify_all()
+        if self._worker is not None:
+            self._worker.join(timeout)
+        with self._ready:
+            if self._spool is not None:
+                self._spool.close()
+                self._spool = None
+
+    def _run(self):
+        while True:
+            with self._ready:
+                self._ready.wait_for(lambda: self._pending or self._closing.is_set())
+                if not self._pending:
+                    return
+                # Give concurrent recognitions a moment to join the batch
+                self._ready.wait_for(lambda: len(self._pending) >= self.batch_size
+                                     or self._closing.is_set(), timeout=self.flush_interval)
+                batch = [self._pending.popleft() for _ in range(min(self.batch_size, len(self._pending)))]
+                self._in_flight = batch
+
+            retry = self._send(batch)
+
+            given_up = []
+            with self._ready:
+                self._in_flight = []
+                if retry:
+                    given_up = self._retry_locked(retry)
+                else:
+                    self._failures = 0
+                if not self._pending and self._spool is not None:
+                    # Everything delivered: nothing in the spool is needed any more
+                    self._spool.truncate(0)
+            for entry, outcome in given_up:
+                self._notify(entry, outcome)
+
+            if retry and self._pending:
+                delay = min(self.backoff_max, self.backoff_base * 2 ** (self._failures - 1))
+                if self._closing.wait(delay):
+                    return
+
+    def _send(self, batch):
+        """POST one batch; returns the entries to retry"""
+        body = {'marks': [dict(entry['mark'], id=entry['id']) for entry in batch]}
+        try:
+            response = self.client.post(self.bulk_path, json=body)
+        except requests.exceptions.RequestException as e:
+            self.last_error = f"Network error: {e}"
+            return batch
+        if response.status_code != 200:
+            self.last_error = f"HTTP {response.status_code}: {response.text[:200]}"
+            return batch
+
+        try:
+            results = {item.get('id'): item for item in response.json().get('results', [])}
+        except (ValueError, AttributeError):
+            self.last_error = 'Malformed bulk attendance reply'
+            return batch
+        retry = []
+        for entry in batch:
+            result = results.get(entry['id'])
+            if result is None or result.get('status', 500) >= 500:
+                retry.append(entry)
+            else:
+                # A resent mark that already landed comes back as already_present
+                delivered = result.get('success') or result.get('error') == 'already_present'
+                self._finish(entry, 'marked' if delivered else 'rejected', result)
+
+        with self._ready:
+            self.counters['batches'] += 1
+            self.counters['sent'] += len(batch)
+        if retry:
+            self.last_error = f"{len(retry)} of {len(batch)} marks failed on the main system"
+        return retry
+
+    def _retry_locked(self, entries):
+        self._failures += 1
+        requeue, given_up = [], []
+        for entry in entries:
+            entry['attempts'] += 1
+            if entry['attempts'] >= self.max_attempts:
+                logger.error(f"Giving up attendance mark {entry['id']} after "
+                             f"{entry['attempts']} attempts: {self.last_error}")
+                given_up.append((entry, self._finish_locked(entry, 'failed',
+                                                            {'success': False, 'error': self.last_error})))
+            else:
+                requeue.append(entry)
+        self.counters['retries'] += len(requeue)
+        self._pending.extendleft(reversed(requeue))
+        return given_up
+
+    def _finish(self, entry, status, result):
+        with self._ready:
+            outcome = self._finish_locked(entry, status, result)
+        self._notify(entry, outcome)
+
+    def _notify(self, entry, outcome):
+        if self.on_result is not None:
+            try:
+                self.on_result(entry['mark'], outcome)
+            except Exception as e:
+                logger.error(f"Attendance result callback failed: {e}")
+
+    def _finish_locked(self, entry, status, result):
+        outcome = dict(result, id=entry['id'], status=status, http_status=result.get('status'))
+        self.counters[status] += 1
+        self._results[entry['id']] = outcome
+        while len(self._results) > self.result_cache_size:
+            self._results.popitem(last=False)
+        self._spool_locked({'op': 'done', 'id': entry['id']})
+        return outcome
+
+    def _spool_locked(self, record, sync=False):
+        if self._spool is None:
+            self._spool = open(self.spool_file, 'ab')
+        self._spool.write((json.dumps(record) + "\n").encode('utf-8'))
+        self._spool.flush()
+        if sync:
+            os.fsync(self._spool.fileno())
+
+    def _replay_locked(self):
+        """Queue spooled marks that were never delivered, then compact the spool"""
+        if not os.path.exists(self.spool_file):
+            return
+        undelivered = OrderedDict()
+        with open(self.spool_file, 'rb') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Torn final record from a crash mid-write
+                    break
+                if record['op'] == 'add':
+                    undelivered[record['id']] = record
+                else:
+                    undelivered.pop(record['id'], None)
+
+        tmp_file = self.spool_file + ".tmp"
+        with open(tmp_file, 'wb') as f:
+            f.writelines((json.dumps(record) + "\n").encode('utf-8') for record in undelivered.values())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.spool_file)
+
+        for record in undelivered.values():
+            self._pending.append({'id': record['id'], 'mark': record['mark'], 'attempts': 0})
+        if undelivered:
+            logger.info(f"Resending {len(undelivered)} spooled attendance marks")
@@ -0,0 +1,353 @@
+"""
+Bulk enrolment across worker processes
+Decoding, detection and embedding of many students run in a pool of spawned
+processes, each with its own copy of the face models, so a large intake uses
+every core instead of one request thread. Progress is reported per student as
+it finishes and the gallery is updated once, after every student is processed.
+Accepted images are staged and only moved into the students directory once
+that update succeeds
+"""
+
+import binascii
+import json
+import logging
+import multiprocessing
+import os
+import posixpath
+import shutil
+import tempfile
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+import cv2
+
+from image_io import decode_image
+from image_uploads import decode_base64_image
+
+logger = logging.getLogger(__name__)
+
+# Metadata file optionally placed at the root of an enrolment archive
+ARCHIVE_METADATA = 'students.json'
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+
+# Characters that would let a student_id escape the students directory
+_UNSAFE_ID_CHARS = {'/', '\\', '\0', os.sep, os.altsep} - {None}
+
+# Model-only FaceAttendanceSystem of a worker process, built by _init_worker
+_worker_system = None
+
+
+def _init_worker(system_options, quality_options):
+    """Load the face models once per worker process"""
+    global _worker_system
+    from face_attendance_system import FaceAttendanceSystem
+    from face_quality import QualityGate
+
+    _worker_system = FaceAttendanceSystem(
+        load_gallery=False,
+        quality_gate=QualityGate(**quality_options) if quality_options is not None else None,
+        **system_options
+    )
+
+
+def process_student(student_id, images, mode, student_dir):
+    """
+    Decode, gate and embed one student's images (runs in a worker process)
+
+    Args:
+        student_id: Student being enrolled
+        images: Encoded image bytes or base64 strings
+        mode: Detection mode
+        student_dir: Staging directory the accepted images are saved to
+
+    Returns:
+        dict: student_id, accepted embeddings, rejected_images and
+              images_processed
+    """
+    det_size, min_side = _worker_system.detection_plan(mode)
+    os.makedirs(student_dir, exist_ok=True)
+
+    embeddings, rejected_images = [], []
+    for i, img_data in enumerate(images):
+        try:
+            if isinstance(img_data, str):
+                img_data = decode_base64_image(img_data)
+            frame, _ = decode_image(img_data, min_side=min_side) if img_data else (None, 1)
+        except (binascii.Error, ValueError):
+            frame = None
+        if frame is None:
+            rejected_images.append({'index': i, 'reasons': ['undecodable']})
+            continue
+
+        embedding, reasons = _worker_system.enrollment_embedding(frame, det_size=det_size)
+        if reasons:
+            rejected_images.append({'index': i, 'reasons': reasons})
+            continue
+        cv2.imwrite(os.path.join(student_dir, f"img_{len(embeddings)+1:03d}.jpg"), frame)
+        embeddings.append(embedding)
+
+    return {
+        'student_id': student_id,
+        'embeddings': embeddings,
+        'rejected_images': rejected_images,
+        'images_processed': len(embeddings)
+    }
+
+
+def valid_student_id(student_id):
+    """Whether a student_id is safe to use as a directory name"""
+    return (student_id.strip() not in ('', '.') and '..' not in student_id
+            and not _UNSAFE_ID_CHARS.intersection(student_id))
+
+
+def publish_images(staging_dir, students_dir, student_ids):
+    """Move the staged images of committed students into their directories"""
+    for student_id in student_ids:
+        staged = os.path.join(staging_dir, student_id)
+        student_dir = os.path.join(students_dir, student_id)
+        try:
+            os.makedirs(student_dir, exist_ok=True)
+            for name in os.listdir(staged):
+                os.replace(os.path.join(staged, name), os.path.join(student_dir, name))
+        except OSError as e:
+            logger.warning(f"Could not save enrolment images of {student_id}: {e}")
+
+
+def students_from_json(payload):
+    """
+    Students of a JSON bulk payload
+
+    {"students": [{"student_id", "name", "department", "year",
+                   "images": [base64, ...]}, ...]}
+    """
+    students = []
+    for entry in payload.get('students') or []:
+        entry = dict(entry)
+        images = entry.pop('images', None) or []
+        students.append(dict(entry, images=lambda images=images: images))
+    return students
+
+
+def students_from_archive(archive):
+    """
+    Students of a zip archive laid out as <student_id>/<image>
+
+    An optional students.json at the archive root lists
+    {"student_id", "name", "department", "year"} entries. Images are read
+    from the archive only when their student is submitted to the pool.
+
+    Args:
+        archive: Open zipfile.ZipFile (must stay open while students are processed)
+    """
+    names = {}
+    for info in archive.infolist():
+        parts = posixpath.normpath(info.filename).split('/')
+        if (info.is_dir() or len(parts) != 2 or parts[0].startswith(('.', '__'))
+                or not parts[1].lower().endswith(IMAGE_EXTENSIONS)):
+            continue
+        names.setdefault(parts[0], []).append(info.filename)
+
+    metadata = {}
+    if ARCHIVE_METADATA in archive.namelist():
+        for entry in json.loads(archive.read(ARCHIVE_METADATA)):
+            metadata[str(entry.get('student_id'))] = entry
+
+    students = []
+    for student_id, files in names.items():
+        files = sorted(files)
+        students.append(dict(
+            metadata.get(student_id, {}),
+            student_id=student_id,
+            images=lambda files=files: [archive.read(name) for name in files]
+        ))
+    return students
+
+
+class BulkEnroller:
+    """
+    Process pool for enrolling many students in one request
+
+    Workers are spawned (safe with the model and server threads of the parent)
+    on the first run and kept for later runs, so the models load once per
+    worker. At most `window` students are submitted at a time, which bounds
+    the images held in memory.
+    """
+
+    def __init__(self, workers, system_options, quality_options=None, window=None):
+        """
+        Args:
+            workers: Worker processes
+            system_options: FaceAttendanceSystem keyword arguments for the
+                            workers (models, detection modes, ORT options)
+            quality_options: QualityGate keyword arguments (None disables the gate)
+            window: Students submitted at once (default 2 per worker)
+        """
+        self.workers = workers
+        self.window = window or 2 * workers
+        self.system_options = dict(system_options)
+        session_options = dict(self.system_options.get('session_options') or {})
+        if not session_options.get('intra_op_threads'):
+            # One ORT thread pool per process: share the cores instead of oversubscribing them
+            session_options['intra_op_threads'] = max(1, (os.cpu_count() or 1) // workers)
+        self.system_options['session_options'] = session_options
+        self.quality_options = quality_options
+        self._executor = None
+        self.runs = 0
+        self.students_enrolled = 0
+
+    def _pool(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker,
+                initargs=(self.system_options, self.quality_options)
+            )
+        return self._executor
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def stats(self):
+        return {
+            'workers': self.workers,
+            'window': self.window,
+            'started': self._executor is not None,
+            'runs': self.runs,
+            'students_enrolled': self.students_enrolled
+        }
+
+    def run(self, face_system, students, mode, enrolled_at):
+        """
+        Enroll students and report progress
+
+        Args:
+            face_system: FaceAttendanceSystem whose gallery is updated
+            students: Dicts with student_id, optional name / department /
+                      year and an `images` callable returning the images
+            mode: Detection mode
+            enrolled_at: Timestamp stored with every student
+
+        Yields:
+            dict: A 'start' event, one 'student' event per student (processed
+                  or failed) as each finishes, then 'committed' after the
+                  single gallery update (or 'error' if it fails)
+        """
+        # Dot-prefixed, so it is never mistaken for a student; removed however
+        # the run ends (commit, failure or the client going away)
+        staging_dir = tempfile.mkdtemp(prefix='.bulk-', dir=face_system.students_dir)
+        try:
+            yield from self._run(face_system, students, mode, enrolled_at, staging_dir)
+        finally:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+
+    def _run(self, face_system, students, mode, enrolled_at, staging_dir):
+        started = time.perf_counter()
+        total = len(students)
+        done = 0
+        self.runs += 1
+        yield {'type': 'start', 'students': total, 'workers': self.workers, 'mode': mode}
+
+        def progress(student_id, status, **fields):
+            nonlocal done
+            done += 1
+            return dict({'type': 'student', 'student_id': student_id, 'status': status,
+                         'done': done, 'total': total}, **fields)
+
+        queued, seen, metadata = [], set(), {}
+        for student in students:
+            student_id = student.get('student_id')
+            student_id = str(student_id) if student_id not in (None, '') else None
+            if student_id is None:
+                yield progress(None, 'failed', error='Missing student_id')
+            elif not valid_student_id(student_id):
+                yield progress(student_id, 'failed', error='Invalid student_id')
+            elif student_id in seen:
+                yield progress(student_id, 'failed', error='Duplicate student_id')
+            else:
+                seen.add(student_id)
+                metadata[student_id] = {
+                    'name': student.get('name') or student_id,
+                    'department': student.get('department'),
+                    'year': student.get('year'),
+                    'enrolled_at': enrolled_at
+                }
+                queued.append((student_id, student['images']))
+
+        enrolled, failed, in_flight = {}, total - len(queued), {}
+        pending = iter(queued)
+        broken = None
+        try:
+            while True:
+                # Keep the window full; images are loaded only when submitted
+                while broken is None and len(in_flight) < self.window:
+                    student_id, images = next(pending, (None, None))
+                    if student_id is None:
+                        break
+                    try:
+                        future = self._pool().submit(
+                            process_student, student_id, images(), mode,
+                            os.path.join(staging_dir, student_id)
+                        )
+                    except BrokenProcessPool as e:
+                        broken = e
+                        pending = iter([(student_id, images), *pending])
+                        break
+                    except Exception as e:
+                        failed += 1
+                        yield progress(student_id, 'failed', error=f'Could not read images: {e}')
+                        continue
+                    in_flight[future] = student_id
+                if not in_flight:
+                    break
+
+                finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    student_id = in_flight.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        if isinstance(e, BrokenProcessPool):
+                            broken = e
+                        failed += 1
+                        logger.error(f"Bulk enrolment of {student_id} failed: {e}")
+                        yield progress(student_id, 'failed', error=str(e))
+                        continue
+                    if result['embeddings']:
+                        enrolled[student_id] = (result['embeddings'], metadata[student_id])
+                        yield progress(student_id, 'processed', images_processed=result['images_processed'],
+                                       rejected_images=result['rejected_images'])
+                    else:
+                        failed += 1
+                        yield progress(student_id, 'failed', error='No valid faces found in images',
+                                       rejected_images=result['rejected_images'])
+        finally:
+            # Client went away: drop queued students (nothing has been committed)
+            # and let running ones finish before their staging directory goes
+            for future in in_flight:
+                future.cancel()
+            wait(in_flight)
+
+        if broken is not None:
+            # A worker died: the pool is recreated on the next run
+            self._executor.shutdown(wait=False)
+            self._executor = None
+            for student_id, _ in pending:
+                failed += 1
+                yield progress(student_id, 'failed', error=f'Worker pool failed: {broken}')
+
+        try:
+            if enrolled:
+                face_system.add_students(enrolled)
+        except Exception as e:
+            logger.error(f"Bulk enrolment commit failed: {e}")
+            yield {'type': 'error', 'error': str(e), 'students': 0, 'failed': total}
+            return
+        publish_images(staging_dir, face_system.students_dir, enrolled)
+
+        self.students_enrolled += len(enrolled)
+        seconds = round(time.perf_counter() - started, 3)
+        logger.info(f"Bulk enrolled {len(enrolled)} students ({failed} failed) in {seconds}s")
+        yield {'type': 'committed', 'students': len(enrolled), 'failed': failed, 'seconds': seconds}
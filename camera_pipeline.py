@@ -0,0 +1,176 @@
+"""
+Capture / inference / render pipeline for the webcam loops
+Each stage runs on its own thread (rendering stays on the calling thread, as
+OpenCV's HighGUI requires) and stages are linked by bounded latest-frame-wins
+queues, so a slow stage drops stale frames instead of backing up behind them
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+import cv2
+
+logger = logging.getLogger(__name__)
+
+
+class LatestQueue:
+    """Bounded queue that discards its oldest item when full"""
+
+    def __init__(self, maxsize=1):
+        self._items = deque(maxlen=maxsize)
+        self._ready = threading.Condition()
+        self.dropped = 0
+
+    def put(self, item):
+        with self._ready:
+            if len(self._items) == self._items.maxlen:
+                self.dropped += 1
+            self._items.append(item)
+            self._ready.notify()
+
+    def get(self, timeout=None):
+        """Oldest queued item, or None after `timeout` seconds"""
+        with self._ready:
+            if not self._ready.wait_for(lambda: self._items, timeout):
+                return None
+            return self._items.popleft()
+
+
+class StageTimer:
+    """Running per-stage latency counters"""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.worst = 0.0
+
+    def record(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.worst = max(self.worst, seconds)
+
+    def stats(self):
+        return {
+            'frames': self.count,
+            'mean_ms': round(self.total / self.count * 1000, 2) if self.count else 0.0,
+            'max_ms': round(self.worst * 1000, 2)
+        }
+
+
+class CameraPipeline:
+    """
+    Runs capture -> process -> render over a webcam
+
+    `process(frame)` runs on the inference thread and returns a result;
+    `render(frame, result)` returns the frame to display; `on_key(key, frame,
+    result)` handles key presses on the render thread and returns False to stop.
+    """
+
+    def __init__(self, process, render, window_name, camera_index=0, flip=True, queue_size=1):
+        """
+        Args:
+            process: Inference stage, frame -> result
+            render: Render stage, (frame, result) -> display frame
+            window_name: OpenCV window title
+            camera_index: cv2.VideoCapture device index
+            flip: Mirror frames horizontally
+            queue_size: Frames buffered between stages before the oldest is dropped
+        """
+        self.process = process
+        self.render = render
+        self.window_name = window_name
+        self.camera_index = camera_index
+        self.flip = flip
+        self.frames = LatestQueue(queue_size)
+        self.results = LatestQueue(queue_size)
+        self.timers = {'capture': StageTimer(), 'inference': StageTimer(), 'render': StageTimer()}
+        self._stop = threading.Event()
+
+    def stop(self):
+        self._stop.set()
+
+    def _capture(self, cap):
+        timer = self.timers['capture']
+        while not self._stop.is_set():
+            started = time.perf_counter()
+            ret, frame = cap.read()
+            if not ret:
+                logger.warning("Camera stopped delivering frames")
+                self.stop()
+                break
+            if self.flip:
+                frame = cv2.flip(frame, 1)
+            timer.record(time.perf_counter() - started)
+            self.frames.put(frame)
+
+    def _infer(self):
+        timer = self.timers['inference']
+        while not self._stop.is_set():
+            frame = self.frames.get(timeout=0.1)
+            if frame is None:
+                continue
+            started = time.perf_counter()
+            try:
+                result = self.process(frame)
+            except Exception as e:
+                logger.error(f"Inference stage failed: {e}")
+                self.stop()
+                break
+            timer.record(time.perf_counter() - started)
+            self.results.put((frame, result))
+
+    def run(self, on_key=None):
+        """
+        Run until stopped, 'q' is pressed or on_key returns False
+
+        Returns:
+            dict: Per-stage timings and dropped frame counts, or None if the
+                  camera could not be opened
+        """
+        cap = cv2.VideoCapture(self.camera_index)
+        if not cap.isOpened():
+            logger.error("Cannot open camera")
+            return None
+
+        workers = [
+            threading.Thread(target=self._capture, args=(cap,), name='pipeline-capture', daemon=True),
+            threading.Thread(target=self._infer, name='pipeline-inference', daemon=True)
+        ]
+        for worker in workers:
+            worker.start()
+
+        timer = self.timers['render']
+        shown = None
+        try:
+            while not self._stop.is_set():
+                item = self.results.get(timeout=0.05)
+                if item is not None:
+                    started = time.perf_counter()
+                    cv2.imshow(self.window_name, self.render(*item))
+                    timer.record(time.perf_counter() - started)
+                    shown = item
+
+                key = cv2.waitKey(1) & 0xFF
+                if key == ord('q'):
+                    break
+                # Key presses act on the frame currently on screen
+                if on_key and shown is not None and key != 0xFF:
+                    if on_key(key, *shown) is False:
+                        break
+        finally:
+            self.stop()
+            for worker in workers:
+                worker.join()
+            cap.release()
+            cv2.destroyAllWindows()
+
+        stats = self.stats()
+        logger.info(f"Pipeline stage timings: {stats}")
+        return stats
+
+    def stats(self):
+        """Per-stage timings plus frames dropped between stages"""
+        stats = {name: timer.stats() for name, timer in self.timers.items()}
+        stats['dropped'] = {'capture': self.frames.dropped, 'inference': self.results.dropped}
+        return stats
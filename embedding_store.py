@@ -0,0 +1,495 @@
+"""
+Memory-mapped embedding store for the Face Recognition Attendance System
+Replaces embeddings.pkl with a raw float32 matrix opened via np.memmap, a
+small JSON index of row ranges and per-student metadata, and an append-only
+journal of enrol/unenrol records that is folded into the index in the
+background
+"""
+
+import glob
+import json
+import logging
+import os
+import pickle
+import threading
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+INDEX_VERSION = 1
+
+
+def _fsync_dir(path):
+    """Persist a rename inside a directory (no-op where unsupported)"""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class EmbeddingStore:
+    """
+    Append-only float32 row file, JSON index snapshot and write-ahead journal
+
+    Each student owns a contiguous row range: the average embedding followed
+    by every individual enrolment embedding. Enrolment appends the rows and
+    then one fsynced journal record, so a request costs O(its own rows)
+    instead of rewriting every student. On load the journal is replayed on
+    top of the index. Once `compact_threshold` records accumulate, a
+    background thread checkpoints them into the index (and rewrites the data
+    file when most rows are dead). Rows past the last committed record, e.g.
+    from a crash mid-append, are truncated on open.
+    """
+
+    def __init__(self, data_dir, index_name="embeddings_index.json",
+                 journal_name="embeddings_journal.log", compact_threshold=256):
+        """
+        Args:
+            data_dir: Directory holding the store files
+            index_name: File name of the JSON index snapshot
+            journal_name: File name of the enrol/unenrol journal
+            compact_threshold: Journal records that trigger a background checkpoint
+        """
+        self.data_dir = data_dir
+        self.index_file = os.path.join(data_dir, index_name)
+        self.journal_file = os.path.join(data_dir, journal_name)
+        self.compact_threshold = compact_threshold
+        self._lock = threading.Lock()
+        self._index = None
+        self._matrix = None
+        self._journal = None
+        # Sequence number of the last journal record written or replayed
+        self._seq = 0
+        # Records in the journal not yet folded into the index
+        self._journal_records = 0
+        self._compactor = None
+
+    @property
+    def exists(self):
+        return os.path.exists(self.index_file)
+
+    @property
+    def data_file(self):
+        return os.path.join(self.data_dir, self._index['data_file'])
+
+    @property
+    def dead_rows(self):
+        """Rows in the data file no longer referenced by any student"""
+        live = sum(entry['rows'] for entry in self._index['students'].values())
+        return self._index['rows'] - live
+
+    def stats(self):
+        """Row, journal and compaction counters for health reporting"""
+        if self._index is None:
+            return {'rows': 0, 'dead_rows': 0, 'journal_records': 0, 'generation': 0, 'compacting': False}
+        return {
+            'rows': self._index['rows'],
+            'dead_rows': self.dead_rows,
+            'journal_records': self._journal_records,
+            'generation': self._index['generation'],
+            'compacting': self._compactor is not None and self._compactor.is_alive()
+        }
+
+    def load(self):
+        """
+        Open the store, replay the journal and return a student_embeddings dict
+
+        The returned embeddings are read-only views into the memory map, so
+        startup does not copy the matrix.
+        """
+        with self._lock:
+            self._open_locked()
+            self._remove_stale_files()
+            students = {sid: self._student_data(entry) for sid, entry in self._index['students'].items()}
+        self._maybe_compact()
+        return students
+
+    def put(self, student_id, student_data):
+        """Append one student's rows and journal the enrolment"""
+        return self.put_many({student_id: student_data})[student_id]
+
+    def put_many(self, students):
+        """
+        Append several students' rows and journal them together
+
+        The rows go out in one write and one fsync, and the journal records
+        share a single fsync, so bulk enrolment does not pay per-student syncs.
+
+        Args:
+            students: student_id -> student_data
+
+        Returns:
+            dict: student_id -> student_data backed by the memory map
+        """
+        if not students:
+            return {}
+        vectors = {student_id: self._rows_for(student_data) for student_id, student_data in students.items()}
+        dim = next(iter(vectors.values())).shape[1]
+        if any(rows.shape[1] != dim for rows in vectors.values()):
+            raise ValueError("Embeddings in one batch must share a dimension")
+
+        with self._lock:
+            self._ensure_open(dim)
+            if self._index['rows'] == 0:
+                self._index['dim'] = dim
+            elif dim != self._index['dim']:
+                raise ValueError(f"Embedding dimension {dim} does not match store ({self._index['dim']})")
+
+            start = self._index['rows']
+            committed = start * dim * 4
+            records = []
+            try:
+                # Write at the committed end rather than appending, so rows
+                # left over from a failed put can never shift later offsets
+                with open(self.data_file, 'r+b') as f:
+                    f.seek(committed)
+                    for student_id, rows in vectors.items():
+                        f.write(rows.tobytes())
+                        records.append({
+                            'op': 'put',
+                            'id': student_id,
+                            'start': start,
+                            'rows': len(rows),
+                            'dim': dim,
+                            'metadata': self._metadata(students[student_id])
+                        })
+                        start += len(rows)
+                    f.flush()
+                    os.fsync(f.fileno())
+
+                self._journal_locked(*records)
+            except Exception:
+                self._truncate_data(committed)
+                raise
+            self._map()
+            result = {student_id: self._student_data(self._index['students'][student_id])
+                      for student_id in students}
+        self._maybe_compact()
+        return result
+
+    def delete(self, student_id):
+        """Journal an unenrolment; the student's rows become dead space"""
+        with self._lock:
+            if self._index is None:
+                if not self.exists:
+                    return False
+                self._open_locked()
+            if student_id not in self._index['students']:
+                return False
+            self._journal_locked({'op': 'delete', 'id': student_id})
+        self._maybe_compact()
+        return True
+
+    def snapshot(self, student_embeddings):
+        """
+        Rewrite the whole store from a student_embeddings dict
+
+        Rows go to a new data file and the index switch is a single atomic
+        rename, so a crash leaves either the old or the new store intact.
+        The journal is emptied since the snapshot already contains it.
+
+        Returns:
+            dict: student_embeddings backed by the new memory map
+        """
+        with self._lock:
+            if self._index is None and self.exists:
+                self._open_locked()
+            return self._rewrite_locked(student_embeddings)
+
+    def checkpoint(self):
+        """
+        Fold journal records into the index snapshot
+
+        The index is serialized outside the lock so enrolments continue while
+        it is prepared. If most rows are dead the data file is rewritten too.
+        """
+        with self._lock:
+            if self._index is None:
+                return
+            if self.dead_rows > max(self._index['rows'] // 2, 1024):
+                students = {sid: self._student_data(entry) for sid, entry in self._index['students'].items()}
+                self._rewrite_locked(students)
+                logger.info("Compacted embedding store data file")
+                return
+            generation = self._index['generation']
+            seq = self._seq
+            index = dict(self._index, students=dict(self._index['students']), journal_seq=seq)
+
+        payload = json.dumps(index)
+
+        with self._lock:
+            # A snapshot swapped the store meanwhile; it already covers these records
+            if self._index['generation'] != generation:
+                return
+            self._index['journal_seq'] = seq
+            self._write_index(payload)
+            self._trim_journal_locked(seq)
+        logger.info(f"Checkpointed embedding journal up to record {seq}")
+
+    def close(self):
+        """Wait for a running compaction and close the journal"""
+        compactor = self._compactor
+        if compactor is not None:
+            compactor.join()
+        with self._lock:
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+
+    def migrate_pickle(self, pickle_path):
+        """
+        One-shot migration from the legacy embeddings.pkl
+
+        The pickle is renamed to *.migrated once the store is committed.
+        """
+        with open(pickle_path, 'rb') as f:
+            student_embeddings = pickle.load(f)
+
+        migrated = self.snapshot(student_embeddings)
+        os.replace(pickle_path, pickle_path + ".migrated")
+        logger.info(f"Migrated {len(migrated)} students from {pickle_path} to {self.index_file}")
+        return migrated
+
+    @staticmethod
+    def _rows_for(student_data):
+        vectors = [student_data['embedding']]
+        vectors.extend(student_data.get('all_embeddings', []))
+        return np.ascontiguousarray(np.vstack(vectors), dtype=np.float32)
+
+    @staticmethod
+    def _metadata(student_data):
+        metadata = {k: v for k, v in student_data.items() if k not in ('embedding', 'all_embeddings')}
+        # Round-trip through JSON so numpy scalars and datetimes are stored as plain values
+        return json.loads(json.dumps(metadata, default=str))
+
+    def _student_data(self, entry):
+        rows = self._matrix[entry['start']:entry['start'] + entry['rows']]
+        student_data = dict(entry['metadata'])
+        student_data['embedding'] = rows[0]
+        student_data['all_embeddings'] = list(rows[1:])
+        return student_data
+
+    def _open_locked(self):
+        with open(self.index_file, 'r') as f:
+            self._index = json.load(f)
+        self._replay_journal_locked()
+        self._truncate_uncommitted()
+        self._map()
+
+    def _ensure_open(self, dim):
+        if self._index is not None:
+            return
+        if self.exists:
+            self._open_locked()
+            return
+
+        # Brand new store
+        self._index = {
+            'version': INDEX_VERSION,
+            'generation': 1,
+            'data_file': "embeddings-000001.f32",
+            'dim': dim,
+            'rows': 0,
+            'journal_seq': 0,
+            'students': {}
+        }
+        open(self.data_file, 'wb').close()
+        self._write_index()
+
+    def _apply(self, record):
+        students = self._index['students']
+        if record['op'] == 'put':
+            students[record['id']] = {
+                'start': record['start'],
+                'rows': record['rows'],
+                'metadata': record['metadata']
+            }
+            self._index['dim'] = record['dim']
+            self._index['rows'] = max(self._index['rows'], record['start'] + record['rows'])
+        elif record['op'] == 'delete':
+            students.pop(record['id'], None)
+
+    def _journal_locked(self, *records):
+        """Append journal records with one fsync and apply them to the in-memory index"""
+        if self._journal is None:
+            self._journal = open(self.journal_file, 'ab')
+        offset = self._journal.tell()
+        try:
+            for seq, record in enumerate(records, self._seq + 1):
+                record['seq'] = seq
+                self._journal.write((json.dumps(record) + "\n").encode('utf-8'))
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+        except Exception:
+            # Drop the partly written records so they are never replayed
+            journal, self._journal = self._journal, None
+            try:
+                journal.close()
+            except OSError:
+                pass
+            try:
+                os.truncate(self.journal_file, offset)
+            except OSError as e:
+                logger.error(f"Could not roll back {self.journal_file}: {e}")
+            raise
+
+        for record in records:
+            self._seq = record['seq']
+            self._journal_records += 1
+            self._apply(record)
+
+    def _replay_journal_locked(self):
+        """Apply journal records newer than the index; drop a torn final record"""
+        self._seq = self._index.get('journal_seq', 0)
+        self._journal_records = 0
+        if not os.path.exists(self.journal_file):
+            return
+
+        good_bytes = 0
+        with open(self.journal_file, 'rb') as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                good_bytes += len(line)
+                if record['seq'] <= self._seq:
+                    continue
+                self._apply(record)
+                self._seq = record['seq']
+                self._journal_records += 1
+
+        if os.path.getsize(self.journal_file) > good_bytes:
+            logger.warning(f"Dropping torn record at the end of {self.journal_file}")
+            with open(self.journal_file, 'r+b') as f:
+                f.truncate(good_bytes)
+        if self._journal_records:
+            logger.info(f"Replayed {self._journal_records} journal records")
+
+    def _trim_journal_locked(self, seq):
+        """Rewrite the journal keeping only records newer than seq"""
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+
+        kept = []
+        if os.path.exists(self.journal_file):
+            with open(self.journal_file, 'rb') as f:
+                kept = [line for line in f if json.loads(line)['seq'] > seq]
+
+        tmp_file = self.journal_file + ".tmp"
+        with open(tmp_file, 'wb') as f:
+            f.writelines(kept)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.journal_file)
+        _fsync_dir(self.data_dir)
+        self._journal_records = len(kept)
+
+    def _rewrite_locked(self, student_embeddings):
+        """Write live rows to a new data file, switch the index, empty the journal"""
+        blocks, students, rows = [], {}, 0
+        for student_id, student_data in student_embeddings.items():
+            vectors = self._rows_for(student_data)
+            blocks.append(vectors)
+            students[student_id] = {
+                'start': rows,
+                'rows': len(vectors),
+                'metadata': self._metadata(student_data)
+            }
+            rows += len(vectors)
+
+        generation = self._index['generation'] + 1 if self._index else 1
+        dim = blocks[0].shape[1] if blocks else (self._index['dim'] if self._index else 0)
+        data_name = f"embeddings-{generation:06d}.f32"
+
+        with open(os.path.join(self.data_dir, data_name), 'wb') as f:
+            for block in blocks:
+                f.write(block.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+
+        self._index = {
+            'version': INDEX_VERSION,
+            'generation': generation,
+            'data_file': data_name,
+            'dim': dim,
+            'rows': rows,
+            'journal_seq': self._seq,
+            'students': students
+        }
+        self._write_index()
+        self._trim_journal_locked(self._seq)
+        self._map()
+        self._remove_stale_files()
+
+        return {sid: self._student_data(entry) for sid, entry in students.items()}
+
+    def _maybe_compact(self):
+        """Start a background checkpoint once the journal passes the threshold"""
+        if self._journal_records < self.compact_threshold:
+            return
+        with self._lock:
+            if self._compactor is not None and self._compactor.is_alive():
+                return
+            self._compactor = threading.Thread(target=self._compact_in_background,
+                                               name="embedding-store-compactor", daemon=True)
+            self._compactor.start()
+
+    def _compact_in_background(self):
+        try:
+            self.checkpoint()
+        except Exception as e:
+            logger.error(f"Embedding store compaction failed: {e}")
+
+    def _truncate_data(self, size):
+        """Best-effort rollback of rows written past the committed end"""
+        try:
+            with open(self.data_file, 'r+b') as f:
+                f.truncate(size)
+        except OSError as e:
+            logger.error(f"Could not roll back {self.data_file}: {e}")
+
+    def _truncate_uncommitted(self):
+        committed = self._index['rows'] * self._index['dim'] * 4
+        if not os.path.exists(self.data_file):
+            open(self.data_file, 'wb').close()
+        if os.path.getsize(self.data_file) > committed:
+            logger.warning(f"Truncating uncommitted rows from {self.data_file}")
+            with open(self.data_file, 'r+b') as f:
+                f.truncate(committed)
+
+    def _remove_stale_files(self):
+        """Delete data files left behind by earlier snapshots"""
+        for path in glob.glob(os.path.join(self.data_dir, "embeddings-*.f32")):
+            if os.path.basename(path) == self._index['data_file']:
+                continue
+            try:
+                os.remove(path)
+            except OSError as e:
+                # Still memory-mapped (Windows); retried on the next load
+                logger.debug(f"Could not remove stale data file {path}: {e}")
+
+    def _map(self):
+        rows, dim = self._index['rows'], self._index['dim']
+        if rows == 0:
+            self._matrix = np.zeros((0, dim), dtype=np.float32)
+        else:
+            self._matrix = np.memmap(self.data_file, dtype=np.float32, mode='r', shape=(rows, dim))
+
+    def _write_index(self, payload=None):
+        tmp_file = self.index_file + ".tmp"
+        with open(tmp_file, 'w') as f:
+            f.write(payload if payload is not None else json.dumps(self._index))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.index_file)
+        _fsync_dir(self.data_dir)
@@ -6,13 +6,14 @@ Provides REST endpoints for web integration
 from flask import Flask, request, jsonify, Response
 from flask_cors import CORS
 import cv2
-import base64
 import numpy as np
 import json
 import pandas as pd
 from datetime import datetime
 import os
 from face_attendance_system import FaceAttendanceSystem
+from image_io import decode_image
+from image_uploads import read_image_request, stream_images
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for web integration
@@ -52,16 +53,22 @@ def enroll_student():
     Expected payload:
     {
         "student_name": "John Doe",
+        "mode": "closeup",                  (optional, "closeup" or "classroom")
         "images": ["base64_image1", "base64_image2", ...]
     }
+    or multipart/form-data with the same fields followed by binary "images"
+    parts, or a raw image/jpeg body with the fields as query arguments
     """
     try:
-        data = request.get_json()
+        data, images = stream_images(request, 'images')
         student_name = data.get('student_name')
-        images_b64 = data.get('images', [])
+        mode = data.get('mode', 'closeup')
         
-        if not student_name or not images_b64:
+        if not student_name:
             return jsonify({'error': 'Missing student_name or images'}), 400
+        if mode not in face_system.detection_modes:
+            return jsonify({'error': f'Unknown detection mode: {mode}'}), 400
+        det_size, min_side = face_system.detection_plan(mode)
         
         # Create student directory
         student_dir = os.path.join(face_system.students_dir, student_name)
@@ -70,18 +77,17 @@ def enroll_student():
         embeddings_list = []
         saved_count = 0
         
-        for i, img_b64 in enumerate(images_b64):
+        for i, img_data in enumerate(images):
             try:
-                # Decode base64 image
-                img_data = base64.b64decode(img_b64)
-                nparr = np.frombuffer(img_data, np.uint8)
-                frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+                if not img_data:
+                    continue
+                frame, _ = decode_image(img_data, min_side=min_side)
                 
                 if frame is None:
                     continue
                 
-                # Detect faces
-                faces = face_system.app.get(frame)
+                # Detect faces (detection only; just the best face is embedded)
+                faces = face_system.detect_faces(frame, det_size=det_size)
                 
                 if len(faces) > 0:
                     # Use the best quality face
@@ -93,7 +99,7 @@ def enroll_student():
                         cv2.imwrite(img_path, frame)
                         
                         # Store embedding
-                        embeddings_list.append(best_face.embedding)
+                        embeddings_list.append(face_system.embed_face(frame, best_face))
                         saved_count += 1
                 
             except Exception as e:
@@ -102,14 +108,7 @@ def enroll_student():
         
         if saved_count > 0:
             # Average embeddings for robustness
-            avg_embedding = np.mean(embeddings_list, axis=0)
-            face_system.student_embeddings[student_name] = {
-                'embedding': avg_embedding,
-                'all_embeddings': embeddings_list,
-                'num_images': saved_count
-            }
-            
-            face_system._save_embeddings()
+            face_system.add_student(student_name, embeddings_list)
             
             return jsonify({
                 'success': True,
@@ -128,33 +127,41 @@ def recognize_face():
     Recognize face from base64 encoded image
     Expected payload:
     {
-        "image": "base64_encoded_image"
+        "image": "base64_encoded_image",
+        "mode": "classroom"             (optional, "closeup" or "classroom")
     }
+    or multipart/form-data with a binary "image" part, or a raw image/jpeg
+    body with the mode as a query argument
     """
     try:
-        data = request.get_json()
-        img_b64 = data.get('image')
+        data, img_data, _ = read_image_request(request, 'image')
+        mode = data.get('mode', 'classroom')
         
-        if not img_b64:
+        if not img_data:
             return jsonify({'error': 'Missing image data'}), 400
+        if mode not in face_system.detection_modes:
+            return jsonify({'error': f'Unknown detection mode: {mode}'}), 400
+        det_size, min_side = face_system.detection_plan(mode)
         
-        # Decode base64 image
-        img_data = base64.b64decode(img_b64)
-        nparr = np.frombuffer(img_data, np.uint8)
-        frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+        # Decode the image, downscaled to what the detection mode needs
+        frame, decode_scale = decode_image(img_data, min_side=min_side)
         
         if frame is None:
             return jsonify({'error': 'Invalid image data'}), 400
         
         # Detect faces
-        faces = face_system.app.get(frame)
+        faces = face_system.get_faces(frame, det_size=det_size)
         
         results = []
-        for face in faces:
-            # Recognize face
-            student_name, confidence = face_system.recognize_face(face.embedding)
-            
-            bbox = face.bbox.astype(int).tolist()
+        # Score every face in the frame with one gallery scan; one-to-one so
+        # two faces can't both be matched to the same student
+        matches = face_system.recognize_faces_batch(
+            [face.embedding for face in faces],
+            one_to_one=True
+        )
+        
+        for face, (student_name, confidence) in zip(faces, matches):
+            bbox = (face.bbox * decode_scale).astype(int).tolist()
             
             result = {
                 'bbox': bbox,
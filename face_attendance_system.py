@@ -8,24 +8,97 @@ import cv2
 import numpy as np
 import os
 import pandas as pd
-import pickle
 import time
 from datetime import datetime
 from collections import defaultdict, deque
 import insightface
 from insightface.app import FaceAnalysis
+from insightface.app.common import Face
 from insightface.data import get_image as ins_get_image
+from insightface.model_zoo.model_zoo import PickableInferenceSession
+from insightface.utils import face_align
+import onnxruntime as ort
 import logging
+import threading
+from face_gallery import FaceGallery, select_prototypes
+from face_index import create_index
+from embedding_store import EmbeddingStore
+from inference_batcher import MicroBatcher
+from face_tracker import FaceTracker
+from camera_pipeline import CameraPipeline
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Model pack modules actually used: landmark_3d_68, landmark_2d_106 and
+# genderage outputs are never read, so they are not loaded or run
+DEFAULT_FACE_MODULES = ('detection', 'recognition')
+
+# Detection modes: expected face height as a fraction of the image's longer
+# side. The detector input is sized so such a face covers DETECTION_FACE_PIXELS,
+# and uploads are decoded just large enough to keep it ALIGN_FACE_PIXELS tall
+# for the 112x112 ArcFace alignment.
+DETECTION_MODES = {
+    'closeup': 0.25,     # enrolment capture / selfie, one large face
+    'classroom': 0.10    # wide shot of a room, many small faces
+}
+DETECTION_FACE_PIXELS = 64
+ALIGN_FACE_PIXELS = 160
+
+GRAPH_OPTIMIZATION_LEVELS = {
+    'disable': ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+    'basic': ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    'extended': ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    'all': ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+}
+EXECUTION_MODES = {
+    'sequential': ort.ExecutionMode.ORT_SEQUENTIAL,
+    'parallel': ort.ExecutionMode.ORT_PARALLEL
+}
+
+def onnx_session_options(intra_op_threads=0, inter_op_threads=0,
+                         graph_optimization='all', execution_mode='sequential'):
+    """
+    Build ONNX Runtime session options
+    
+    Args:
+        intra_op_threads: Threads used inside one operator (0 = ORT default)
+        inter_op_threads: Threads running independent operators in parallel
+                          execution mode (0 = ORT default)
+        graph_optimization: "disable", "basic", "extended" or "all"
+        execution_mode: "sequential" or "parallel"
+    """
+    if graph_optimization not in GRAPH_OPTIMIZATION_LEVELS:
+        raise ValueError(f"Unknown graph optimization level: {graph_optimization}")
+    if execution_mode not in EXECUTION_MODES:
+        raise ValueError(f"Unknown execution mode: {execution_mode}")
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = int(intra_op_threads)
+    options.inter_op_num_threads = int(inter_op_threads)
+    options.graph_optimization_level = GRAPH_OPTIMIZATION_LEVELS[graph_optimization]
+    options.execution_mode = EXECUTION_MODES[execution_mode]
+    return options
+
 class FaceAttendanceSystem:
     def __init__(self, 
                  similarity_threshold=0.4,  # Lower threshold = stricter matching
                  presence_frames=5,         # Frames needed for presence confirmation
-                 data_dir="data"):
+                 data_dir="data",
+                 index_type="exact",        # "ivf" opts large galleries into approximate search
+                 index_options=None,
+                 storage="float32",         # "int8" for a compact scan matrix
+                 rerank_k=32,
+                 num_prototypes=None,       # Keep k representative captures per student (None = all)
+                 prototype_method="kmedoids",
+                 face_modules=DEFAULT_FACE_MODULES,
+                 detection_modes=None,      # Override the expected face scale per mode
+                 session_options=None,      # ONNX Runtime options (see onnx_session_options)
+                 batch_max_size=0,          # Micro-batch recognition across threads (0 = off)
+                 batch_max_latency=0.005,
+                 quality_gate=None,         # face_quality.QualityGate run before embedding
+                 lazy_model=False,          # Load the models on first use instead of at startup
+                 load_gallery=True):        # Open the embedding store (False for model-only workers)
         """
         Initialize the Face Recognition Attendance System
         
@@ -33,11 +106,35 @@ class FaceAttendanceSystem:
             similarity_threshold: Cosine similarity threshold for recognition
             presence_frames: Number of consecutive frames for presence confirmation
             data_dir: Directory to store student data and embeddings
+            index_type: Gallery search index ("exact" or "ivf"); IVF is
+                        approximate and falls back to exact search until the
+                        gallery reaches min_rows
+            index_options: Extra options for the index (nlist, nprobe, min_rows)
+            storage: Gallery scan matrix storage ("float32" or "int8")
+            rerank_k: Students re-ranked at full precision when storage is compact
+            num_prototypes: Enrollment captures kept per student as prototypes
+            prototype_method: Prototype selection ("kmedoids" or "farthest")
+            face_modules: InsightFace model pack modules to load
+            detection_modes: Mode name -> expected face scale, merged over
+                             DETECTION_MODES
+            session_options: Keyword arguments for onnx_session_options
+                             (threads, graph optimization, execution mode)
+            batch_max_size: Face crops that close a recognition micro-batch;
+                            0 runs recognition per caller without batching
+            batch_max_latency: Seconds a crop waits for others to batch with
+            quality_gate: QualityGate that rejects faces before embedding
+                          (None embeds every detected face)
+            lazy_model: Defer loading the face models until first use
+            load_gallery: Open the embedding store and build the gallery;
+                          worker processes that only run the models skip it
         """
         self.similarity_threshold = similarity_threshold
         self.presence_frames = presence_frames
+        self.num_prototypes = num_prototypes
+        self.prototype_method = prototype_method
         self.data_dir = data_dir
         self.students_dir = os.path.join(data_dir, "students")
+        # Legacy pickle, migrated into the memory-mapped store on first start
         self.embeddings_file = os.path.join(data_dir, "embeddings.pkl")
         self.attendance_file = os.path.join(data_dir, "attendance_log.csv")
         
@@ -46,51 +143,433 @@ class FaceAttendanceSystem:
         os.makedirs(data_dir, exist_ok=True)
         
         # Initialize face analysis model
-        self.app = None
+        self.face_modules = tuple(face_modules)
+        self.detection_modes = dict(DETECTION_MODES, **(detection_modes or {}))
+        self.session_options = session_options
+        self.quality_gate = quality_gate
+        self.recognition_batcher = None
+        if batch_max_size:
+            self.recognition_batcher = MicroBatcher(
+                self._recognize_crops,
+                max_batch=batch_max_size,
+                max_latency=batch_max_latency,
+                name='recognition-batcher'
+            )
+        self._app = None
+        self._model_lock = threading.Lock()
         self.student_embeddings = {}
+        self.store = EmbeddingStore(data_dir)
+        self.gallery = FaceGallery(
+            index=create_index(index_type, **(index_options or {})),
+            storage=storage,
+            rerank_k=rerank_k
+        )
         self.recognition_buffer = defaultdict(deque)
         self.last_attendance = {}
         
         # Initialize face analysis
-        self._initialize_face_model()
+        if not lazy_model:
+            self._initialize_face_model()
         
         # Load existing embeddings
-        self._load_embeddings()
+        if load_gallery:
+            self._load_embeddings()
         
         logger.info("Face Attendance System initialized successfully")
     
+    @property
+    def app(self):
+        """InsightFace FaceAnalysis app, loaded on first access when lazy"""
+        if self._app is None:
+            self._initialize_face_model()
+        return self._app
+    
     def _initialize_face_model(self):
         """Initialize InsightFace model with RetinaFace detector"""
-        try:
-            self.app = FaceAnalysis(providers=['CPUExecutionProvider'])
-            self.app.prepare(ctx_id=0, det_size=(640, 640))
-            logger.info("Face analysis model loaded successfully")
-        except Exception as e:
-            logger.error(f"Failed to initialize face model: {e}")
-            raise
-    
-    def _load_embeddings(self):
-        """Load pre-computed student embeddings from file"""
-        if os.path.exists(self.embeddings_file):
+        with self._model_lock:
+            if self._app is not None:
+                return
             try:
-                with open(self.embeddings_file, 'rb') as f:
-                    self.student_embeddings = pickle.load(f)
-                logger.info(f"Loaded embeddings for {len(self.student_embeddings)} students")
+                app = FaceAnalysis(
+                    allowed_modules=list(self.face_modules),
+                    providers=['CPUExecutionProvider']
+                )
+                if self.session_options:
+                    self._apply_session_options(app)
+                app.prepare(ctx_id=0, det_size=(640, 640))
+                self._app = app
+                logger.info(f"Face analysis model loaded successfully (modules: {', '.join(self.face_modules)})")
             except Exception as e:
-                logger.error(f"Failed to load embeddings: {e}")
+                logger.error(f"Failed to initialize face model: {e}")
+                raise
+    
+    def _apply_session_options(self, app):
+        """Recreate each model's inference session with the configured options"""
+        # FaceAnalysis only forwards providers to the model zoo, so the
+        # sessions are rebuilt here from the same model files
+        options = onnx_session_options(**self.session_options)
+        for model in app.models.values():
+            model.session = PickableInferenceSession(
+                model.model_file,
+                sess_options=options,
+                providers=model.session.get_providers()
+            )
+        logger.info(f"ONNX Runtime session options applied: {self.session_options}")
+    
+    def warm_up(self, iterations=2):
+        """
+        Run inference on synthetic frames so graph optimization and memory
+        arena growth happen before the first real request
+        
+        Returns:
+            dict: Warm-up report (detector sizes exercised, seconds taken)
+        """
+        started = time.perf_counter()
+        rng = np.random.default_rng(0)
+        det_sizes = sorted({self.detection_plan(mode)[0] for mode in self.detection_modes})
+        for det_size in det_sizes:
+            frame = rng.integers(0, 256, (det_size[1], det_size[0], 3), dtype=np.uint8)
+            for _ in range(iterations):
+                self.detect_faces(frame, det_size=det_size)
+        
+        recognition = self.app.models.get('recognition')
+        if recognition is not None:
+            width, height = recognition.input_size
+            crop = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+            for _ in range(iterations):
+                recognition.get_feat(crop)
+        
+        report = {
+            'iterations': iterations,
+            'det_sizes': [list(size) for size in det_sizes],
+            'seconds': round(time.perf_counter() - started, 3)
+        }
+        logger.info(f"Face models warmed up in {report['seconds']}s")
+        return report
+    
+    def detection_plan(self, mode='classroom'):
+        """
+        Detector input size and decode size for a detection mode
+        
+        Returns:
+            tuple: ((width, height) detector input, smallest longer image side
+                   worth decoding)
+        """
+        face_scale = self.detection_modes.get(mode)
+        if not face_scale:
+            raise ValueError(f"Unknown detection mode: {mode}")
+        # SCRFD needs input sides that are multiples of 32
+        side = int(np.clip(np.ceil(DETECTION_FACE_PIXELS / face_scale / 32) * 32, 160, 1280))
+        min_side = max(side, int(np.ceil(ALIGN_FACE_PIXELS / face_scale)))
+        return (side, side), min_side
+    
+    def detect_faces(self, frame, max_num=0, det_size=None):
+        """
+        Detection-only pass: boxes, keypoints and scores without embeddings
+        
+        Use embed_face on the face that is actually needed afterwards.
+        det_size overrides the detector input size for this frame.
+        """
+        bboxes, kpss = self.app.det_model.detect(frame, input_size=det_size, max_num=max_num, metric='default')
+        faces = []
+        for i in range(bboxes.shape[0]):
+            faces.append(Face(
+                bbox=bboxes[i, 0:4],
+                kps=kpss[i] if kpss is not None else None,
+                det_score=bboxes[i, 4]
+            ))
+        return faces
+    
+    def _recognize_crops(self, crops):
+        """One ArcFace forward pass over a list of aligned crops"""
+        return self.app.models['recognition'].get_feat(crops)
+    
+    def embed_faces(self, frame, faces):
+        """
+        Compute (and attach) ArcFace embeddings for detected faces
+        
+        The aligned crops go through the recognition micro-batcher when it is
+        enabled, so faces from concurrent requests share one forward pass.
+        """
+        if 'recognition' not in self.app.models:
+            raise RuntimeError("Recognition model not loaded (detection-only mode)")
+        if not faces:
+            return []
+        image_size = self.app.models['recognition'].input_size[0]
+        crops = [face_align.norm_crop(frame, landmark=face.kps, image_size=image_size) for face in faces]
+        for face, embedding in zip(faces, self._embed_crops(crops)):
+            face.embedding = embedding.flatten()
+        return [face.embedding for face in faces]
+    
+    def _embed_crops(self, crops):
+        """Embed aligned crops, through the micro-batcher when enabled"""
+        if self.recognition_batcher is not None:
+            return self.recognition_batcher(crops)
+        return self._recognize_crops(crops)
+    
+    def faces_from_aligned(self, crops):
+        """
+        Embed crops that the client already aligned to the ArcFace template
+        
+        Crops of another size are resized to the model input (112x112).
+        The returned faces carry no box, keypoints or detection score.
+        """
+        if 'recognition' not in self.app.models:
+            raise RuntimeError("Recognition model not loaded (detection-only mode)")
+        if not crops:
+            return []
+        size = tuple(self.app.models['recognition'].input_size)
+        crops = [crop if crop.shape[1::-1] == size else cv2.resize(crop, size) for crop in crops]
+        return [Face(bbox=None, kps=None, det_score=None, embedding=embedding.flatten())
+                for embedding in self._embed_crops(crops)]
+    
+    def locate_faces(self, frame, boxes):
+        """
+        Faces the client already located, without full-frame detection
+        
+        Args:
+            frame: BGR frame the boxes refer to
+            boxes: Dicts with 'bbox' (x1, y1, x2, y2), optional 'landmarks'
+                   (five (x, y) points) and optional 'score'
+        
+        Boxes without landmarks run the detector on the padded box only, at
+        the close-up input size, to find the keypoints alignment needs.
+        """
+        height, width = frame.shape[:2]
+        faces = []
+        for box in boxes:
+            bbox = np.asarray(box['bbox'], dtype=np.float32)
+            if box.get('landmarks') is not None:
+                faces.append(Face(
+                    bbox=bbox,
+                    kps=np.asarray(box['landmarks'], dtype=np.float32).reshape(5, 2),
+                    det_score=box.get('score')
+                ))
+                continue
+            
+            pad = 0.25 * max(bbox[2] - bbox[0], bbox[3] - bbox[1])
+            x1, y1 = int(max(bbox[0] - pad, 0)), int(max(bbox[1] - pad, 0))
+            x2, y2 = int(min(bbox[2] + pad, width)), int(min(bbox[3] + pad, height))
+            if x2 <= x1 or y2 <= y1:
+                continue
+            found = self.detect_faces(frame[y1:y2, x1:x2], max_num=1,
+                                      det_size=self.detection_plan('closeup')[0])
+            if found:
+                face = found[0]
+                face.bbox = face.bbox + np.array([x1, y1, x1, y1], dtype=np.float32)
+                face.kps = face.kps + np.array([x1, y1], dtype=np.float32)
+                faces.append(face)
+        return faces
+    
+    def embed_face(self, frame, face):
+        """Compute (and attach) the ArcFace embedding of one detected face"""
+        return self.embed_faces(frame, [face])[0]
+    
+    def gate_faces(self, frame, faces):
+        """
+        Run the quality gate over detected faces
+        
+        Returns:
+            tuple: (faces worth embedding, rejected faces with quality_reasons)
+        """
+        if self.quality_gate is None:
+            return list(faces), []
+        return self.quality_gate.filter(frame, faces)
+    
+    def get_faces(self, frame, max_num=0, det_size=None):
+        """
+        Detect and embed the faces in a frame (FaceAnalysis.get with a
+        per-frame det_size); faces rejected by the quality gate are dropped
+        """
+        faces = self.detect_faces(frame, max_num=max_num, det_size=det_size)
+        faces, _ = self.gate_faces(frame, faces)
+        self.embed_faces(frame, faces)
+        return faces
+    
+    def enrollment_embedding(self, frame, det_size=None, min_det_score=0.5):
+        """
+        Embedding of the best face in an enrollment image
+        
+        Returns:
+            tuple: (embedding or None, rejection reasons: 'no_face', quality
+                   reasons or 'low_detection_score')
+        """
+        faces = self.detect_faces(frame, det_size=det_size)
+        if not faces:
+            return None, ['no_face']
+        
+        best_face = max(faces, key=lambda x: x.det_score)
+        _, rejected = self.gate_faces(frame, [best_face])
+        if rejected:
+            return None, best_face.quality_reasons
+        if best_face.det_score <= min_det_score:
+            return None, ['low_detection_score']
+        return self.embed_face(frame, best_face), []
+    
+    def _load_embeddings(self):
+        """Open the memory-mapped embedding store (migrating embeddings.pkl once)"""
+        try:
+            if self.store.exists:
+                self.student_embeddings = self.store.load()
+            elif os.path.exists(self.embeddings_file):
+                self.student_embeddings = self.store.migrate_pickle(self.embeddings_file)
+            else:
                 self.student_embeddings = {}
-        else:
+            logger.info(f"Loaded embeddings for {len(self.student_embeddings)} students")
+        except Exception as e:
+            logger.error(f"Failed to load embeddings: {e}")
             self.student_embeddings = {}
+        
+        self.gallery.build(self.student_embeddings)
     
     def _save_embeddings(self):
-        """Save student embeddings to file"""
+        """Write a full snapshot of student embeddings to the store"""
         try:
-            with open(self.embeddings_file, 'wb') as f:
-                pickle.dump(self.student_embeddings, f)
+            self.student_embeddings = self.store.snapshot(self.student_embeddings)
             logger.info("Embeddings saved successfully")
         except Exception as e:
             logger.error(f"Failed to save embeddings: {e}")
     
+    def add_student(self, student_id, embeddings_list, **metadata):
+        """
+        Register (or replace) a student's embeddings and update the gallery
+        
+        Args:
+            student_id: Name or ID of the student
+            embeddings_list: Embeddings captured during enrollment
+            **metadata: Extra fields stored alongside the embeddings
+        """
+        return self.add_students({student_id: (embeddings_list, metadata)})[student_id]
+    
+    def add_students(self, students):
+        """
+        Register (or replace) many students with one store write and one
+        gallery rebuild
+        
+        Args:
+            students: student_id -> (embeddings_list, metadata dict)
+        
+        Returns:
+            dict: student_id -> stored student data
+        
+        Raises:
+            OSError: The store could not persist the students; nothing is
+                     added to the gallery
+        """
+        records = {}
+        for student_id, (embeddings_list, metadata) in students.items():
+            # Keep float32 throughout; np.mean would otherwise promote to float64
+            embeddings = np.asarray(embeddings_list, dtype=np.float32)
+            student_data = {
+                'embedding': embeddings.mean(axis=0),
+                'all_embeddings': self._prototypes(list(embeddings)),
+                'num_images': len(embeddings)
+            }
+            student_data.update(metadata)
+            records[student_id] = student_data
+        
+        # Append the rows to the store; the returned records are backed by the memory map
+        try:
+            records = self.store.put_many(records)
+        except Exception as e:
+            logger.error(f"Failed to save embeddings for {', '.join(map(str, records))}: {e}")
+            raise
+        
+        self.student_embeddings.update(records)
+        self.gallery.add_many(records)
+        return records
+    
+    def _prototypes(self, embeddings, k=None, method=None):
+        """Representative subset of a student's captures (all of them if unconfigured)"""
+        k = self.num_prototypes if k is None else k
+        if not k or len(embeddings) <= k:
+            return embeddings
+        
+        keep = select_prototypes(embeddings, k, method or self.prototype_method)
+        return [embeddings[i] for i in keep]
+    
+    def compact_prototypes(self, k=None, method=None):
+        """
+        Reduce every enrolled student to k prototypes (offline compaction)
+        
+        The average embedding is kept as is; only the individual captures are
+        reduced. The store is rewritten once and the gallery rebuilt.
+        
+        Args:
+            k: Prototypes per student (default: num_prototypes)
+            method: "kmedoids" or "farthest" (default: prototype_method)
+            
+        Returns:
+            dict: Before/after gallery rows and scan-matrix bytes
+        """
+        k = k or self.num_prototypes
+        if not k:
+            raise ValueError("Number of prototypes must be positive")
+        
+        rows_before, bytes_before = self.gallery.num_rows, self.gallery.nbytes
+        compacted = {}
+        for student_id, student_data in self.student_embeddings.items():
+            student_data = dict(student_data)
+            student_data['all_embeddings'] = self._prototypes(
+                list(student_data.get('all_embeddings', [])), k, method)
+            compacted[student_id] = student_data
+        
+        self.student_embeddings = compacted
+        self._save_embeddings()
+        self.gallery.build(self.student_embeddings)
+        
+        report = {
+            'students': len(self.student_embeddings),
+            'prototypes_per_student': k,
+            'rows_before': rows_before,
+            'rows_after': self.gallery.num_rows,
+            'bytes_before': bytes_before,
+            'bytes_after': self.gallery.nbytes
+        }
+        logger.info(f"Compacted gallery from {rows_before} to {report['rows_after']} rows "
+                    f"({bytes_before / 1e6:.1f} MB -> {report['bytes_after'] / 1e6:.1f} MB)")
+        return report
+    
+    def remove_student(self, student_id):
+        """
+        Remove a student's embeddings and drop their gallery rows
+        
+        Raises:
+            OSError: The store could not record the removal; the student
+                     stays enrolled
+        """
+        if student_id not in self.student_embeddings:
+            return False
+        
+        # Store first: a student reported as removed must not come back on restart
+        try:
+            self.store.delete(student_id)
+        except Exception as e:
+            logger.error(f"Failed to remove embeddings for {student_id}: {e}")
+            raise
+        
+        self.student_embeddings.pop(student_id, None)
+        self.gallery.remove(student_id)
+        return True
+    
+    def index_info(self):
+        """Describe the gallery search index and whether it is in use"""
+        index = self.gallery.index
+        info = {
+            'type': 'exact' if index is None else 'ivf',
+            'storage': self.gallery.storage,
+            'gallery_rows': self.gallery.num_rows,
+            'gallery_bytes': self.gallery.nbytes,
+            'active': index is not None and index.trained
+        }
+        if index is not None:
+            info.update({
+                'nprobe': index.nprobe,
+                'min_rows': index.min_rows,
+                'cells': 0 if index.centroids is None else len(index.centroids)
+            })
+        return info
+    
     def _detect_blink(self, landmarks):
         """Simple blink detection for anti-spoofing"""
         if landmarks is None or len(landmarks) < 68:
@@ -127,28 +606,13 @@ class FaceAttendanceSystem:
         student_dir = os.path.join(self.students_dir, student_name)
         os.makedirs(student_dir, exist_ok=True)
         
-        cap = cv2.VideoCapture(0)
-        if not cap.isOpened():
-            logger.error("Cannot open camera")
-            return False
-        
-        captured_count = 0
+        captured = []
         embeddings_list = []
         
         logger.info(f"Starting enrollment for {student_name}. Press 'q' to quit, 'c' to capture")
         
-        while captured_count < num_images:
-            ret, frame = cap.read()
-            if not ret:
-                break
-            
-            # Flip frame horizontally for mirror effect
-            frame = cv2.flip(frame, 1)
+        def render(frame, faces):
             display_frame = frame.copy()
-            
-            # Detect faces
-            faces = self.app.get(frame)
-            
             for face in faces:
                 # Draw rectangle around face
                 bbox = face.bbox.astype(int)
@@ -160,49 +624,52 @@ class FaceAttendanceSystem:
                            cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 1)
             
             # Show progress
-            progress_text = f"Captured: {captured_count}/{num_images} for {student_name}"
+            progress_text = f"Captured: {len(captured)}/{num_images} for {student_name}"
             cv2.putText(display_frame, progress_text, (10, 30), 
                        cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
             
             instruction_text = "Press 'c' to capture, 'q' to quit"
             cv2.putText(display_frame, instruction_text, (10, 60), 
                        cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
-            
-            cv2.imshow('Student Enrollment', display_frame)
-            
-            key = cv2.waitKey(1) & 0xFF
-            if key == ord('q'):
-                break
-            elif key == ord('c') and len(faces) > 0:
-                # Capture image with highest quality face
-                best_face = max(faces, key=lambda x: x.det_score)
-                if best_face.det_score > 0.5:  # Quality threshold
-                    # Save image
-                    img_filename = f"img_{captured_count+1:03d}.jpg"
-                    img_path = os.path.join(student_dir, img_filename)
-                    cv2.imwrite(img_path, frame)
-                    
-                    # Store embedding
-                    embeddings_list.append(best_face.embedding)
-                    captured_count += 1
-                    
-                    logger.info(f"Captured image {captured_count}/{num_images}")
-                else:
-                    logger.warning("Face quality too low, try again")
+            return display_frame
         
-        cap.release()
-        cv2.destroyAllWindows()
+        def on_key(key, frame, faces):
+            if key != ord('c') or len(faces) == 0:
+                return True
+            # Capture image with highest quality face
+            best_face = max(faces, key=lambda x: x.det_score)
+            _, rejected = self.gate_faces(frame, [best_face])
+            if rejected:
+                logger.warning(f"Face rejected ({', '.join(best_face.quality_reasons)}), try again")
+            elif best_face.det_score > 0.5:  # Quality threshold
+                # Save image
+                img_filename = f"img_{len(captured)+1:03d}.jpg"
+                img_path = os.path.join(student_dir, img_filename)
+                cv2.imwrite(img_path, frame)
+                
+                # Store embedding
+                embeddings_list.append(self.embed_face(frame, best_face))
+                captured.append(img_path)
+                
+                logger.info(f"Captured image {len(captured)}/{num_images}")
+            else:
+                logger.warning("Face quality too low, try again")
+            return len(captured) < num_images
+        
+        # Detection only for the preview (inference stage); the embedding is
+        # computed on capture
+        pipeline = CameraPipeline(self.detect_faces, render, 'Student Enrollment')
+        if pipeline.run(on_key) is None:
+            return False
+        captured_count = len(captured)
         
         if captured_count > 0:
             # Average embeddings for robustness
-            avg_embedding = np.mean(embeddings_list, axis=0)
-            self.student_embeddings[student_name] = {
-                'embedding': avg_embedding,
-                'all_embeddings': embeddings_list,
-                'num_images': captured_count
-            }
-            
-            self._save_embeddings()
+            try:
+                self.add_student(student_name, embeddings_list)
+            except Exception:
+                # Already logged; the student is not enrolled
+                return False
             logger.info(f"Successfully enrolled {student_name} with {captured_count} images")
             return True
         else:
@@ -223,35 +690,177 @@ class FaceAttendanceSystem:
         Returns:
             tuple: (student_name, confidence_score) or (None, 0)
         """
-        if not self.student_embeddings:
+        # One matrix-vector product against every stored embedding; the
+        # per-student score is the max over the average and individual rows
+        best_match, best_similarity = self.gallery.match(face_embedding)
+        if best_match is None or best_similarity <= 0:
             return None, 0
         
-        best_match = None
-        best_similarity = 0
-        
-        for student_name, student_data in self.student_embeddings.items():
-            # Compare with average embedding
-            similarity = self._cosine_similarity(face_embedding, student_data['embedding'])
-            
-            # Also compare with individual embeddings for better accuracy
-            max_individual_sim = 0
-            for individual_emb in student_data['all_embeddings']:
-                individual_sim = self._cosine_similarity(face_embedding, individual_emb)
-                max_individual_sim = max(max_individual_sim, individual_sim)
-            
-            # Use the better of the two similarities
-            final_similarity = max(similarity, max_individual_sim)
-            
-            if final_similarity > best_similarity:
-                best_similarity = final_similarity
-                best_match = student_name
-        
         # Check if similarity meets threshold
         if best_similarity >= self.similarity_threshold:
             return best_match, best_similarity
         else:
             return None, best_similarity
     
+    def candidate_students(self, student_ids=None, department=None, year=None):
+        """
+        Enrolled students that belong to a class
+        
+        An explicit roster wins; otherwise students are selected by the
+        department/year stored with their enrollment.
+        
+        Returns:
+            list: Enrolled student IDs (empty if nothing matches)
+        """
+        if student_ids:
+            return [sid for sid in student_ids if sid in self.student_embeddings]
+        
+        def same(a, b):
+            return str(a or '').strip().lower() == str(b or '').strip().lower()
+        
+        # Snapshot: enrolments may change the dict while the subset is built
+        return [
+            sid for sid, data in list(self.student_embeddings.items())
+            if (department is None or same(data.get('department'), department))
+            and (year is None or same(data.get('year'), year))
+        ]
+    
+    def search(self, face_embedding, k=5, gallery=None):
+        """
+        Top-k candidate students for one face
+        
+        Args:
+            face_embedding: Face embedding to match
+            k: Number of candidates to return
+            gallery: Optional candidate sub-gallery to search instead
+            
+        Returns:
+            dict: 'student_ids' and 'scores' (best first) and 'margin', the
+                  top-1 minus top-2 score (None with fewer than 2 candidates)
+        """
+        return self.search_batch([face_embedding], k, gallery)[0]
+    
+    def search_batch(self, face_embeddings, k=5, gallery=None):
+        """Top-k candidates for every face of a frame from one gallery scan"""
+        if len(face_embeddings) == 0:
+            return []
+        
+        gallery = self.gallery if gallery is None else gallery
+        student_ids, scores = gallery.student_score_matrix(np.vstack(face_embeddings))
+        return self._top_k(student_ids, scores, k)
+    
+    @staticmethod
+    def _top_k(student_ids, scores, k):
+        """Partial sort of a (faces, students) score matrix into per-face candidates"""
+        k = min(k, len(student_ids))
+        if k <= 0:
+            return [{'student_ids': [], 'scores': [], 'margin': None} for _ in range(scores.shape[0])]
+        
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1)
+        top = np.take_along_axis(top, order, axis=1)
+        top_scores = np.take_along_axis(top_scores, order, axis=1)
+        
+        candidates = []
+        for face_top, face_scores in zip(top, top_scores):
+            candidates.append({
+                'student_ids': [student_ids[i] for i in face_top],
+                'scores': [float(score) for score in face_scores],
+                'margin': float(face_scores[0] - face_scores[1]) if k > 1 else None
+            })
+        return candidates
+    
+    def recognize_faces_batch(self, face_embeddings, one_to_one=False,
+                              gallery=None, fallback_to_global=False, top_k=0):
+        """
+        Recognize every face of a frame with a single gallery scan
+        
+        Args:
+            face_embeddings: Sequence of face embeddings from one frame
+            one_to_one: Assign each student to at most one face, greedily by
+                        descending similarity
+            gallery: Optional candidate sub-gallery (see FaceGallery.subset)
+                     searched instead of the full gallery
+            fallback_to_global: Retry faces unmatched in `gallery` against
+                                the full gallery
+            top_k: Also return the top-k candidates of each face, taken from
+                   the same scan (see search)
+            
+        Returns:
+            list: (student_name, confidence_score) or (None, score) per face,
+                  in the same order as face_embeddings. With top_k each entry
+                  is (student_name, confidence_score, candidates).
+        """
+        results, candidates = self._match_in_gallery(
+            self.gallery if gallery is None else gallery, face_embeddings, one_to_one, top_k)
+        
+        unmatched = [i for i, (student_id, _) in enumerate(results) if student_id is None]
+        if gallery is not None and fallback_to_global and unmatched:
+            # Students already matched in the sub-gallery stay out of the retry's assignment
+            assigned = {student_id for student_id, _ in results if student_id is not None}
+            retry, retry_candidates = self._match_in_gallery(
+                self.gallery, [face_embeddings[i] for i in unmatched], one_to_one, top_k,
+                exclude=assigned if one_to_one else ())
+            for pos, (face_idx, (student_id, similarity)) in enumerate(zip(unmatched, retry)):
+                results[face_idx] = (student_id, similarity)
+                if top_k:
+                    candidates[face_idx] = retry_candidates[pos]
+        
+        if top_k:
+            return [result + (face_candidates,) for result, face_candidates in zip(results, candidates)]
+        return results
+    
+    def _match_in_gallery(self, gallery, face_embeddings, one_to_one, top_k=0, exclude=()):
+        """
+        Score faces against one gallery and apply threshold / assignment
+        
+        Args:
+            exclude: Students the one-to-one assignment must not hand out
+                     (already assigned to other faces of the frame)
+        
+        Returns:
+            tuple: (matches, candidates) where candidates is None unless top_k
+        """
+        if len(face_embeddings) == 0:
+            return [], ([] if top_k else None)
+        
+        student_ids, scores = gallery.student_score_matrix(np.vstack(face_embeddings))
+        num_faces = scores.shape[0]
+        candidates = self._top_k(student_ids, scores, top_k) if top_k else None
+        if not student_ids:
+            return [(None, 0)] * num_faces, candidates
+        
+        results = [None] * num_faces
+        if one_to_one:
+            # Greedy assignment: repeatedly take the highest remaining
+            # (face, student) pair, then retire that face and that student
+            remaining = scores.copy()
+            if exclude:
+                remaining[:, [i for i, student_id in enumerate(student_ids) if student_id in exclude]] = -np.inf
+            for _ in range(min(num_faces, len(student_ids))):
+                face_idx, student_idx = np.unravel_index(np.argmax(remaining), remaining.shape)
+                similarity = float(remaining[face_idx, student_idx])
+                if similarity < self.similarity_threshold:
+                    break
+                results[face_idx] = (student_ids[student_idx], similarity)
+                remaining[face_idx, :] = -np.inf
+                remaining[:, student_idx] = -np.inf
+        
+        best_idx = np.argmax(scores, axis=1)
+        for face_idx in range(num_faces):
+            if results[face_idx] is not None:
+                continue
+            similarity = float(scores[face_idx, best_idx[face_idx]])
+            if similarity <= 0:
+                results[face_idx] = (None, 0)
+            elif similarity >= self.similarity_threshold and not one_to_one:
+                results[face_idx] = (student_ids[best_idx[face_idx]], similarity)
+            else:
+                results[face_idx] = (None, similarity)
+        
+        return results, candidates
+    
     def log_attendance(self, student_name, confidence):
         """Log attendance to CSV file"""
         timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
@@ -283,43 +892,68 @@ class FaceAttendanceSystem:
         logger.info(f"Attendance logged for {student_name} with confidence {confidence:.2f}")
         return True
     
-    def run_recognition(self):
-        """Run real-time face recognition for attendance"""
-        cap = cv2.VideoCapture(0)
-        if not cap.isOpened():
-            logger.error("Cannot open camera")
-            return
+    def run_recognition(self, detect_every=5, reembed_every=30):
+        """
+        Run real-time face recognition for attendance
         
+        Args:
+            detect_every: Run full face detection on every N-th frame; boxes
+                          are followed with optical flow in between
+            reembed_every: Re-embed a tracked face at least every N frames
+        """
         logger.info("Starting face recognition. Press 'q' to quit")
         
-        while True:
-            ret, frame = cap.read()
-            if not ret:
-                break
-            
-            # Flip frame horizontally for mirror effect
-            frame = cv2.flip(frame, 1)
-            display_frame = frame.copy()
-            
-            # Detect faces
-            faces = self.app.get(frame)
-            
-            for face in faces:
-                bbox = face.bbox.astype(int)
+        tracker = FaceTracker(detect_every=detect_every, reembed_every=reembed_every)
+        
+        def process(frame):
+            if tracker.is_detection_frame():
+                tracks, to_embed, dropped = tracker.update(frame, self.detect_faces(frame))
+                for track in dropped:
+                    self.recognition_buffer.pop(track.track_id, None)
                 
-                # Recognize face
-                student_name, confidence = self.recognize_face(face.embedding)
+                # Only new, drifted or stale tracks are embedded and matched;
+                # faces failing the quality gate are retried on a later detection
+                to_embed = [track for track in to_embed
+                            if self.gate_faces(frame, [track.face])[0]]
+                if to_embed:
+                    embeddings = self.embed_faces(frame, [track.face for track in to_embed])
+                    matches = self.recognize_faces_batch(embeddings, one_to_one=True)
+                    for track, (student_name, confidence) in zip(to_embed, matches):
+                        if student_name != track.student_id:
+                            self.recognition_buffer.pop(track.track_id, None)
+                        track.assign(student_name, confidence, tracker.frame_index)
                 
+                # Presence confirmation counts the detection rounds a track
+                # keeps its identity
+                for track in tracks:
+                    if track.student_id and track.seen_at == tracker.frame_index:
+                        buffer = self.recognition_buffer[track.track_id]
+                        buffer.append(track.confidence)
+                        if len(buffer) > self.presence_frames:
+                            buffer.popleft()
+            else:
+                tracks, _, _ = tracker.update(frame)
+            
+            # Snapshot what the render stage draws; tracks keep changing
+            results = []
+            for track in tracks:
+                buffer = self.recognition_buffer.get(track.track_id, ())
+                confirmed = track.student_id and len(buffer) >= self.presence_frames
+                avg_confidence = np.mean(list(buffer)) if confirmed else None
+                if confirmed:
+                    # Log attendance (only once per day)
+                    self.log_attendance(track.student_id, avg_confidence)
+                results.append((track.bbox.astype(int), track.student_id, track.confidence, avg_confidence))
+            return results
+        
+        fps = [0.0, time.perf_counter()]
+        
+        def render(frame, results):
+            display_frame = frame.copy()
+            for bbox, student_name, confidence, avg_confidence in results:
                 if student_name:
-                    # Add to recognition buffer for presence confirmation
-                    self.recognition_buffer[student_name].append(confidence)
-                    if len(self.recognition_buffer[student_name]) > self.presence_frames:
-                        self.recognition_buffer[student_name].popleft()
-                    
                     # Check if consistently recognized
-                    if len(self.recognition_buffer[student_name]) >= self.presence_frames:
-                        avg_confidence = np.mean(list(self.recognition_buffer[student_name]))
-                        
+                    if avg_confidence is not None:
                         # Draw green rectangle for recognized student
                         cv2.rectangle(display_frame, (bbox[0], bbox[1]), (bbox[2], bbox[3]), (0, 255, 0), 2)
                         
@@ -327,9 +961,6 @@ class FaceAttendanceSystem:
                         text = f"{student_name} ({avg_confidence:.2f})"
                         cv2.putText(display_frame, text, (bbox[0], bbox[1]-10), 
                                    cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
-                        
-                        # Log attendance (only once per day)
-                        self.log_attendance(student_name, avg_confidence)
                     else:
                         # Draw yellow rectangle for partial recognition
                         cv2.rectangle(display_frame, (bbox[0], bbox[1]), (bbox[2], bbox[3]), (0, 255, 255), 2)
@@ -342,21 +973,21 @@ class FaceAttendanceSystem:
                                (bbox[0], bbox[1]-10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255), 1)
             
             # Display system info
+            now = time.perf_counter()
+            fps[0] = 0.9 * fps[0] + 0.1 / max(now - fps[1], 1e-6)
+            fps[1] = now
+            
             info_text = f"Students enrolled: {len(self.student_embeddings)}"
             cv2.putText(display_frame, info_text, (10, 30), 
                        cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
             
-            threshold_text = f"Threshold: {self.similarity_threshold}"
+            threshold_text = f"Threshold: {self.similarity_threshold}  FPS: {fps[0]:.1f}"
             cv2.putText(display_frame, threshold_text, (10, 60), 
                        cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
-            
-            cv2.imshow('Face Recognition Attendance', display_frame)
-            
-            if cv2.waitKey(1) & 0xFF == ord('q'):
-                break
+            return display_frame
         
-        cap.release()
-        cv2.destroyAllWindows()
+        CameraPipeline(process, render, 'Face Recognition Attendance').run()
+        self.recognition_buffer.clear()
     
     def list_enrolled_students(self):
         """List all enrolled students"""
@@ -384,7 +1015,8 @@ class FaceAttendanceSystem:
 
 def main():
     """Main application interface"""
-    system = FaceAttendanceSystem()
+    # Models load on the first enrollment / recognition, so the menu starts instantly
+    system = FaceAttendanceSystem(lazy_model=True)
     
     while True:
         print("\n" + "="*50)
@@ -395,11 +1027,12 @@ def main():
         print("3. List Enrolled Students")
         print("4. View Attendance Log")
         print("5. Adjust Similarity Threshold")
-        print("6. Exit")
+        print("6. Compact Student Prototypes")
+        print("7. Exit")
         print("-"*50)
         
         try:
-            choice = input("Enter your choice (1-6): ").strip()
+            choice = input("Enter your choice (1-7): ").strip()
             
             if choice == '1':
                 student_name = input("Enter student name/ID: ").strip()
@@ -437,6 +1070,13 @@ def main():
                     print("Invalid threshold value.")
             
             elif choice == '6':
+                k = input("Prototypes to keep per student (default 8): ").strip()
+                k = int(k) if k.isdigit() and int(k) > 0 else 8
+                report = system.compact_prototypes(k)
+                print(f"Gallery rows: {report['rows_before']} -> {report['rows_after']}")
+                print(f"Gallery size: {report['bytes_before'] / 1e6:.1f} MB -> {report['bytes_after'] / 1e6:.1f} MB")
+            
+            elif choice == '7':
                 print("Goodbye!")
                 break
             
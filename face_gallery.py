@@ -0,0 +1,535 @@
+"""
+Vectorized embedding gallery for the Face Recognition Attendance System
+Keeps every enrolled embedding in one contiguous, L2-normalized float32 matrix
+so a probe is scored against the whole gallery with a single matrix product;
+large galleries can delegate candidate search to an ANN index (face_index.py)
+and store the scan matrix as compact int8 codes
+"""
+
+import threading
+import numpy as np
+
+
+def l2_normalize(vectors):
+    """L2-normalize a vector or the rows of a matrix as float32"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def select_prototypes(embeddings, k, method='kmedoids', iterations=10):
+    """
+    Reduce a student's enrolment embeddings to k representative prototypes
+
+    Args:
+        embeddings: Sequence of enrolment embeddings
+        k: Number of prototypes to keep
+        method: "farthest" (greedy farthest-point) or "kmedoids" (farthest-point
+                seeding refined by k-medoids on cosine similarity)
+        iterations: k-medoids refinement rounds
+
+    Returns:
+        list: Indices of the selected embeddings
+    """
+    vectors = l2_normalize(np.vstack(embeddings))
+    n = len(vectors)
+    if k <= 0 or k >= n:
+        return list(range(n))
+    if method not in ('farthest', 'kmedoids'):
+        raise ValueError(f"Unknown prototype method: {method}")
+
+    similarity = vectors @ vectors.T
+
+    # Farthest-point: start from the most central capture, then repeatedly add
+    # the capture least similar to everything chosen so far
+    chosen = [int(np.argmax(similarity.sum(axis=1)))]
+    closest = similarity[chosen[0]].copy()
+    while len(chosen) < k:
+        candidate = int(np.argmin(closest))
+        chosen.append(candidate)
+        closest = np.maximum(closest, similarity[candidate])
+
+    if method == 'farthest':
+        return sorted(chosen)
+
+    medoids = np.array(chosen)
+    for _ in range(iterations):
+        assign = np.argmax(similarity[:, medoids], axis=1)
+        updated = medoids.copy()
+        for cluster in range(k):
+            members = np.flatnonzero(assign == cluster)
+            if len(members):
+                within = similarity[np.ix_(members, members)].sum(axis=1)
+                updated[cluster] = members[np.argmax(within)]
+        if np.array_equal(updated, medoids):
+            break
+        medoids = updated
+
+    return sorted(set(int(m) for m in medoids))
+
+
+# Scan matrix storage modes and their code dtype
+STORAGE_MODES = {
+    'float32': np.float32,
+    'int8': np.int8
+}
+
+# Rows converted per step when scanning compact codes; small enough that the
+# float32 staging buffer stays in cache
+SCAN_BLOCK_ROWS = 256
+
+# Smallest row capacity allocated for the scan matrix
+MIN_CAPACITY_ROWS = 64
+
+
+def quantize(vectors, storage):
+    """
+    Encode normalized float32 rows for the scan matrix
+
+    Returns:
+        tuple: (codes, scales) where row i decodes to codes[i] * scales[i]
+    """
+    scales = np.ones(vectors.shape[0], dtype=np.float32)
+    if storage == 'float32':
+        return np.ascontiguousarray(vectors, dtype=np.float32), scales
+
+    # int8 with one scale per vector
+    peak = np.abs(vectors).max(axis=1)
+    peak[peak == 0] = 1.0
+    scales = (peak / 127.0).astype(np.float32)
+    codes = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+    return codes, scales
+
+
+def dequantize(codes, scales):
+    """Decode scan-matrix rows back to float32"""
+    if codes.dtype == np.float32:
+        return codes
+    return codes.astype(np.float32) * scales[:, None]
+
+
+class FaceGallery:
+    """
+    Contiguous gallery matrix plus a row -> student index
+
+    Rows belonging to one student are stored next to each other, so the
+    per-student score is a segment max over the rows of a single
+    matrix-vector product.
+
+    The matrix is a view of the first rows of an over-allocated buffer:
+    enrolment writes into the spare capacity and publishes a longer view, and
+    unenrolment only marks the student's segment dead. Rows a published view
+    covers are never rewritten, so searches need no lock. Once dead rows make
+    up half the matrix, the live rows are compacted into a new buffer.
+
+    With int8 storage the first pass scans the codes (or the index cells,
+    which hold the same decoded rows) and only the `rerank_k` best students
+    are re-scored against their full-precision embeddings, so the reported
+    similarities stay exact for those students.
+    """
+
+    def __init__(self, index=None, storage='float32', rerank_k=32):
+        """
+        Args:
+            index: Optional ANN index (see face_index.create_index); exact
+                   search is used while it is None or untrained
+            storage: Scan matrix storage ("float32" or "int8")
+            rerank_k: Students re-ranked at full precision for compact storage
+        """
+        if storage not in STORAGE_MODES:
+            raise ValueError(f"Unknown storage mode: {storage}")
+
+        self.storage = storage
+        self.rerank_k = rerank_k
+        self._lock = threading.Lock()
+        # Published as one tuple so readers always see a consistent snapshot:
+        # (matrix, ids, counts, scales, segments, live). counts and segments
+        # (student id, None once removed) describe every row segment; ids are
+        # the enrolled students and live their segment positions (None when
+        # no segment is dead).
+        self._state = self._empty_state(0)
+        # Buffers behind the published matrix and scales views
+        self._buffer = self._state[0]
+        self._scale_buffer = self._state[3]
+        # Segment position of each enrolled student, and rows of removed ones
+        self._positions = {}
+        self._dead_rows = 0
+        # Full-precision student_data per student, used for the re-rank
+        self._sources = {}
+        # Bumped on every mutation so derived sub-galleries know when to rebuild
+        self.version = 0
+        self.index = index
+        # Stable integer codes identify students inside the index
+        self._codes = {}
+        self._code_ids = {}
+        self._next_code = 0
+
+    def _empty_state(self, dim):
+        return (np.zeros((0, dim), dtype=STORAGE_MODES[self.storage]), [],
+                np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32), [], None)
+
+    @staticmethod
+    def _student_vectors(student_data):
+        """Average embedding followed by every individual enrolment embedding"""
+        vectors = [student_data['embedding']]
+        vectors.extend(student_data.get('all_embeddings', []))
+        return l2_normalize(np.vstack(vectors))
+
+    def __len__(self):
+        return len(self._state[1])
+
+    @property
+    def num_rows(self):
+        """Rows of the enrolled students"""
+        return self._state[0].shape[0] - self._dead_rows
+
+    @property
+    def student_ids(self):
+        return list(self._state[1])
+
+    @property
+    def nbytes(self):
+        """Memory held by the scan matrix and its per-row scales (with spare capacity)"""
+        return self._buffer.nbytes + self._scale_buffer.nbytes
+
+    def build(self, student_embeddings):
+        """Rebuild the whole matrix from a student_embeddings dict"""
+        blocks, scale_blocks, ids, counts = [], [], [], []
+        for student_id, student_data in student_embeddings.items():
+            codes, scales = quantize(self._student_vectors(student_data), self.storage)
+            blocks.append(codes)
+            scale_blocks.append(scales)
+            ids.append(student_id)
+            counts.append(len(codes))
+
+        with self._lock:
+            if blocks:
+                rows = sum(counts)
+                self._allocate_locked(rows + rows // 4, blocks[0].shape[1])
+                np.concatenate(blocks, out=self._buffer[:rows])
+                np.concatenate(scale_blocks, out=self._scale_buffer[:rows])
+                self._positions = {student_id: pos for pos, student_id in enumerate(ids)}
+                self._dead_rows = 0
+                self._publish_locked(rows, ids, np.asarray(counts, dtype=np.int64))
+            else:
+                self._state = self._empty_state(0)
+                self._buffer, self._scale_buffer = self._state[0], self._state[3]
+                self._positions = {}
+                self._dead_rows = 0
+            self._sources = dict(student_embeddings)
+            self.version += 1
+            self._rebuild_index_locked()
+
+    def add(self, student_id, student_data):
+        """Insert (or replace) one student's rows"""
+        self.add_many({student_id: student_data})
+
+    def add_many(self, students):
+        """
+        Insert (or replace) several students
+
+        Their rows are appended after the current matrix; a replaced
+        student's old rows become dead. Only a full buffer is copied, into
+        one of twice the size, so enrolment is amortized O(its own rows).
+        """
+        if not students:
+            return
+        vectors = {student_id: self._student_vectors(student_data) for student_id, student_data in students.items()}
+        quantized = {student_id: quantize(rows, self.storage) for student_id, rows in vectors.items()}
+        dim = next(iter(vectors.values())).shape[1]
+        with self._lock:
+            matrix, _, counts, _, segments, _ = self._state
+            if matrix.shape[0] and dim != matrix.shape[1]:
+                raise ValueError(f"Embedding dimension {dim} does not match gallery ({matrix.shape[1]})")
+            segments = list(segments)
+            for student_id in students:
+                self._kill_locked(student_id, segments, counts)
+
+            rows = matrix.shape[0]
+            needed = rows + sum(len(codes) for codes, _ in quantized.values())
+            if needed > self._buffer.shape[0] or dim != self._buffer.shape[1]:
+                self._allocate_locked(max(needed, 2 * self._buffer.shape[0]), dim, keep_rows=rows)
+            for student_id, (codes, row_scales) in quantized.items():
+                self._buffer[rows:rows + len(codes)] = codes
+                self._scale_buffer[rows:rows + len(codes)] = row_scales
+                self._positions[student_id] = len(segments)
+                segments.append(student_id)
+                rows += len(codes)
+            counts = np.concatenate([counts, np.asarray([len(codes) for codes, _ in quantized.values()],
+                                                        dtype=np.int64)])
+            self._publish_locked(rows, segments, counts)
+            self._compact_if_sparse_locked()
+            self._sources.update(students)
+            self.version += 1
+            self._update_index_locked({student_id: dequantize(codes, row_scales)
+                                       for student_id, (codes, row_scales) in quantized.items()})
+
+    def remove(self, student_id):
+        """Drop one student's rows; returns True if the student was present"""
+        with self._lock:
+            matrix, _, counts, _, segments, _ = self._state
+            segments = list(segments)
+            present = self._kill_locked(student_id, segments, counts)
+            if present:
+                self._publish_locked(matrix.shape[0], segments, counts)
+                self._compact_if_sparse_locked()
+            self._sources.pop(student_id, None)
+            self.version += 1
+            code = self._codes.pop(student_id, None)
+            if code is not None:
+                self._code_ids.pop(code, None)
+                if self.index is not None and self.index.trained:
+                    self.index.remove(code)
+        return present
+
+    def subset(self, student_ids):
+        """
+        Exact-search gallery restricted to the given students
+
+        The rows are copied out of the current matrix, so no embedding is
+        re-normalized. Unknown student ids are ignored.
+        """
+        state = self._state
+        matrix, scales = state[0], state[3]
+        wanted = set(student_ids)
+
+        rows, sub_ids, sub_counts = [], [], []
+        for student_id, start, count in self._live_segments(state):
+            if student_id in wanted:
+                rows.append(np.arange(start, start + count))
+                sub_ids.append(student_id)
+                sub_counts.append(count)
+
+        sub = FaceGallery(storage=self.storage, rerank_k=self.rerank_k)
+        if sub_ids:
+            rows = np.concatenate(rows)
+            sub._buffer = np.ascontiguousarray(matrix[rows])
+            sub._scale_buffer = scales[rows]
+            sub._positions = {student_id: pos for pos, student_id in enumerate(sub_ids)}
+            sub._publish_locked(len(rows), sub_ids, np.asarray(sub_counts, dtype=np.int64))
+            sub._sources = {sid: self._sources[sid] for sid in sub_ids if sid in self._sources}
+        sub.version = self.version
+        return sub
+
+    @staticmethod
+    def _live_segments(state):
+        """(student_id, first row, row count) of each enrolled student in a state"""
+        counts, segments = state[2], state[4]
+        start = 0
+        for student_id, count in zip(segments, counts):
+            if student_id is not None:
+                yield student_id, start, int(count)
+            start += int(count)
+
+    def _allocate_locked(self, capacity, dim, keep_rows=0):
+        """Switch to new buffers, copying the first keep_rows rows over"""
+        capacity = max(capacity, MIN_CAPACITY_ROWS)
+        buffer = np.empty((capacity, dim), dtype=STORAGE_MODES[self.storage])
+        scale_buffer = np.empty(capacity, dtype=np.float32)
+        if keep_rows:
+            buffer[:keep_rows] = self._buffer[:keep_rows]
+            scale_buffer[:keep_rows] = self._scale_buffer[:keep_rows]
+        self._buffer, self._scale_buffer = buffer, scale_buffer
+
+    def _publish_locked(self, rows, segments, counts):
+        """Publish the first `rows` buffer rows with their segment layout"""
+        if self._dead_rows:
+            live = np.flatnonzero([student_id is not None for student_id in segments])
+            ids = [segments[pos] for pos in live]
+        else:
+            live, ids = None, segments
+        self._state = (self._buffer[:rows], ids, counts, self._scale_buffer[:rows], segments, live)
+
+    def _kill_locked(self, student_id, segments, counts):
+        """Mark a student's segment dead in `segments`; returns True if enrolled"""
+        pos = self._positions.pop(student_id, None)
+        if pos is None:
+            return False
+        segments[pos] = None
+        self._dead_rows += int(counts[pos])
+        return True
+
+    def _compact_if_sparse_locked(self):
+        """Copy the live rows into new buffers once half the matrix is dead"""
+        matrix, scales = self._state[0], self._state[3]
+        if not self._dead_rows or 2 * self._dead_rows < matrix.shape[0]:
+            return
+
+        live_segments = list(self._live_segments(self._state))
+        rows = matrix.shape[0] - self._dead_rows
+        buffer = np.empty((max(rows + rows // 4, MIN_CAPACITY_ROWS), matrix.shape[1]), dtype=matrix.dtype)
+        scale_buffer = np.empty(buffer.shape[0], dtype=np.float32)
+        offset = 0
+        for _, start, count in live_segments:
+            buffer[offset:offset + count] = matrix[start:start + count]
+            scale_buffer[offset:offset + count] = scales[start:start + count]
+            offset += count
+        self._buffer, self._scale_buffer = buffer, scale_buffer
+        ids = [student_id for student_id, _, _ in live_segments]
+        self._positions = {student_id: pos for pos, student_id in enumerate(ids)}
+        self._dead_rows = 0
+        self._publish_locked(rows, ids, np.asarray([count for _, _, count in live_segments], dtype=np.int64))
+
+    def _code_for(self, student_id):
+        code = self._codes.get(student_id)
+        if code is None:
+            code = self._next_code
+            self._next_code += 1
+            self._codes[student_id] = code
+            self._code_ids[code] = student_id
+        return code
+
+    def _rebuild_index_locked(self):
+        """
+        (Re)train the index on the current matrix once it is large enough
+
+        The new index is trained and filled while searches keep using the old
+        one, then published with a single reference swap.
+        """
+        if self.index is None:
+            return
+
+        state = self._state
+        matrix, scales = state[0], state[3]
+        index = self.index.untrained_copy()
+        if self.num_rows >= index.min_rows:
+            segments = list(self._live_segments(state))
+            rows = np.concatenate([np.arange(start, start + count) for _, start, count in segments])
+            vectors = dequantize(matrix[rows], scales[rows])
+            index.train(vectors)
+            offset = 0
+            for student_id, _, count in segments:
+                index.add(self._code_for(student_id), vectors[offset:offset + count])
+                offset += count
+        self.index = index
+
+    def _update_index_locked(self, vectors):
+        """
+        Incrementally insert students, retraining when the gallery outgrows the cells
+
+        Args:
+            vectors: student_id -> decoded scan-matrix rows, the same rows a
+                     rebuild would insert
+        """
+        if self.index is None:
+            return
+
+        if not self.index.trained or self.num_rows > 4 * self.index.trained_rows:
+            self._rebuild_index_locked()
+            return
+
+        for student_id, rows in vectors.items():
+            code = self._code_for(student_id)
+            self.index.remove(code)
+            self.index.add(code, rows)
+
+    def student_scores(self, face_embedding):
+        """
+        Best cosine similarity per student for one probe
+
+        Returns:
+            tuple: (student_ids, scores) with scores aligned to student_ids
+        """
+        ids, scores = self.student_score_matrix(face_embedding)
+        return ids, scores[0]
+
+    def student_score_matrix(self, face_embeddings):
+        """
+        Best cosine similarity per (face, student) for a batch of probes
+
+        With a trained index only the candidate students found by the index
+        are returned; otherwise every enrolled student is scored exactly.
+
+        Returns:
+            tuple: (student_ids, scores) with scores shaped (num_faces, num_students)
+        """
+        matrix, ids, counts, scales, _, live = self._state
+        # Rebuilds swap in a new index, so read the reference once
+        index = self.index
+        probes = l2_normalize(np.atleast_2d(face_embeddings))
+        if not ids:
+            return [], np.zeros((probes.shape[0], 0), dtype=np.float32)
+
+        if index is not None and index.trained:
+            return self._index_score_matrix(index, probes)
+
+        # One matrix-matrix product scores every face against every row
+        row_scores = self._scan(matrix, scales, probes)
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        scores = np.maximum.reduceat(row_scores, starts, axis=0).T
+        if live is not None:
+            # Drop the dead segments of removed students
+            scores = scores[:, live]
+        if matrix.dtype != np.float32:
+            self._rerank(ids, scores, probes)
+        return ids, scores
+
+    @staticmethod
+    def _scan(matrix, scales, probes):
+        """Row scores (num_rows, num_probes) for the stored codes"""
+        if matrix.dtype == np.float32:
+            return matrix @ probes.T
+
+        # Decode a block of codes at a time into a small float32 buffer
+        # rather than materializing the whole float32 matrix
+        num_rows = matrix.shape[0]
+        row_scores = np.empty((num_rows, probes.shape[0]), dtype=np.float32)
+        buffer = np.empty((min(SCAN_BLOCK_ROWS, num_rows), matrix.shape[1]), dtype=np.float32)
+        probes_t = np.ascontiguousarray(probes.T)
+        for start in range(0, num_rows, SCAN_BLOCK_ROWS):
+            block = matrix[start:start + SCAN_BLOCK_ROWS]
+            staged = buffer[:len(block)]
+            staged[...] = block
+            np.dot(staged, probes_t, out=row_scores[start:start + len(block)])
+        row_scores *= scales[:, None]
+        return row_scores
+
+    def _rerank(self, ids, scores, probes):
+        """Replace approximate scores of each probe's top students with exact ones"""
+        k = min(self.rerank_k, len(ids))
+        if k <= 0:
+            return
+
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        for col in np.unique(top):
+            student_data = self._sources.get(ids[col])
+            if student_data is None:
+                continue
+            exact = (self._student_vectors(student_data) @ probes.T).max(axis=0)
+            rows = np.any(top == col, axis=1)
+            scores[rows, col] = exact[rows]
+
+    def _index_score_matrix(self, index, probes):
+        """Per-student max over the candidate rows returned by the index"""
+        candidates = index.search(probes)
+        all_codes = np.unique(np.concatenate([codes for codes, _ in candidates]))
+        # Drop students removed while the search was running
+        all_codes = np.array([code for code in all_codes if code in self._code_ids], dtype=np.int64)
+        if len(all_codes) == 0:
+            return [], np.zeros((probes.shape[0], 0), dtype=np.float32)
+
+        scores = np.full((probes.shape[0], len(all_codes)), -1.0, dtype=np.float32)
+        for row, (codes, row_scores) in enumerate(candidates):
+            cols = np.searchsorted(all_codes, codes)
+            valid = (cols < len(all_codes)) & (all_codes[np.minimum(cols, len(all_codes) - 1)] == codes)
+            np.maximum.at(scores[row], cols[valid], row_scores[valid])
+
+        ids = [self._code_ids.get(code) for code in all_codes]
+        if self.storage != 'float32':
+            self._rerank(ids, scores, probes)
+        return ids, scores
+
+    def match(self, face_embedding):
+        """
+        Best matching student for one probe
+
+        Returns:
+            tuple: (student_id, similarity) or (None, 0) for an empty gallery
+        """
+        ids, scores = self.student_scores(face_embedding)
+        if not ids:
+            return None, 0
+
+        best = int(np.argmax(scores))
+        return ids[best], float(scores[best])
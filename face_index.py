@@ -0,0 +1,166 @@
+"""
+Approximate nearest-neighbour indexes for large enrolment galleries
+Pure NumPy implementation so no extra native dependency is required
+"""
+
+import logging
+import threading
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class IVFIndex:
+    """
+    Inverted-file index over L2-normalized embeddings
+
+    Rows are clustered with spherical k-means into `nlist` coarse cells. A
+    query is only compared against the rows of its `nprobe` closest cells, so
+    `nprobe` is the recall-vs-latency knob: raising it scans more cells and
+    approaches exact search. Galleries smaller than `min_rows` are left to the
+    caller's exact search.
+    """
+
+    def __init__(self, nlist=None, nprobe=8, min_rows=4096, train_iters=8,
+                 max_train_samples=65536, seed=0):
+        """
+        Args:
+            nlist: Number of coarse cells (default: sqrt of the gallery rows)
+            nprobe: Cells scanned per query; higher = better recall, slower
+            min_rows: Below this many rows the index stays untrained
+            train_iters: k-means iterations used when (re)training
+            max_train_samples: Rows sampled for k-means training
+            seed: Random seed for reproducible training
+        """
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.min_rows = min_rows
+        self.train_iters = train_iters
+        self.max_train_samples = max_train_samples
+        self.seed = seed
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Forget the trained cells and every stored row"""
+        with self._lock:
+            # Centroids and cells are published as one tuple so readers never
+            # pair new centroids with old cells; each cell is itself one
+            # (vectors, codes) tuple so vectors and codes always match
+            self._layout = (None, [])
+            self.trained_rows = 0
+            self._code_cells = {}
+
+    def untrained_copy(self):
+        """Empty index with the same settings, to be trained and filled off to the side"""
+        return IVFIndex(nlist=self.nlist, nprobe=self.nprobe, min_rows=self.min_rows,
+                        train_iters=self.train_iters, max_train_samples=self.max_train_samples,
+                        seed=self.seed)
+
+    @property
+    def centroids(self):
+        return self._layout[0]
+
+    @property
+    def trained(self):
+        return self._layout[0] is not None
+
+    def __len__(self):
+        return sum(len(codes) for _, codes in self._layout[1])
+
+    def train(self, vectors):
+        """
+        Learn coarse cells with spherical k-means on (a sample of) vectors
+
+        Training empties the index. Searches running meanwhile see either the
+        old cells or the new, empty ones; to retrain an index that serves
+        searches, train an untrained_copy() and swap it in once filled.
+        """
+        num_rows = vectors.shape[0]
+        nlist = self.nlist or int(np.clip(np.sqrt(num_rows), 16, 4096))
+        nlist = min(nlist, num_rows)
+
+        rng = np.random.default_rng(self.seed)
+        if num_rows > self.max_train_samples:
+            sample = vectors[rng.choice(num_rows, self.max_train_samples, replace=False)]
+        else:
+            sample = vectors
+
+        centroids = sample[rng.choice(sample.shape[0], nlist, replace=False)].copy()
+        for _ in range(self.train_iters):
+            assign = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, sample)
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            # Empty cells keep their previous centroid
+            filled = norms[:, 0] > 0
+            centroids[filled] = sums[filled] / norms[filled]
+
+        dim = centroids.shape[1]
+        cells = [(np.zeros((0, dim), dtype=np.float32), np.zeros(0, dtype=np.int64))
+                 for _ in range(nlist)]
+        with self._lock:
+            self._layout = (np.ascontiguousarray(centroids, dtype=np.float32), cells)
+            self.trained_rows = num_rows
+            self._code_cells = {}
+        logger.info(f"Trained IVF index with {nlist} cells on {sample.shape[0]} rows")
+
+    def add(self, code, vectors):
+        """Insert the rows of one student, identified by an integer code"""
+        with self._lock:
+            centroids, cells = self._layout
+            assign = np.argmax(vectors @ centroids.T, axis=1)
+            code_cells = self._code_cells.setdefault(code, set())
+            for cell in np.unique(assign):
+                cell_vectors, cell_codes = cells[cell]
+                rows = vectors[assign == cell]
+                cells[cell] = (np.vstack([cell_vectors, rows]),
+                               np.append(cell_codes, np.full(len(rows), code, dtype=np.int64)))
+                code_cells.add(int(cell))
+
+    def remove(self, code):
+        """Delete every row stored for one student code"""
+        with self._lock:
+            cells = self._layout[1]
+            for cell in self._code_cells.pop(code, ()):
+                cell_vectors, cell_codes = cells[cell]
+                keep = cell_codes != code
+                cells[cell] = (cell_vectors[keep], cell_codes[keep])
+
+    def search(self, probes):
+        """
+        Candidate rows for each probe from its nprobe closest cells
+
+        Args:
+            probes: L2-normalized query matrix (num_probes, dim)
+
+        Returns:
+            list: (codes, scores) arrays per probe
+        """
+        centroids, cells = self._layout
+        if centroids is None:
+            return [(np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)) for _ in probes]
+        nprobe = max(1, min(self.nprobe, len(cells)))
+        centroid_scores = probes @ centroids.T
+        nearest = np.argpartition(-centroid_scores, nprobe - 1, axis=1)[:, :nprobe]
+
+        results = []
+        for probe, probe_cells in zip(probes, nearest):
+            codes = [cells[cell][1] for cell in probe_cells]
+            scores = [cells[cell][0] @ probe for cell in probe_cells]
+            results.append((np.concatenate(codes), np.concatenate(scores)))
+        return results
+
+
+def create_index(index_type="exact", **options):
+    """
+    Build the gallery index for a configured index type
+
+    Returns:
+        An index instance, or None for exact (brute-force) search
+    """
+    if index_type in (None, "exact"):
+        return None
+    if index_type == "ivf":
+        return IVFIndex(**options)
+    raise ValueError(f"Unknown index type: {index_type}")
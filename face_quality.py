@@ -0,0 +1,116 @@
+"""
+Pre-embedding face quality gate
+Cheap checks (size, sharpness, exposure, pose) that reject faces which would
+never match before they reach the embedding model and the gallery scan
+"""
+
+import threading
+from collections import Counter
+import cv2
+import numpy as np
+
+QUALITY_REASONS = ('too_small', 'blurry', 'too_dark', 'too_bright', 'pose')
+
+
+class QualityGate:
+    """
+    Rejects detected faces that are too small, blurry, badly exposed or turned
+
+    Sharpness is the variance of the Laplacian of the face crop resized to
+    112x112, so it does not depend on how large the face is in the frame.
+    Pose comes from the five detector keypoints: roll is the angle of the eye
+    line, yaw the nose's offset from the eye midpoint along that line as a
+    fraction of the eye distance.
+    """
+
+    def __init__(self, min_face_size=32, min_sharpness=25.0, min_brightness=40,
+                 max_brightness=220, max_yaw=0.5, max_roll=30.0):
+        """
+        Args:
+            min_face_size: Smallest face side in pixels
+            min_sharpness: Minimum Laplacian variance of the 112x112 face crop
+            min_brightness: Minimum mean grey level of the face
+            max_brightness: Maximum mean grey level of the face
+            max_yaw: Maximum nose offset from the eye midpoint (fraction of eye distance)
+            max_roll: Maximum eye-line tilt in degrees
+        """
+        self.min_face_size = min_face_size
+        self.min_sharpness = min_sharpness
+        self.min_brightness = min_brightness
+        self.max_brightness = max_brightness
+        self.max_yaw = max_yaw
+        self.max_roll = max_roll
+        self._lock = threading.Lock()
+        self.checked = 0
+        self.rejections = Counter()
+        self.rejected = 0
+
+    def check(self, frame, face):
+        """
+        Quality problems of one face
+
+        Returns:
+            list: Rejection reasons (see QUALITY_REASONS); empty when the face passes
+        """
+        reasons = []
+        height, width = frame.shape[:2]
+        x1, y1, x2, y2 = np.clip(face.bbox.astype(int), 0, [width, height, width, height])
+        if min(x2 - x1, y2 - y1) < self.min_face_size:
+            reasons.append('too_small')
+
+        if x2 > x1 and y2 > y1:
+            crop = frame[y1:y2, x1:x2]
+            gray = crop if crop.ndim == 2 else cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY)
+            gray = cv2.resize(gray, (112, 112), interpolation=cv2.INTER_AREA)
+            if cv2.Laplacian(gray, cv2.CV_64F).var() < self.min_sharpness:
+                reasons.append('blurry')
+            brightness = gray.mean()
+            if brightness < self.min_brightness:
+                reasons.append('too_dark')
+            elif brightness > self.max_brightness:
+                reasons.append('too_bright')
+
+        if face.kps is not None and self._bad_pose(np.asarray(face.kps, dtype=np.float32)):
+            reasons.append('pose')
+        return reasons
+
+    def _bad_pose(self, kps):
+        left_eye, right_eye, nose = kps[0], kps[1], kps[2]
+        eye_line = right_eye - left_eye
+        eye_distance = float(np.linalg.norm(eye_line))
+        if eye_distance < 1e-6:
+            return True
+        roll = np.degrees(np.arctan2(eye_line[1], eye_line[0]))
+        yaw = np.dot(nose - (left_eye + right_eye) / 2, eye_line / eye_distance) / eye_distance
+        return abs(roll) > self.max_roll or abs(yaw) > self.max_yaw
+
+    def filter(self, frame, faces):
+        """
+        Split faces into those worth embedding and those rejected
+
+        Rejected faces get their reasons attached as `face.quality_reasons`.
+
+        Returns:
+            tuple: (accepted faces, rejected faces)
+        """
+        accepted, rejected = [], []
+        for face in faces:
+            reasons = self.check(frame, face)
+            face.quality_reasons = reasons
+            (rejected if reasons else accepted).append(face)
+
+        with self._lock:
+            self.checked += len(faces)
+            self.rejected += len(rejected)
+            for face in rejected:
+                self.rejections.update(face.quality_reasons)
+        return accepted, rejected
+
+    def stats(self):
+        """Per-reason rejection counters (a face can fail several checks)"""
+        with self._lock:
+            return {
+                'checked': self.checked,
+                'rejected': self.rejected,
+                'reasons': {reason: self.rejections[reason] for reason in QUALITY_REASONS}
+            }
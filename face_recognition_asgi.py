@@ -0,0 +1,283 @@
+"""
+Asyncio (ASGI) entry point for the Face Recognition Microservice
+Serves the same routes as face_recognition_service.py. /recognize runs its
+CPU-bound inference on the service's bounded inference pool and marks attendance
+with an async HTTP client, so a slow main server no longer holds an inference
+thread. Every other route is served by the Flask app through a WSGI bridge.
+It also adds the /recognize/stream WebSocket, which the Flask server cannot
+serve.
+
+Run with: python face_recognition_asgi.py
+      or: uvicorn face_recognition_asgi:app --host 0.0.0.0 --port 5001
+"""
+
+import asyncio
+import binascii
+import contextlib
+import json
+import os
+import httpx
+import uvicorn
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse
+from starlette.routing import Mount, Route, WebSocketRoute
+from starlette.websockets import WebSocketDisconnect
+from werkzeug.test import EnvironBuilder
+from werkzeug.wrappers import Request as WerkzeugRequest
+
+import face_recognition_service as service
+from image_uploads import decode_base64_image, form_bool, read_image_request
+from recognition_stream import RecognitionStream
+
+logger = service.logger
+
+# Threads serving the bridged Flask routes (enroll, sessions, settings, ...)
+WSGI_WORKERS = int(os.getenv('FACE_WSGI_WORKERS', '8'))
+# Streaming recognition: full detection every N frames, optical flow in between
+STREAM_DETECT_EVERY = int(os.getenv('FACE_STREAM_DETECT_EVERY', '3'))
+STREAM_REEMBED_EVERY = int(os.getenv('FACE_STREAM_REEMBED_EVERY', '15'))
+
+http_client = None
+
+
+def _recognize_sync(method, path, query_string, content_type, body):
+    """Parse the buffered request body and run the CPU-bound recognition"""
+    environ = EnvironBuilder(path=path, method=method, query_string=query_string,
+                             content_type=content_type, data=body).get_environ()
+    try:
+        data, img_data, files = read_image_request(WerkzeugRequest(environ), 'image')
+    except (ValueError, binascii.Error) as e:
+        raise service.RecognizeError('Invalid image data') from e
+    return service.analyze_recognition(data, img_data, files)
+
+
+async def mark_attendance(session_id, student_id, confidence, department, year):
+    """Async counterpart of service.mark_attendance_in_main_system"""
+    try:
+        response = await http_client.post(
+            '/attendance/face-recognition',
+            json=service.attendance_payload(session_id, student_id, confidence, department, year)
+        )
+        return service.attendance_result(session_id, student_id, response)
+    except httpx.HTTPError as e:
+        logger.error(f"Network error marking attendance: {e}")
+        return {
+            'success': False,
+            'error': f"Network error: {str(e)}"
+        }
+    except Exception as e:
+        logger.error(f"Unexpected error marking attendance: {e}")
+        return {
+            'success': False,
+            'error': f"Unexpected error: {str(e)}"
+        }
+
+
+async def recognize(request):
+    """Recognize faces and mark attendance (same payloads as the Flask route)"""
+    body = await request.body()
+    try:
+        (payload, mark), queue_wait = await asyncio.wrap_future(service.inference_pool.submit(
+            _recognize_sync,
+            request.method,
+            request.url.path,
+            request.url.query,
+            request.headers.get('content-type'),
+            body
+        ))
+    except service.RecognizeError as e:
+        return JSONResponse({'error': str(e)}, status_code=e.status)
+    except service.PoolSaturated as e:
+        return JSONResponse({
+            'error': 'overloaded',
+            'message': 'Face recognition is at capacity, please retry shortly',
+            'retry_after': e.retry_after
+        }, status_code=503, headers={'Retry-After': str(e.retry_after)})
+    except Exception as e:
+        logger.error(f"Recognition error: {e}")
+        return JSONResponse({'error': str(e)}, status_code=500)
+
+    payload['processing']['queue_wait_ms'] = round(queue_wait * 1000, 2)
+    if mark:
+        if service.attendance_queue is not None:
+            result = service.submit_attendance(**mark)
+        else:
+            # Awaiting the main server frees the inference thread meanwhile
+            result = await mark_attendance(**mark)
+        payload = service.complete_recognition(payload, mark, result)
+    return JSONResponse(payload)
+
+
+async def stream_attendance(stream, session, student_id, confidence, track_id):
+    """Mark a student confirmed on a stream; returns the attendance event"""
+    event = {'type': 'attendance', 'student_id': student_id, 'track_id': track_id}
+    if service.session_manager.is_student_recognized(stream.session_id, student_id):
+        stream.mark_sent(student_id, {'success': True})
+        return dict(event, success=True, already_marked=True,
+                    message=f'Student {student_id} already marked present in this session')
+
+    mark = {
+        'session_id': stream.session_id,
+        'student_id': student_id,
+        'confidence': confidence,
+        'department': session['department'],
+        'year': session['year']
+    }
+    if service.attendance_queue is not None:
+        result = service.submit_attendance(**mark)
+    else:
+        result = await mark_attendance(**mark)
+    stream.mark_sent(student_id, result)
+    return service.complete_recognition(dict(event, confidence=confidence), mark, result)
+
+
+def settled_stream_marks(stream):
+    """'attendance_result' events of the stream's queued marks that have settled"""
+    events = []
+    for student_id, mark_id in stream.queued_marks():
+        outcome = service.attendance_queue.status(mark_id)
+        if outcome is not None and outcome['status'] == 'pending':
+            continue
+        # An unknown mark (outcome evicted) is resent; the main system dedupes
+        outcome = outcome or {'status': 'failed', 'error': 'Unknown mark id'}
+        marked = outcome['status'] == 'marked'
+        stream.mark_sent(student_id, {'success': marked})
+        events.append({
+            'type': 'attendance_result',
+            'student_id': student_id,
+            'mark_id': mark_id,
+            'success': marked,
+            'attendance_status': outcome['status'],
+            'marked_at': outcome.get('marked_at'),
+            'error': None if marked else outcome.get('error') or outcome.get('message')
+        })
+    return events
+
+
+async def recognize_stream(websocket):
+    """
+    Streaming recognition over a WebSocket
+    Connect to /recognize/stream?session_id=...&mode=classroom and send
+    camera frames as binary JPEG/PNG messages (or text {"image": base64}).
+    Each frame is answered with a "frame" event (tracked faces and timings);
+    "recognized" and "attendance" events are pushed when a student is first
+    confirmed on the stream. A queued (pending) mark is followed and its
+    outcome pushed as an "attendance_result" event; a student whose mark
+    failed or was rejected is marked again once re-confirmed. Frames refused
+    by the inference pool get an "overloaded" event with retry_after and are
+    dropped.
+    """
+    session_id = websocket.query_params.get('session_id')
+    mode = websocket.query_params.get('mode') or service.FACE_RECOGNIZE_MODE
+    await websocket.accept()
+
+    session = service.session_manager.get_session(session_id) if session_id else None
+    error = None
+    if not service.FACE_RECOGNITION_AVAILABLE or not service.face_system:
+        error = 'Face recognition system is not available'
+    elif not session or not session['active']:
+        error = 'Invalid or inactive session'
+    elif mode not in service.face_system.detection_modes:
+        error = f'Unknown detection mode: {mode}'
+    if error:
+        await websocket.send_json({'type': 'error', 'message': error})
+        await websocket.close(code=1008)
+        return
+
+    fallback_to_global = form_bool(websocket.query_params.get('fallback_to_global', session['fallback_to_global']))
+    stream = RecognitionStream(
+        service.face_system,
+        session_id,
+        mode,
+        lambda: service.session_manager.get_candidate_gallery(session_id),
+        fallback_to_global=fallback_to_global,
+        detect_every=STREAM_DETECT_EVERY,
+        reembed_every=STREAM_REEMBED_EVERY
+    )
+    await websocket.send_json({'type': 'ready', 'session_id': session_id, 'mode': mode,
+                               'detect_every': STREAM_DETECT_EVERY})
+
+    try:
+        while True:
+            message = await websocket.receive()
+            if message['type'] == 'websocket.disconnect':
+                break
+            if not session['active']:
+                await websocket.send_json({'type': 'error', 'message': 'Session closed'})
+                await websocket.close(code=1000)
+                break
+            data = message.get('bytes')
+            if data is None:
+                try:
+                    data = decode_base64_image(json.loads(message.get('text') or '{}')['image'])
+                except (ValueError, KeyError, TypeError, binascii.Error):
+                    await websocket.send_json({'type': 'error', 'message': 'Invalid image data'})
+                    continue
+
+            try:
+                (event, confirmed), queue_wait = await asyncio.wrap_future(
+                    service.inference_pool.submit(stream.process, data))
+            except service.PoolSaturated as e:
+                await websocket.send_json({'type': 'overloaded', 'retry_after': e.retry_after})
+                continue
+            except ValueError as e:
+                await websocket.send_json({'type': 'error', 'message': str(e)})
+                continue
+
+            event['processing']['queue_wait_ms'] = round(queue_wait * 1000, 2)
+            await websocket.send_json(event)
+            if service.attendance_queue is not None:
+                for result in settled_stream_marks(stream):
+                    await websocket.send_json(result)
+            for student_id, confidence, track_id in confirmed:
+                await websocket.send_json({'type': 'recognized', 'student_id': student_id,
+                                           'confidence': confidence, 'track_id': track_id})
+                await websocket.send_json(await stream_attendance(stream, session, student_id,
+                                                                  confidence, track_id))
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        logger.error(f"Recognition stream error: {e}")
+        with contextlib.suppress(Exception):
+            await websocket.send_json({'type': 'error', 'message': str(e)})
+            await websocket.close(code=1011)
+    logger.info(f"Recognition stream for session {session_id} closed after {stream.frames} frames")
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    global http_client
+    # Only a serving process loads the models; spawned bulk enrolment workers
+    # re-import this script as __mp_main__ and never reach the lifespan
+    service.init_service()
+    http_client = httpx.AsyncClient(
+        base_url=service.MAIN_SERVER_URL,
+        timeout=httpx.Timeout(service.MAIN_SERVER_READ_TIMEOUT, connect=service.MAIN_SERVER_CONNECT_TIMEOUT),
+        limits=httpx.Limits(max_keepalive_connections=service.MAIN_SERVER_POOL_SIZE)
+    )
+    try:
+        yield
+    finally:
+        await http_client.aclose()
+
+
+app = Starlette(
+    routes=[
+        Route('/recognize', recognize, methods=['POST']),
+        WebSocketRoute('/recognize/stream', recognize_stream),
+        Mount('/', app=WSGIMiddleware(service.app, workers=WSGI_WORKERS))
+    ],
+    # Same browser origins as the Flask app, which only covers the bridged routes
+    middleware=[Middleware(CORSMiddleware, allow_origins=service.CORS_ORIGINS,
+                           allow_methods=['*'], allow_headers=['*'])],
+    lifespan=lifespan
+)
+
+if __name__ == '__main__':
+    logger.info("Starting Face Recognition Microservice (asyncio)...")
+    logger.info(f"Microservice running on http://localhost:{service.SERVICE_PORT}")
+    logger.info(f"Main system URL: {service.MAIN_SERVER_URL}")
+    uvicorn.run(app, host='0.0.0.0', port=service.SERVICE_PORT)
@@ -7,7 +7,7 @@ Integrates with existing Node.js/Express attendance system
 from flask import Flask, request, jsonify, Response
 from flask_cors import CORS
 import cv2
-import base64
+import binascii
 import numpy as np
 import json
 import pandas as pd
@@ -16,8 +16,21 @@ import os
 import threading
 import time
 import requests
-from concurrent.futures import ThreadPoolExecutor
 import logging
+import io
+import shutil
+import tempfile
+import zipfile
+from frame_cache import FrameCache, frame_hash
+from image_io import decode_image, image_dimensions
+from face_quality import QualityGate
+from http_client import PooledHTTPClient
+from attendance_queue import AttendanceQueue
+from inference_pool import InferencePool, PoolSaturated
+from image_uploads import (read_image_request, stream_images, decode_base64_image, form_bool, form_json,
+                           iter_multipart, upload_kind, CHUNK_SIZE)
+from bulk_enrollment import (BulkEnroller, publish_images, students_from_archive, students_from_json,
+                             valid_student_id)
 
 # Configure logging first
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -38,32 +51,124 @@ except Exception as e:
     FACE_RECOGNITION_AVAILABLE = False
     FaceAttendanceSystem = None
 
+# Browser origins allowed to call the service (shared with the ASGI entry point)
+CORS_ORIGINS = ["http://localhost:5173", "http://localhost:3000", "http://localhost:4000"]
+
 app = Flask(__name__)
-CORS(app, origins=["http://localhost:5173", "http://localhost:3000", "http://localhost:4000"])
+CORS(app, origins=CORS_ORIGINS)
+
+# Gallery search index: "exact" (default) or the approximate, opt-in "ivf",
+# and the IVF recall-vs-latency knob
+FACE_INDEX_TYPE = os.getenv('FACE_INDEX_TYPE', 'exact')
+FACE_INDEX_NPROBE = int(os.getenv('FACE_INDEX_NPROBE', '8'))
+# Gallery scan matrix storage: "float32" or "int8" (re-ranked at full precision)
+FACE_GALLERY_STORAGE = os.getenv('FACE_GALLERY_STORAGE', 'float32')
+# Enrollment captures kept per student as prototypes (0 = keep all, the
+# default; pruning captures trades recall for a smaller gallery)
+FACE_NUM_PROTOTYPES = int(os.getenv('FACE_NUM_PROTOTYPES', '0'))
+# InsightFace model pack modules to load (landmarks / genderage are unused)
+FACE_MODEL_MODULES = [m.strip() for m in os.getenv('FACE_MODEL_MODULES', 'detection,recognition').split(',') if m.strip()]
+# Expected face height (fraction of the image) per detection mode; drives the
+# detector input size and how far uploads are downscaled while decoding
+FACE_DETECTION_MODES = {
+    'closeup': float(os.getenv('FACE_CLOSEUP_FACE_SCALE', '0.25')),
+    'classroom': float(os.getenv('FACE_CLASSROOM_FACE_SCALE', '0.10'))
+}
+FACE_ENROLL_MODE = os.getenv('FACE_ENROLL_MODE', 'closeup')
+FACE_RECOGNIZE_MODE = os.getenv('FACE_RECOGNIZE_MODE', 'classroom')
+# Pre-embedding quality gate (FACE_QUALITY_GATE=0 embeds every detected face)
+FACE_QUALITY_GATE = os.getenv('FACE_QUALITY_GATE', '1') == '1'
+FACE_QUALITY_OPTIONS = {
+    'min_face_size': int(os.getenv('FACE_QUALITY_MIN_FACE_SIZE', '32')),
+    'min_sharpness': float(os.getenv('FACE_QUALITY_MIN_SHARPNESS', '25')),
+    'min_brightness': float(os.getenv('FACE_QUALITY_MIN_BRIGHTNESS', '40')),
+    'max_brightness': float(os.getenv('FACE_QUALITY_MAX_BRIGHTNESS', '220')),
+    'max_yaw': float(os.getenv('FACE_QUALITY_MAX_YAW', '0.5')),
+    'max_roll': float(os.getenv('FACE_QUALITY_MAX_ROLL', '30'))
+}
+# ONNX Runtime session tuning (0 threads = ORT default)
+FACE_ORT_OPTIONS = {
+    'intra_op_threads': int(os.getenv('FACE_ORT_INTRA_OP_THREADS', '0')),
+    'inter_op_threads': int(os.getenv('FACE_ORT_INTER_OP_THREADS', '0')),
+    'graph_optimization': os.getenv('FACE_ORT_GRAPH_OPTIMIZATION', 'all'),
+    'execution_mode': os.getenv('FACE_ORT_EXECUTION_MODE', 'sequential')
+}
+# Recognition micro-batching across concurrent requests (max size 0 = off)
+FACE_BATCH_MAX_SIZE = int(os.getenv('FACE_BATCH_MAX_SIZE', '32'))
+FACE_BATCH_MAX_LATENCY_MS = float(os.getenv('FACE_BATCH_MAX_LATENCY_MS', '5'))
+# Synthetic inferences per model run before /health reports ready (0 = skip)
+FACE_WARMUP_ITERATIONS = int(os.getenv('FACE_WARMUP_ITERATIONS', '2'))
+# Worker processes for /enroll/bulk and the most students one request may enroll
+FACE_BULK_ENROLL_WORKERS = int(os.getenv('FACE_BULK_ENROLL_WORKERS', str(min(4, os.cpu_count() or 1))))
+FACE_BULK_ENROLL_MAX_STUDENTS = int(os.getenv('FACE_BULK_ENROLL_MAX_STUDENTS', '1000'))
 
-# Initialize face recognition system (if available)
+# Face recognition system, loaded by init_service()
 face_system = None
-if FACE_RECOGNITION_AVAILABLE:
+
+# Warm the models up in the background; /health reports "warming_up" until done
+warmup_status = {'ready': True, 'report': None}
+
+def warm_up_face_system():
     try:
-        face_system = FaceAttendanceSystem(
-            similarity_threshold=0.4,
-            presence_frames=3,  # Reduced for faster response
-            data_dir="data"
-        )
-        logger.info("Face recognition system initialized successfully")
+        warmup_status['report'] = face_system.warm_up(FACE_WARMUP_ITERATIONS)
     except Exception as e:
-        logger.error(f"Failed to initialize face recognition system: {e}")
-        FACE_RECOGNITION_AVAILABLE = False
-        face_system = None
-else:
-    logger.warning("Face recognition system is not available - service running in limited mode")
+        logger.error(f"Model warm-up failed: {e}")
+        warmup_status['report'] = {'error': str(e)}
+    warmup_status['ready'] = True
+
+# All detection / embedding runs on a bounded pool; requests past the queue
+# depth are refused with 503 + Retry-After instead of oversubscribing the CPU
+inference_pool = InferencePool(
+    workers=int(os.getenv('FACE_INFERENCE_WORKERS', '4')),
+    queue_depth=int(os.getenv('FACE_INFERENCE_QUEUE_DEPTH', '16'))
+)
 
-# Thread pool for concurrent processing
-executor = ThreadPoolExecutor(max_workers=4)
+# Bulk enrolment fans students out over worker processes, one run at a time
+bulk_enroller = BulkEnroller(
+    FACE_BULK_ENROLL_WORKERS,
+    system_options={
+        'data_dir': "data",
+        'face_modules': FACE_MODEL_MODULES,
+        'detection_modes': FACE_DETECTION_MODES,
+        'session_options': FACE_ORT_OPTIONS
+    },
+    quality_options=FACE_QUALITY_OPTIONS if FACE_QUALITY_GATE else None
+)
+bulk_enroll_lock = threading.Lock()
+
+def overloaded_response(error):
+    """503 telling the client when to retry a request refused by the inference pool"""
+    response = jsonify({
+        'error': 'overloaded',
+        'message': 'Face recognition is at capacity, please retry shortly',
+        'retry_after': error.retry_after
+    })
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response, 503
 
 # Configuration
 MAIN_SERVER_URL = os.getenv('MAIN_SERVER_URL', 'http://localhost:3000')
+MAIN_SERVER_POOL_SIZE = int(os.getenv('MAIN_SERVER_POOL_SIZE', '10'))
+MAIN_SERVER_CONNECT_TIMEOUT = float(os.getenv('MAIN_SERVER_CONNECT_TIMEOUT', '2'))
+MAIN_SERVER_READ_TIMEOUT = float(os.getenv('MAIN_SERVER_READ_TIMEOUT', '5'))
 SERVICE_PORT = int(os.getenv('FACE_SERVICE_PORT', '5001'))
+# Write-behind attendance marks: answer "pending" and deliver in batches (0 = mark synchronously)
+ATTENDANCE_WRITE_BEHIND = os.getenv('FACE_ATTENDANCE_WRITE_BEHIND', '1') == '1'
+ATTENDANCE_QUEUE_OPTIONS = {
+    'spool_file': os.getenv('FACE_ATTENDANCE_SPOOL', os.path.join('data', 'attendance_spool.jsonl')),
+    'batch_size': int(os.getenv('FACE_ATTENDANCE_BATCH_SIZE', '50')),
+    'flush_interval': float(os.getenv('FACE_ATTENDANCE_FLUSH_MS', '200')) / 1000,
+    'max_attempts': int(os.getenv('FACE_ATTENDANCE_MAX_ATTEMPTS', '8')),
+    'backoff_max': float(os.getenv('FACE_ATTENDANCE_BACKOFF_MAX', '30'))
+}
+
+# Keep-alive connections to the main system, shared by all request threads
+main_server = PooledHTTPClient(
+    MAIN_SERVER_URL,
+    pool_size=MAIN_SERVER_POOL_SIZE,
+    connect_timeout=MAIN_SERVER_CONNECT_TIMEOUT,
+    read_timeout=MAIN_SERVER_READ_TIMEOUT
+)
 
 class RecognitionSession:
     """Manages active recognition sessions"""
@@ -71,12 +176,16 @@ class RecognitionSession:
         self.sessions = {}
         self.lock = threading.Lock()
     
-    def create_session(self, session_id, course_id, department, year):
+    def create_session(self, session_id, course_id, department, year,
+                       roster=None, fallback_to_global=False):
         with self.lock:
             self.sessions[session_id] = {
                 'course_id': course_id,
                 'department': department,
                 'year': year,
+                'roster': list(roster) if roster else None,
+                'fallback_to_global': fallback_to_global,
+                'candidate_gallery': None,
                 'created_at': datetime.now(),
                 'recognized_students': set(),
                 'active': True
@@ -87,6 +196,38 @@ class RecognitionSession:
         with self.lock:
             return self.sessions.get(session_id)
     
+    def get_candidate_gallery(self, session_id):
+        """
+        Sub-gallery of the session's class (roster, else department + year)
+        
+        Built on first use and rebuilt whenever the global gallery changes.
+        When no enrolled student matches, the gallery is empty and nothing is
+        recognized unless the caller falls back to the global gallery.
+        Returns None only for an unknown session.
+        """
+        with self.lock:
+            session = self.sessions.get(session_id)
+            if not session:
+                return None
+            
+            gallery = session['candidate_gallery']
+            if gallery is not None and gallery.version == face_system.gallery.version:
+                return gallery
+            
+            candidates = face_system.candidate_students(
+                student_ids=session['roster'],
+                department=session['department'],
+                year=session['year']
+            )
+            gallery = face_system.gallery.subset(candidates)
+            session['candidate_gallery'] = gallery
+            logger.info(f"Session {session_id} candidate gallery: {len(gallery)} of "
+                        f"{len(face_system.gallery)} enrolled students")
+            if not len(gallery):
+                logger.warning(f"No enrolled student matches session {session_id}; only "
+                               f"fallback_to_global requests will recognize anyone")
+            return gallery
+    
     def add_recognized_student(self, session_id, student_id):
         with self.lock:
             if session_id in self.sessions:
@@ -94,6 +235,11 @@ class RecognitionSession:
                 return True
         return False
     
+    def discard_recognized_student(self, session_id, student_id):
+        with self.lock:
+            if session_id in self.sessions:
+                self.sessions[session_id]['recognized_students'].discard(student_id)
+    
     def is_student_recognized(self, session_id, student_id):
         with self.lock:
             session = self.sessions.get(session_id)
@@ -108,6 +254,104 @@ class RecognitionSession:
 # Global session manager
 session_manager = RecognitionSession()
 
+def attendance_delivered(mark, outcome):
+    """Write-behind result: let a later frame retry marks the main system did not record"""
+    if outcome['status'] == 'marked':
+        logger.info(f"Successfully marked attendance for {mark['studentId']} in session {mark['sessionId']}")
+        return
+    session_manager.discard_recognized_student(mark['sessionId'], mark['studentId'])
+    logger.warning(f"Queued attendance for {mark['studentId']} in session {mark['sessionId']} "
+                   f"{outcome['status']}: {outcome.get('error') or outcome.get('message')}")
+
+attendance_queue = None
+
+_service_lock = threading.Lock()
+_service_started = False
+
+def init_service():
+    """
+    Load the face models and gallery, start the warm-up and the attendance queue
+    
+    Run by the entry points (this script, the ASGI lifespan) and otherwise on
+    the first request. Importing the module starts nothing, so spawned bulk
+    enrolment workers that re-import the entry script never load the gallery
+    or replay the attendance spool.
+    """
+    global face_system, FACE_RECOGNITION_AVAILABLE, attendance_queue, _service_started
+    with _service_lock:
+        if _service_started:
+            return
+        _service_started = True
+        
+        if FACE_RECOGNITION_AVAILABLE:
+            try:
+                face_system = FaceAttendanceSystem(
+                    similarity_threshold=0.4,
+                    presence_frames=3,  # Reduced for faster response
+                    data_dir="data",
+                    index_type=FACE_INDEX_TYPE,
+                    index_options={'nprobe': FACE_INDEX_NPROBE},
+                    storage=FACE_GALLERY_STORAGE,
+                    num_prototypes=FACE_NUM_PROTOTYPES or None,
+                    face_modules=FACE_MODEL_MODULES,
+                    detection_modes=FACE_DETECTION_MODES,
+                    session_options=FACE_ORT_OPTIONS,
+                    batch_max_size=FACE_BATCH_MAX_SIZE,
+                    batch_max_latency=FACE_BATCH_MAX_LATENCY_MS / 1000,
+                    quality_gate=QualityGate(**FACE_QUALITY_OPTIONS) if FACE_QUALITY_GATE else None
+                )
+                logger.info("Face recognition system initialized successfully")
+            except Exception as e:
+                logger.error(f"Failed to initialize face recognition system: {e}")
+                FACE_RECOGNITION_AVAILABLE = False
+                face_system = None
+        else:
+            logger.warning("Face recognition system is not available - service running in limited mode")
+        
+        if face_system is not None and FACE_WARMUP_ITERATIONS > 0:
+            warmup_status['ready'] = False
+            threading.Thread(target=warm_up_face_system, name='face-warmup', daemon=True).start()
+        
+        if ATTENDANCE_WRITE_BEHIND:
+            os.makedirs(os.path.dirname(ATTENDANCE_QUEUE_OPTIONS['spool_file']) or '.', exist_ok=True)
+            attendance_queue = AttendanceQueue(
+                main_server,
+                on_result=attendance_delivered,
+                **ATTENDANCE_QUEUE_OPTIONS
+            ).start()
+
+@app.before_request
+def ensure_service_started():
+    # Covers WSGI servers that import the app without running an entry point
+    if not _service_started:
+        init_service()
+
+# Near-duplicate frame cache: reuse detection + embeddings for repeated frames
+frame_cache = FrameCache(
+    max_entries=int(os.getenv('FACE_FRAME_CACHE_SIZE', '8')),
+    ttl=float(os.getenv('FACE_FRAME_CACHE_TTL', '2.0')),
+    max_distance=int(os.getenv('FACE_FRAME_CACHE_DISTANCE', '8'))
+)
+
+def decode_upload(img_data, mode):
+    """
+    Decode an uploaded image no larger than the detection mode needs
+    
+    Returns:
+        tuple: (frame or None, processing info with the decode scale and timings)
+    """
+    det_size, min_side = face_system.detection_plan(mode)
+    started = time.perf_counter()
+    frame, scale = decode_image(img_data, min_side=min_side)
+    processing = {
+        'mode': mode,
+        'original_size': image_dimensions(img_data),
+        'decode_scale': scale,
+        'det_size': list(det_size),
+        'decode_ms': round((time.perf_counter() - started) * 1000, 2)
+    }
+    return frame, processing
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
@@ -120,11 +364,28 @@ def health_check():
     
     if face_system:
         response['enrolled_students'] = len(face_system.student_embeddings)
+        response['embedding_store'] = face_system.store.stats()
+        if face_system.recognition_batcher is not None:
+            response['recognition_batching'] = face_system.recognition_batcher.stats()
+        if face_system.quality_gate is not None:
+            response['quality_gate'] = face_system.quality_gate.stats()
     else:
         response['enrolled_students'] = 0
         response['warning'] = 'Face recognition system not initialized. Install insightface to enable face recognition features.'
     
     response['active_sessions'] = len([s for s in session_manager.sessions.values() if s['active']])
+    response['frame_cache'] = frame_cache.stats()
+    response['inference_pool'] = inference_pool.stats()
+    response['bulk_enrollment'] = bulk_enroller.stats()
+    response['main_server_http'] = main_server.stats()
+    if attendance_queue is not None:
+        response['attendance_queue'] = attendance_queue.stats()
+    response['ready'] = warmup_status['ready']
+    response['warmup'] = warmup_status['report']
+    
+    if not warmup_status['ready']:
+        response['status'] = 'warming_up'
+        return jsonify(response), 503
     
     return jsonify(response)
 
@@ -153,6 +414,24 @@ def get_enrolled_students():
         'threshold': face_system.similarity_threshold
     })
 
+def analyze_enrollment_image(img_data, mode, det_size):
+    """
+    Decode one enrolment image and embed its best face (runs on the inference pool)
+    
+    Returns:
+        tuple: (frame or None if undecodable, embedding or None, rejection
+               reasons, decode_ms, detect_ms)
+    """
+    frame, processing = decode_upload(img_data, mode)
+    if frame is None:
+        return None, None, [], processing['decode_ms'], 0.0
+    
+    # Detect, gate and embed the best face
+    started = time.perf_counter()
+    embedding, reasons = face_system.enrollment_embedding(frame, det_size=det_size)
+    detect_ms = (time.perf_counter() - started) * 1000
+    return frame, embedding, reasons, processing['decode_ms'], detect_ms
+
 @app.route('/enroll', methods=['POST'])
 def enroll_student():
     """
@@ -161,8 +440,14 @@ def enroll_student():
     {
         "student_id": "CS2021001",
         "name": "John Doe", 
+        "department": "Computer Science",   (optional, used for session candidate galleries)
+        "year": "4th Year",                 (optional)
+        "mode": "closeup",                  (optional, "closeup" or "classroom")
         "images": ["base64_image1", "base64_image2", ...]
     }
+    or multipart/form-data with the same fields followed by binary "images"
+    parts (processed one part at a time as they stream in), or a single raw
+    image/jpeg body with the fields as query arguments
     """
     if not FACE_RECOGNITION_AVAILABLE or not face_system:
         return jsonify({
@@ -171,64 +456,80 @@ def enroll_student():
             'details': 'Install insightface: pip install insightface (requires Microsoft Visual C++ Build Tools on Windows)'
         }), 503
     
+    staging_dir = None
     try:
-        data = request.get_json()
+        data, images = stream_images(request, 'images')
         student_id = data.get('student_id')
         student_name = data.get('name', student_id)
-        images_b64 = data.get('images', [])
+        department = data.get('department')
+        year = data.get('year')
+        mode = data.get('mode') or FACE_ENROLL_MODE
         
-        if not student_id or not images_b64:
+        if not student_id:
             return jsonify({'error': 'Missing student_id or images'}), 400
+        if not valid_student_id(student_id):
+            return jsonify({'error': 'Invalid student_id'}), 400
+        if mode not in face_system.detection_modes:
+            return jsonify({'error': f'Unknown detection mode: {mode}'}), 400
+        det_size, _ = face_system.detection_plan(mode)
         
-        # Create student directory
-        student_dir = os.path.join(face_system.students_dir, student_id)
-        os.makedirs(student_dir, exist_ok=True)
+        # Images are staged and moved into the student directory only once the
+        # student is enrolled, so a failed or refused request leaves nothing behind
+        staging_dir = tempfile.mkdtemp(prefix='.enroll-', dir=face_system.students_dir)
+        student_dir = os.path.join(staging_dir, student_id)
+        os.makedirs(student_dir)
         
         embeddings_list = []
         saved_count = 0
+        rejected_images = []
+        decode_ms = detect_ms = queue_wait_ms = 0.0
         
-        for i, img_b64 in enumerate(images_b64):
+        images_received = 0
+        for i, img_data in enumerate(images):
+            images_received += 1
             try:
-                # Decode base64 image
-                img_data = base64.b64decode(img_b64)
-                nparr = np.frombuffer(img_data, np.uint8)
-                frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+                if not img_data:
+                    continue
+                (frame, embedding, reasons, image_decode_ms, image_detect_ms), queue_wait = inference_pool.run(
+                    analyze_enrollment_image, img_data, mode, det_size
+                )
+                queue_wait_ms += queue_wait * 1000
                 
                 if frame is None:
                     continue
+                decode_ms += image_decode_ms
+                detect_ms += image_detect_ms
                 
-                # Detect faces
-                faces = face_system.app.get(frame)
-                
-                if len(faces) > 0:
-                    # Use the best quality face
-                    best_face = max(faces, key=lambda x: x.det_score)
-                    if best_face.det_score > 0.5:
-                        # Save image
-                        img_filename = f"img_{saved_count+1:03d}.jpg"
-                        img_path = os.path.join(student_dir, img_filename)
-                        cv2.imwrite(img_path, frame)
-                        
-                        # Store embedding
-                        embeddings_list.append(best_face.embedding)
-                        saved_count += 1
+                if reasons:
+                    rejected_images.append({'index': i, 'reasons': reasons})
+                else:
+                    # Save image
+                    img_filename = f"img_{saved_count+1:03d}.jpg"
+                    img_path = os.path.join(student_dir, img_filename)
+                    cv2.imwrite(img_path, frame)
+                    
+                    # Store embedding
+                    embeddings_list.append(embedding)
+                    saved_count += 1
                 
+            except PoolSaturated:
+                # Nothing is committed or saved until every image is processed; the client retries
+                raise
             except Exception as e:
                 logger.error(f"Error processing image {i} for {student_id}: {e}")
                 continue
         
         if saved_count > 0:
             # Average embeddings for robustness
-            avg_embedding = np.mean(embeddings_list, axis=0)
-            face_system.student_embeddings[student_id] = {
-                'embedding': avg_embedding,
-                'all_embeddings': embeddings_list,
-                'num_images': saved_count,
-                'name': student_name,
-                'enrolled_at': datetime.now().isoformat()
-            }
-            
-            face_system._save_embeddings()
+            face_system.add_student(
+                student_id,
+                embeddings_list,
+                name=student_name,
+                department=department,
+                year=year,
+                enrolled_at=datetime.now().isoformat()
+            )
+            publish_images(staging_dir, face_system.students_dir, [student_id])
             
             logger.info(f"Successfully enrolled {student_id} ({student_name}) with {saved_count} images")
             
@@ -237,14 +538,193 @@ def enroll_student():
                 'message': f'Successfully enrolled {student_name}',
                 'student_id': student_id,
                 'images_processed': saved_count,
-                'threshold': face_system.similarity_threshold
+                'rejected_images': rejected_images,
+                'threshold': face_system.similarity_threshold,
+                'processing': {
+                    'mode': mode,
+                    'det_size': list(det_size),
+                    'decode_ms': round(decode_ms, 2),
+                    'detect_ms': round(detect_ms, 2),
+                    'queue_wait_ms': round(queue_wait_ms, 2)
+                }
             })
+        elif images_received == 0:
+            return jsonify({'error': 'Missing student_id or images'}), 400
         else:
-            return jsonify({'error': 'No valid faces found in images'}), 400
+            return jsonify({
+                'error': 'No valid faces found in images',
+                'rejected_images': rejected_images
+            }), 400
             
+    except PoolSaturated as e:
+        return overloaded_response(e)
     except Exception as e:
         logger.error(f"Enrollment error: {e}")
         return jsonify({'error': str(e)}), 500
+    finally:
+        if staging_dir is not None:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+
+def read_bulk_enrollment(request):
+    """
+    Parse a bulk enrolment request
+    
+    Returns:
+        tuple: (fields dict, students, archive upload file to close once
+               the students are processed, or None)
+    """
+    kind = upload_kind(request)
+    if kind == 'json' and request.mimetype not in ('application/zip', 'application/x-zip-compressed'):
+        fields = request.get_json() or {}
+        return fields, students_from_json(fields), None
+    
+    fields = request.args.to_dict()
+    if kind == 'multipart':
+        upload = None
+        for name, filename, data in iter_multipart(request):
+            if filename is None:
+                fields[name] = data.decode('utf-8')
+            elif name == 'archive':
+                upload = io.BytesIO(data)
+        if upload is None:
+            raise ValueError('Missing "archive" part')
+    else:
+        # Raw zip body: spooled to disk, images are read as students are submitted
+        upload = tempfile.TemporaryFile()
+        shutil.copyfileobj(request.stream, upload, CHUNK_SIZE)
+        upload.seek(0)
+    try:
+        return fields, students_from_archive(zipfile.ZipFile(upload)), upload
+    except Exception:
+        upload.close()
+        raise
+
+@app.route('/enroll/bulk', methods=['POST'])
+def enroll_students_bulk():
+    """
+    Enroll many students in one request
+    Expected payload:
+    {
+        "mode": "closeup",                  (optional, "closeup" or "classroom")
+        "students": [
+            {"student_id": "CS2021001", "name": "John Doe", "department": "...",
+             "year": "...", "images": ["base64_image1", ...]},
+            ...
+        ]
+    }
+    or a zip archive of <student_id>/<image> files (optional students.json
+    list of metadata at the root), sent as a raw application/zip body with
+    "mode" as a query argument or as the multipart "archive" part
+    
+    Students are processed on worker processes and the gallery is updated
+    once at the end. The response streams one JSON object per line: a
+    "start" event, a "student" event per student (processed / failed) and a
+    final "committed" or "error" event.
+    """
+    if not FACE_RECOGNITION_AVAILABLE or not face_system:
+        return jsonify({
+            'error': 'face_recognition_unavailable',
+            'message': 'Face recognition system is not available. Please install required dependencies.'
+        }), 503
+    
+    if not bulk_enroll_lock.acquire(blocking=False):
+        return jsonify({'error': 'bulk_enrollment_running',
+                        'message': 'Another bulk enrollment is in progress'}), 409
+    
+    upload = None
+    streaming = False
+    
+    def finish():
+        if upload is not None:
+            upload.close()
+        bulk_enroll_lock.release()
+    
+    try:
+        try:
+            data, students, upload = read_bulk_enrollment(request)
+        except (ValueError, zipfile.BadZipFile) as e:
+            return jsonify({'error': f'Invalid bulk enrollment request: {e}'}), 400
+        
+        mode = data.get('mode') or FACE_ENROLL_MODE
+        if mode not in face_system.detection_modes:
+            return jsonify({'error': f'Unknown detection mode: {mode}'}), 400
+        if not students:
+            return jsonify({'error': 'No students in request'}), 400
+        if len(students) > FACE_BULK_ENROLL_MAX_STUDENTS:
+            return jsonify({'error': f'At most {FACE_BULK_ENROLL_MAX_STUDENTS} students per request'}), 413
+        
+        events = bulk_enroller.run(face_system, students, mode, datetime.now().isoformat())
+        response = Response((json.dumps(event) + "\n" for event in events), mimetype='application/x-ndjson')
+        # The lock and the archive are released once the stream ends or the client leaves
+        response.call_on_close(finish)
+        streaming = True
+        return response
+    
+    except Exception as e:
+        logger.error(f"Bulk enrollment error: {e}")
+        return jsonify({'error': str(e)}), 500
+    finally:
+        if not streaming:
+            finish()
+
+@app.route('/unenroll/<student_id>', methods=['DELETE'])
+def unenroll_student(student_id):
+    """Remove a student from face recognition"""
+    if not FACE_RECOGNITION_AVAILABLE or not face_system:
+        return jsonify({
+            'error': 'face_recognition_unavailable',
+            'message': 'Face recognition system is not available. Please install required dependencies.'
+        }), 503
+    
+    try:
+        if not face_system.remove_student(student_id):
+            return jsonify({
+                'success': False,
+                'message': f'Student {student_id} not found in enrolled list'
+            }), 404
+        
+        logger.info(f"Unenrolled {student_id} from face recognition")
+        return jsonify({
+            'success': True,
+            'message': f'Student {student_id} unenrolled successfully'
+        })
+        
+    except Exception as e:
+        logger.error(f"Unenroll error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/maintenance/compact-prototypes', methods=['POST'])
+def compact_prototypes():
+    """
+    Reduce every enrolled student to k prototype embeddings
+    Expected payload (optional):
+    {
+        "k": 8,
+        "method": "kmedoids"    (or "farthest")
+    }
+    """
+    if not FACE_RECOGNITION_AVAILABLE or not face_system:
+        return jsonify({
+            'error': 'face_recognition_unavailable',
+            'message': 'Face recognition system is not available. Please install required dependencies.'
+        }), 503
+    
+    try:
+        data = request.get_json(silent=True) or {}
+        k = int(data.get('k') or FACE_NUM_PROTOTYPES or 8)
+        method = data.get('method')
+        
+        if k <= 0:
+            return jsonify({'error': 'k must be positive'}), 400
+        if method not in (None, 'kmedoids', 'farthest'):
+            return jsonify({'error': 'method must be kmedoids or farthest'}), 400
+        
+        report = face_system.compact_prototypes(k, method)
+        return jsonify({'success': True, 'report': report})
+        
+    except Exception as e:
+        logger.error(f"Prototype compaction error: {e}")
+        return jsonify({'error': str(e)}), 500
 
 @app.route('/session/start', methods=['POST'])
 def start_recognition_session():
@@ -255,7 +735,9 @@ def start_recognition_session():
         "session_id": "S_1699012345",
         "course_id": "21CS701",
         "department": "Computer Science",
-        "year": "4th Year"
+        "year": "4th Year",
+        "roster": ["CS2021001", ...],     (optional, course roster)
+        "fallback_to_global": false      (optional, search all students if unmatched)
     }
     """
     try:
@@ -264,17 +746,26 @@ def start_recognition_session():
         course_id = data.get('course_id')
         department = data.get('department')
         year = data.get('year')
+        roster = data.get('roster')
+        fallback_to_global = bool(data.get('fallback_to_global', False))
         
         if not all([session_id, course_id, department, year]):
             return jsonify({'error': 'Missing required fields'}), 400
         
-        session_manager.create_session(session_id, course_id, department, year)
+        if roster is not None and not isinstance(roster, list):
+            return jsonify({'error': 'roster must be a list of student IDs'}), 400
+        
+        session_manager.create_session(session_id, course_id, department, year,
+                                       roster=roster, fallback_to_global=fallback_to_global)
+        candidate_gallery = session_manager.get_candidate_gallery(session_id) if face_system else None
         
         return jsonify({
             'success': True,
             'session_id': session_id,
             'message': 'Face recognition session started',
-            'enrolled_students': len(face_system.student_embeddings)
+            'enrolled_students': len(face_system.student_embeddings),
+            'candidate_students': len(candidate_gallery) if candidate_gallery else 0,
+            'fallback_to_global': fallback_to_global
         })
         
     except Exception as e:
@@ -286,6 +777,7 @@ def close_recognition_session(session_id):
     """Close a face recognition session"""
     try:
         session_manager.close_session(session_id)
+        frame_cache.drop_session(session_id)
         return jsonify({
             'success': True,
             'session_id': session_id,
@@ -295,6 +787,261 @@ def close_recognition_session(session_id):
         logger.error(f"Session close error: {e}")
         return jsonify({'error': str(e)}), 500
 
+class RecognizeError(Exception):
+    """Invalid /recognize request, reported to the client as a 400"""
+    
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+def analyze_recognition(data, img_data, files):
+    """
+    CPU-bound part of /recognize: validate, decode, detect, embed and match
+    
+    Args:
+        data: Request fields
+        img_data: Encoded frame bytes (None when aligned crops are sent)
+        files: Binary multipart parts by name
+    
+    Returns:
+        tuple: (response payload, attendance mark or None). When a mark is
+               returned, the caller records it in the main system and
+               finishes the payload with complete_recognition.
+    
+    Raises:
+        RecognizeError: for invalid requests
+    """
+    aligned_data = files.get('aligned_faces') or data.get('aligned_faces')
+    session_id = data.get('session_id')
+    
+    if not img_data and not aligned_data:
+        raise RecognizeError('Missing image data')
+    try:
+        face_boxes = form_json(data.get('faces'))
+    except ValueError:
+        face_boxes = False
+    if face_boxes is not None:
+        try:
+            valid = isinstance(face_boxes, list) and all(
+                np.asarray(box['bbox'], dtype=np.float32).shape == (4,) and
+                (box.get('landmarks') is None or np.asarray(box['landmarks'], dtype=np.float32).size == 10)
+                for box in face_boxes
+            )
+        except (TypeError, ValueError, KeyError):
+            valid = False
+        if not valid:
+            raise RecognizeError('faces must be a list of {bbox: [x1, y1, x2, y2], landmarks: 5 [x, y] points}')
+    
+    try:
+        top_k = int(data.get('top_k') or 0)
+    except (TypeError, ValueError) as e:
+        raise RecognizeError('top_k must be an integer') from e
+    if not 0 <= top_k <= 50:
+        raise RecognizeError('top_k must be between 0 and 50')
+    
+    mode = data.get('mode') or FACE_RECOGNIZE_MODE
+    if mode not in face_system.detection_modes:
+        raise RecognizeError(f'Unknown detection mode: {mode}')
+    
+    if not session_id:
+        raise RecognizeError('Missing session_id')
+    
+    # Check if session exists and is active
+    session = session_manager.get_session(session_id)
+    if not session or not session['active']:
+        raise RecognizeError('Invalid or inactive session')
+    
+    cache_hit = False
+    rejected_faces = []
+    if aligned_data:
+        # Pre-aligned crops: no detection at all, straight to embedding
+        started = time.perf_counter()
+        try:
+            crops = [cv2.imdecode(np.frombuffer(decode_base64_image(crop) if isinstance(crop, str) else crop,
+                                                np.uint8), cv2.IMREAD_COLOR)
+                     for crop in aligned_data]
+        except Exception as e:
+            raise RecognizeError('Invalid aligned face data') from e
+        if any(crop is None for crop in crops):
+            raise RecognizeError('Could not decode aligned face')
+        processing = {
+            'input': 'aligned',
+            'decode_scale': 1,
+            'decode_ms': round((time.perf_counter() - started) * 1000, 2)
+        }
+        started = time.perf_counter()
+        faces = face_system.faces_from_aligned(crops)
+        processing['embed_ms'] = round((time.perf_counter() - started) * 1000, 2)
+    else:
+        # Decode the image, downscaled to what the detection mode needs
+        try:
+            frame, processing = decode_upload(img_data, mode)
+        except Exception as e:
+            raise RecognizeError('Invalid image data') from e
+        
+        if frame is None:
+            raise RecognizeError('Could not decode image')
+        
+        started = time.perf_counter()
+        if face_boxes is not None:
+            # Client-side boxes (upload coordinates) replace full-frame detection
+            processing['input'] = 'boxes'
+            scale = processing['decode_scale']
+            faces = face_system.locate_faces(frame, [
+                dict(box,
+                     bbox=np.asarray(box['bbox'], dtype=np.float32) / scale,
+                     landmarks=None if box.get('landmarks') is None
+                     else np.asarray(box['landmarks'], dtype=np.float32) / scale)
+                for box in face_boxes
+            ])
+            faces, rejected_faces = face_system.gate_faces(frame, faces)
+            face_system.embed_faces(frame, faces)
+        else:
+            # Detect faces, reusing the result of a near-identical recent frame
+            processing['input'] = 'frame'
+            cache_key = frame_hash(frame)
+            # Boxes are in decoded-frame coordinates of one detector input size
+            cache_variant = (mode, tuple(processing['det_size']), processing['decode_scale'], frame.shape[:2])
+            cached = frame_cache.lookup(session_id, cache_key, cache_variant)
+            cache_hit = cached is not None
+            if cache_hit:
+                faces, rejected_faces = cached
+            else:
+                # Faces failing the quality gate are never embedded or matched
+                faces = face_system.detect_faces(frame, det_size=tuple(processing['det_size']))
+                faces, rejected_faces = face_system.gate_faces(frame, faces)
+                face_system.embed_faces(frame, faces)
+                frame_cache.store(session_id, cache_key, (faces, rejected_faces), cache_variant)
+        processing['detect_ms'] = round((time.perf_counter() - started) * 1000, 2)
+    
+    rejected = [{
+        'bbox': (face.bbox * processing['decode_scale']).astype(int).tolist(),
+        'reasons': face.quality_reasons,
+        'detection_score': float(face.det_score) if face.det_score is not None else None
+    } for face in rejected_faces]
+    
+    if len(faces) == 0:
+        return {
+            'success': False,
+            'message': 'No face passed the quality check' if rejected else 'No face detected',
+            'faces_detected': len(rejected),
+            'recognized': False,
+            'cache_hit': cache_hit,
+            'processing': processing,
+            'rejected_faces': rejected
+        }, None
+    
+    results = []
+    best_recognition = None
+    
+    # Score every face in the frame with one gallery scan; one-to-one so
+    # two faces can't both be matched to the same student. The session's
+    # class sub-gallery is searched first when one could be built.
+    fallback_to_global = form_bool(data.get('fallback_to_global', session['fallback_to_global']))
+    matches = face_system.recognize_faces_batch(
+        [face.embedding for face in faces],
+        one_to_one=True,
+        gallery=session_manager.get_candidate_gallery(session_id),
+        fallback_to_global=fallback_to_global,
+        top_k=top_k
+    )
+    
+    for face, match in zip(faces, matches):
+        student_id, confidence = match[0], match[1]
+        # Boxes are reported in the coordinates of the uploaded image
+        bbox = None
+        if face.bbox is not None:
+            bbox = (face.bbox * processing['decode_scale']).astype(int).tolist()
+        
+        result = {
+            'bbox': bbox,
+            'confidence': float(confidence),
+            'student_id': student_id,
+            'recognized': student_id is not None,
+            'detection_score': float(face.det_score) if face.det_score is not None else None
+        }
+        
+        if top_k:
+            # Candidates come from the same scan as the match itself
+            candidates = match[2]
+            result['candidates'] = [
+                {'student_id': sid, 'score': score}
+                for sid, score in zip(candidates['student_ids'], candidates['scores'])
+            ]
+            result['margin'] = candidates['margin']
+        
+        if student_id and (not best_recognition or confidence > best_recognition['confidence']):
+            best_recognition = result
+        
+        results.append(result)
+    
+    base = {
+        'faces_detected': len(faces),
+        'results': results,
+        'cache_hit': cache_hit,
+        'processing': processing,
+        'rejected_faces': rejected
+    }
+    
+    if not best_recognition or not best_recognition['recognized']:
+        return dict(base, success=False, message='Face not recognized', recognized=False), None
+    
+    student_id = best_recognition['student_id']
+    base.update(student_id=student_id, confidence=best_recognition['confidence'])
+    
+    # Check if already recognized in this session
+    if session_manager.is_student_recognized(session_id, student_id):
+        return dict(
+            base,
+            success=True,
+            message=f'Student {student_id} already marked present in this session',
+            already_marked=True
+        ), None
+    
+    mark = {
+        'session_id': session_id,
+        'student_id': student_id,
+        'confidence': best_recognition['confidence'],
+        'department': session['department'],
+        'year': session['year']
+    }
+    return base, mark
+
+def complete_recognition(payload, mark, attendance_result):
+    """Finish a /recognize payload once the attendance mark has been sent"""
+    student_id = mark['student_id']
+    if attendance_result.get('pending'):
+        # Counted as recognized now; dropped again if the main system rejects
+        # the mark. Clients poll /attendance/marks/<mark_id> for the outcome.
+        session_manager.add_recognized_student(mark['session_id'], student_id)
+        return dict(
+            payload,
+            success=False,
+            recognized=True,
+            message=f'Face recognized, attendance queued for {student_id}',
+            attendance_logged=False,
+            attendance_status='pending',
+            mark_id=attendance_result['mark_id']
+        )
+    if attendance_result['success']:
+        # Add to session's recognized students
+        session_manager.add_recognized_student(mark['session_id'], student_id)
+        return dict(
+            payload,
+            success=True,
+            message=f'Attendance marked for {student_id}',
+            attendance_logged=True,
+            attendance_status='marked',
+            marked_at=attendance_result.get('marked_at')
+        )
+    return dict(
+        payload,
+        success=False,
+        message=f'Face recognized but attendance marking failed: {attendance_result.get("error")}',
+        attendance_logged=False,
+        attendance_status='failed'
+    )
+
 @app.route('/recognize', methods=['POST'])
 def recognize_face():
     """
@@ -302,166 +1049,84 @@ def recognize_face():
     Expected payload:
     {
         "image": "base64_encoded_image",
-        "session_id": "S_1699012345"
+        "session_id": "S_1699012345",
+        "mode": "classroom",            (optional, "closeup" or "classroom")
+        "faces": [{"bbox": [x1, y1, x2, y2], "landmarks": [[x, y] x5]}],
+                                        (optional, boxes from a client-side detector;
+                                         skips full-frame detection, landmarks optional)
+        "aligned_faces": ["base64_112x112_crop", ...],
+                                        (optional, instead of "image": crops already
+                                         aligned to the ArcFace template)
+        "fallback_to_global": false,    (optional, overrides the session setting)
+        "top_k": 3                      (optional, return top-k candidates and margin per face)
     }
+    or multipart/form-data with a binary "image" part (or binary
+    "aligned_faces" parts) and the other fields as form fields ("faces" as a
+    JSON string), or a raw image/jpeg body with the fields as query arguments
+
+    With write-behind attendance enabled, a recognized student's mark is
+    queued and the response has success false, attendance_status "pending"
+    and a mark_id; poll /attendance/marks/<mark_id> until its status is
+    marked, rejected or failed
     """
     try:
-        data = request.get_json()
-        img_b64 = data.get('image')
-        session_id = data.get('session_id')
-        
-        if not img_b64:
-            return jsonify({'error': 'Missing image data'}), 400
-        
-        if not session_id:
-            return jsonify({'error': 'Missing session_id'}), 400
-        
-        # Check if session exists and is active
-        session = session_manager.get_session(session_id)
-        if not session or not session['active']:
-            return jsonify({'error': 'Invalid or inactive session'}), 400
-        
-        # Decode base64 image
         try:
-            img_data = base64.b64decode(img_b64)
-            nparr = np.frombuffer(img_data, np.uint8)
-            frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        except Exception as e:
+            data, img_data, files = read_image_request(request, 'image')
+        except (ValueError, binascii.Error) as e:
             return jsonify({'error': 'Invalid image data'}), 400
         
-        if frame is None:
-            return jsonify({'error': 'Could not decode image'}), 400
-        
-        # Detect faces
-        faces = face_system.app.get(frame)
-        
-        if len(faces) == 0:
-            return jsonify({
-                'success': False,
-                'message': 'No face detected',
-                'faces_detected': 0,
-                'recognized': False
-            })
-        
-        results = []
-        best_recognition = None
-        
-        for face in faces:
-            # Recognize face
-            student_id, confidence = face_system.recognize_face(face.embedding)
-            
-            bbox = face.bbox.astype(int).tolist()
-            
-            result = {
-                'bbox': bbox,
-                'confidence': float(confidence),
-                'student_id': student_id,
-                'recognized': student_id is not None,
-                'detection_score': float(face.det_score)
-            }
-            
-            if student_id and (not best_recognition or confidence > best_recognition['confidence']):
-                best_recognition = result
-            
-            results.append(result)
-        
-        # If we have a recognized student, mark attendance
-        if best_recognition and best_recognition['recognized']:
-            student_id = best_recognition['student_id']
-            
-            # Check if already recognized in this session
-            if session_manager.is_student_recognized(session_id, student_id):
-                return jsonify({
-                    'success': True,
-                    'message': f'Student {student_id} already marked present in this session',
-                    'student_id': student_id,
-                    'confidence': best_recognition['confidence'],
-                    'already_marked': True,
-                    'faces_detected': len(faces),
-                    'results': results
-                })
-            
+        (payload, mark), queue_wait = inference_pool.run(analyze_recognition, data, img_data, files)
+        payload['processing']['queue_wait_ms'] = round(queue_wait * 1000, 2)
+        if mark:
             # Mark attendance in main system
-            attendance_result = mark_attendance_in_main_system(
-                session_id, 
-                student_id, 
-                best_recognition['confidence'],
-                session['department'],
-                session['year']
-            )
-            
-            if attendance_result['success']:
-                # Add to session's recognized students
-                session_manager.add_recognized_student(session_id, student_id)
-                
-                return jsonify({
-                    'success': True,
-                    'message': f'Attendance marked for {student_id}',
-                    'student_id': student_id,
-                    'confidence': best_recognition['confidence'],
-                    'attendance_logged': True,
-                    'marked_at': attendance_result.get('marked_at'),
-                    'faces_detected': len(faces),
-                    'results': results
-                })
-            else:
-                return jsonify({
-                    'success': False,
-                    'message': f'Face recognized but attendance marking failed: {attendance_result.get("error")}',
-                    'student_id': student_id,
-                    'confidence': best_recognition['confidence'],
-                    'attendance_logged': False,
-                    'faces_detected': len(faces),
-                    'results': results
-                })
-        else:
-            return jsonify({
-                'success': False,
-                'message': 'Face not recognized',
-                'faces_detected': len(faces),
-                'recognized': False,
-                'results': results
-            })
+            payload = complete_recognition(payload, mark, submit_attendance(**mark))
+        return jsonify(payload)
         
+    except RecognizeError as e:
+        return jsonify({'error': str(e)}), e.status
+    except PoolSaturated as e:
+        return overloaded_response(e)
     except Exception as e:
         logger.error(f"Recognition error: {e}")
         return jsonify({'error': str(e)}), 500
 
+def attendance_payload(session_id, student_id, confidence, department, year):
+    """Body of the main system's /attendance/face-recognition call"""
+    return {
+        'sessionId': session_id,
+        'studentId': student_id,
+        'confidence': confidence,
+        'source': 'face_recognition',
+        'department': department,
+        'year': year,
+        'timestamp': datetime.now().isoformat()
+    }
+
+def attendance_result(session_id, student_id, response):
+    """Interpret the main system's reply (a requests or httpx response)"""
+    if response.status_code == 200:
+        result = response.json()
+        logger.info(f"Successfully marked attendance for {student_id} in session {session_id}")
+        return {
+            'success': True,
+            'marked_at': result.get('markedAt'),
+            'message': result.get('message')
+        }
+    logger.error(f"Failed to mark attendance: {response.status_code} - {response.text}")
+    return {
+        'success': False,
+        'error': f"HTTP {response.status_code}: {response.text}"
+    }
+
 def mark_attendance_in_main_system(session_id, student_id, confidence, department, year):
     """Mark attendance in the main Node.js system"""
     try:
-        # Prepare the attendance data
-        attendance_data = {
-            'sessionId': session_id,
-            'studentId': student_id,
-            'confidence': confidence,
-            'source': 'face_recognition',
-            'department': department,
-            'year': year,
-            'timestamp': datetime.now().isoformat()
-        }
-        
         # Call the main system's attendance endpoint
-        response = requests.post(
-            f"{MAIN_SERVER_URL}/attendance/face-recognition",
-            json=attendance_data,
-            timeout=5
+        response = main_server.post(
+            '/attendance/face-recognition',
+            json=attendance_payload(session_id, student_id, confidence, department, year)
         )
-        
-        if response.status_code == 200:
-            result = response.json()
-            logger.info(f"Successfully marked attendance for {student_id} in session {session_id}")
-            return {
-                'success': True,
-                'marked_at': result.get('markedAt'),
-                'message': result.get('message')
-            }
-        else:
-            logger.error(f"Failed to mark attendance: {response.status_code} - {response.text}")
-            return {
-                'success': False,
-                'error': f"HTTP {response.status_code}: {response.text}"
-            }
+        return attendance_result(session_id, student_id, response)
             
     except requests.exceptions.RequestException as e:
         logger.error(f"Network error marking attendance: {e}")
@@ -476,6 +1141,28 @@ def mark_attendance_in_main_system(session_id, student_id, confidence, departmen
             'error': f"Unexpected error: {str(e)}"
         }
 
+def submit_attendance(session_id, student_id, confidence, department, year):
+    """Queue a mark for write-behind delivery, or send it now when the queue is disabled"""
+    if attendance_queue is None:
+        return mark_attendance_in_main_system(session_id, student_id, confidence, department, year)
+    mark_id = attendance_queue.enqueue(attendance_payload(session_id, student_id, confidence, department, year))
+    # Not a success yet: the main system may still reject the mark
+    return {
+        'success': False,
+        'pending': True,
+        'mark_id': mark_id
+    }
+
+@app.route('/attendance/marks/<mark_id>', methods=['GET'])
+def get_attendance_mark(mark_id):
+    """Delivery status of a write-behind attendance mark"""
+    if attendance_queue is None:
+        return jsonify({'error': 'Write-behind attendance is disabled'}), 404
+    status = attendance_queue.status(mark_id)
+    if status is None:
+        return jsonify({'error': 'Unknown mark id'}), 404
+    return jsonify(status)
+
 @app.route('/settings', methods=['GET', 'POST'])
 def handle_settings():
     """Get or update face recognition settings"""
@@ -484,6 +1171,8 @@ def handle_settings():
             'similarity_threshold': face_system.similarity_threshold,
             'presence_frames': face_system.presence_frames,
             'enrolled_students_count': len(face_system.student_embeddings),
+            'index': face_system.index_info(),
+            'recognition_batching': face_system.recognition_batcher.stats() if face_system.recognition_batcher else None,
             'service_status': 'running'
         })
     
@@ -507,12 +1196,39 @@ def handle_settings():
                 else:
                     return jsonify({'error': 'Presence frames must be positive'}), 400
             
+            if 'index_nprobe' in data:
+                nprobe = int(data['index_nprobe'])
+                if nprobe <= 0:
+                    return jsonify({'error': 'Index nprobe must be positive'}), 400
+                if face_system.gallery.index is None:
+                    return jsonify({'error': 'Exact search is configured; no index to tune'}), 400
+                face_system.gallery.index.nprobe = nprobe
+                logger.info(f"Updated index nprobe to {nprobe}")
+            
+            batcher = face_system.recognition_batcher
+            if 'batch_max_size' in data or 'batch_max_latency_ms' in data:
+                if batcher is None:
+                    return jsonify({'error': 'Recognition batching is disabled (FACE_BATCH_MAX_SIZE=0)'}), 400
+                if 'batch_max_size' in data:
+                    max_batch = int(data['batch_max_size'])
+                    if max_batch <= 0:
+                        return jsonify({'error': 'Batch max size must be positive'}), 400
+                    batcher.max_batch = max_batch
+                if 'batch_max_latency_ms' in data:
+                    max_latency_ms = float(data['batch_max_latency_ms'])
+                    if max_latency_ms < 0:
+                        return jsonify({'error': 'Batch max latency cannot be negative'}), 400
+                    batcher.max_latency = max_latency_ms / 1000
+                logger.info(f"Updated recognition batching to {batcher.max_batch} items / {batcher.max_latency * 1000}ms")
+            
             return jsonify({
                 'success': True,
                 'message': 'Settings updated successfully',
                 'current_settings': {
                     'similarity_threshold': face_system.similarity_threshold,
-                    'presence_frames': face_system.presence_frames
+                    'presence_frames': face_system.presence_frames,
+                    'index': face_system.index_info(),
+                    'recognition_batching': batcher.stats() if batcher else None
                 }
             })
             
@@ -524,7 +1240,7 @@ def handle_settings():
 def test_main_system_connection():
     """Test connection to main attendance system"""
     try:
-        response = requests.get(f"{MAIN_SERVER_URL}/health", timeout=5)
+        response = main_server.get('/health')
         if response.status_code == 200:
             return jsonify({
                 'success': True,
@@ -551,14 +1267,19 @@ def internal_error(error):
     return jsonify({'error': 'Internal server error'}), 500
 
 if __name__ == '__main__':
+    init_service()
     logger.info("Starting Face Recognition Microservice...")
     logger.info("Available endpoints:")
     logger.info("  GET  /health - Health check")
     logger.info("  GET  /students - List enrolled students")
     logger.info("  POST /enroll - Enroll new student")
+    logger.info("  POST /enroll/bulk - Enroll many students (JSON or zip), streams NDJSON progress")
+    logger.info("  DELETE /unenroll/<student_id> - Remove student")
+    logger.info("  POST /maintenance/compact-prototypes - Reduce students to k prototypes")
     logger.info("  POST /session/start - Start recognition session")
     logger.info("  POST /session/<id>/close - Close recognition session")
     logger.info("  POST /recognize - Recognize faces and mark attendance")
+    logger.info("  GET  /attendance/marks/<id> - Delivery status of a queued mark")
     logger.info("  GET/POST /settings - Get/update settings")
     logger.info("  GET  /test-connection - Test main system connection")
     logger.info(f"\nMicroservice running on http://localhost:{SERVICE_PORT}")
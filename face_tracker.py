@@ -0,0 +1,186 @@
+"""
+Track-by-detection for the webcam recognition loop
+Full detection runs every few frames; in between, face boxes follow the faces
+with Lucas-Kanade optical flow, and a face is only re-embedded when its track
+is new, has drifted or has not been confirmed for a while
+"""
+
+import itertools
+import cv2
+import numpy as np
+
+
+def box_iou(a, b):
+    """Intersection over union of two (x1, y1, x2, y2) boxes"""
+    x1, y1 = max(a[0], b[0]), max(a[1], b[1])
+    x2, y2 = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0.0, x2 - x1) * max(0.0, y2 - y1)
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+class Track:
+    """One face followed across frames"""
+
+    def __init__(self, track_id, face, frame_index):
+        self.track_id = track_id
+        self.face = face
+        self.student_id = None
+        self.confidence = 0.0
+        self.embedded_bbox = None
+        self.embedded_at = None
+        self.seen_at = frame_index
+        self.misses = 0
+
+    @property
+    def bbox(self):
+        return self.face.bbox
+
+    def shift(self, offset):
+        """Move the box and keypoints by an (dx, dy) offset"""
+        dx, dy = offset
+        self.face.bbox = self.face.bbox + np.array([dx, dy, dx, dy], dtype=np.float32)
+        if self.face.kps is not None:
+            self.face.kps = self.face.kps + np.array([dx, dy], dtype=np.float32)
+
+    def assign(self, student_id, confidence, frame_index):
+        """Record the result of a fresh embedding + gallery match"""
+        self.student_id = student_id
+        self.confidence = confidence
+        self.embedded_bbox = self.face.bbox.copy()
+        self.embedded_at = frame_index
+
+
+class FaceTracker:
+    """
+    Associates detections with tracks by IoU and follows them in between
+
+    update() returns the tracks whose face needs a (re-)embedding: new tracks,
+    tracks whose box drifted away from where they were last embedded, and
+    tracks not re-confirmed within `reembed_every` frames.
+    """
+
+    def __init__(self, detect_every=5, iou_threshold=0.3, drift_iou=0.5,
+                 reembed_every=30, max_misses=2):
+        """
+        Args:
+            detect_every: Run full detection on every N-th frame
+            iou_threshold: Minimum IoU to associate a detection with a track
+            drift_iou: Re-embed when the box overlaps its last embedded box less than this
+            reembed_every: Re-embed a track at least every N frames
+            max_misses: Detection rounds a track survives without a matching face
+        """
+        self.detect_every = detect_every
+        self.iou_threshold = iou_threshold
+        self.drift_iou = drift_iou
+        self.reembed_every = reembed_every
+        self.max_misses = max_misses
+        self.tracks = []
+        self.frame_index = -1
+        self._prev_gray = None
+        self._ids = itertools.count(1)
+
+    def is_detection_frame(self):
+        """Whether the next frame should run full detection"""
+        return (self.frame_index + 1) % self.detect_every == 0 or not self.tracks
+
+    def update(self, frame, faces=None):
+        """
+        Advance the tracker by one frame
+
+        Args:
+            frame: BGR frame
+            faces: Detected faces on detection frames, None in between
+
+        Returns:
+            tuple: (live tracks, tracks that need embedding, tracks dropped)
+        """
+        self.frame_index += 1
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+
+        if faces is None:
+            if self._prev_gray is not None:
+                self._follow(self._prev_gray, gray)
+            self._prev_gray = gray
+            return self.tracks, [], []
+
+        self._prev_gray = gray
+        to_embed, dropped = self._associate(faces)
+        return self.tracks, to_embed, dropped
+
+    def _associate(self, faces):
+        """Greedy IoU matching of detections to tracks"""
+        pairs = []
+        for t, track in enumerate(self.tracks):
+            for f, face in enumerate(faces):
+                iou = box_iou(track.bbox, face.bbox)
+                if iou >= self.iou_threshold:
+                    pairs.append((iou, t, f))
+        pairs.sort(reverse=True)
+
+        matched_tracks, matched_faces = set(), set()
+        to_embed = []
+        for _, t, f in pairs:
+            if t in matched_tracks or f in matched_faces:
+                continue
+            matched_tracks.add(t)
+            matched_faces.add(f)
+            track = self.tracks[t]
+            track.face = faces[f]
+            track.seen_at = self.frame_index
+            track.misses = 0
+            if track.embedded_at is None:
+                to_embed.append(track)
+                continue
+            drifted = box_iou(track.embedded_bbox, track.bbox) < self.drift_iou
+            stale = self.frame_index - track.embedded_at >= self.reembed_every
+            if drifted or stale:
+                to_embed.append(track)
+
+        survivors, dropped = [], []
+        for t, track in enumerate(self.tracks):
+            if t not in matched_tracks:
+                track.misses += 1
+                if track.misses > self.max_misses:
+                    dropped.append(track)
+                    continue
+            survivors.append(track)
+
+        for f, face in enumerate(faces):
+            if f not in matched_faces:
+                track = Track(next(self._ids), face, self.frame_index)
+                survivors.append(track)
+                to_embed.append(track)
+
+        self.tracks = survivors
+        return to_embed, dropped
+
+    def _follow(self, prev_gray, gray):
+        """Shift every track by the median optical flow of corners inside its box"""
+        height, width = gray.shape
+        starts, owners = [], []
+        for t, track in enumerate(self.tracks):
+            x1, y1, x2, y2 = np.clip(track.bbox.astype(int), 0, [width, height, width, height])
+            if x2 - x1 < 8 or y2 - y1 < 8:
+                continue
+            mask = np.zeros_like(prev_gray)
+            mask[y1:y2, x1:x2] = 255
+            points = cv2.goodFeaturesToTrack(prev_gray, maxCorners=30, qualityLevel=0.01,
+                                             minDistance=3, mask=mask)
+            if points is not None:
+                starts.append(points)
+                owners.extend([t] * len(points))
+
+        if not starts:
+            return
+        # One pyramidal LK call for the corners of every track
+        starts = np.concatenate(starts)
+        ends, status, _ = cv2.calcOpticalFlowPyrLK(prev_gray, gray, starts, None,
+                                                   winSize=(15, 15), maxLevel=2)
+        flow = (ends - starts).reshape(-1, 2)
+        ok = status.ravel() == 1
+        owners = np.array(owners)
+        for t, track in enumerate(self.tracks):
+            mine = ok & (owners == t)
+            if mine.sum() >= 3:
+                track.shift(np.median(flow[mine], axis=0))
@@ -0,0 +1,105 @@
+"""
+Duplicate-frame cache for the face recognition service
+Consecutive camera frames of a seated student are nearly identical, so the
+detection + embedding result of a frame is reused for near-duplicate frames
+of the same session and detection input within a short TTL
+"""
+
+import threading
+import time
+from collections import OrderedDict
+import cv2
+import numpy as np
+
+
+def frame_hash(frame, hash_size=16):
+    """
+    Difference hash (dHash) of a downscaled grayscale frame
+
+    Returns:
+        int: hash_size * hash_size bit perceptual hash
+    """
+    gray = frame if frame.ndim == 2 else cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    small = cv2.resize(gray, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+class FrameCache:
+    """
+    Bounded per-session LRU of frame hash -> detected faces
+
+    A lookup hits when a cached frame of the same session and variant is
+    within `max_distance` hash bits and younger than `ttl` seconds. The
+    variant identifies the detector input (mode, detection size, decode scale
+    and frame size), since cached boxes are only valid for the same input.
+    """
+
+    def __init__(self, max_entries=8, ttl=2.0, max_distance=8, max_sessions=256):
+        """
+        Args:
+            max_entries: Frames remembered per session
+            ttl: Seconds a cached result stays valid
+            max_distance: Hamming distance (bits) that still counts as a duplicate
+            max_sessions: Sessions tracked before the least recently used is dropped
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_distance = max_distance
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+
+    def lookup(self, session_id, key, variant=None):
+        """Cached faces for a near-duplicate frame of the same variant, or None"""
+        now = time.monotonic()
+        with self._lock:
+            entries = self._sessions.get(session_id)
+            if entries is not None:
+                self._sessions.move_to_end(session_id)
+                for cached in list(entries):
+                    stored_at, faces = entries[cached]
+                    if now - stored_at > self.ttl:
+                        del entries[cached]
+                        self.expired += 1
+                        continue
+                    cached_variant, cached_key = cached
+                    if cached_variant == variant and bin(cached_key ^ key).count('1') <= self.max_distance:
+                        entries.move_to_end(cached)
+                        self.hits += 1
+                        return faces
+            self.misses += 1
+            return None
+
+    def store(self, session_id, key, faces, variant=None):
+        """Remember the faces detected in a frame"""
+        with self._lock:
+            entries = self._sessions.get(session_id)
+            if entries is None:
+                entries = self._sessions[session_id] = OrderedDict()
+                while len(self._sessions) > self.max_sessions:
+                    self._sessions.popitem(last=False)
+            self._sessions.move_to_end(session_id)
+            entries[variant, key] = (time.monotonic(), faces)
+            entries.move_to_end((variant, key))
+            while len(entries) > self.max_entries:
+                entries.popitem(last=False)
+
+    def drop_session(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def stats(self):
+        """Hit-rate counters"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'expired': self.expired,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'sessions': len(self._sessions)
+            }
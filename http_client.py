@@ -0,0 +1,80 @@
+"""
+Pooled keep-alive HTTP client for calls to the main Node.js server
+One requests.Session per target is shared by all request threads; its
+connection pool keeps sockets alive so attendance marks reuse connections
+instead of paying a TCP handshake each time
+"""
+
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class PooledHTTPClient:
+    """
+    Thread-safe pooled client for one base URL
+
+    The adapter's urllib3 pools are shared across threads; up to `pool_size`
+    connections per host are kept alive (more are opened under bursts but
+    not kept).
+    """
+
+    def __init__(self, base_url, pool_size=10, connect_timeout=2.0, read_timeout=5.0):
+        """
+        Args:
+            base_url: Server root, e.g. http://localhost:3000
+            pool_size: Keep-alive connections kept per host
+            connect_timeout: Seconds to establish a connection
+            read_timeout: Seconds to wait for response data
+        """
+        self.base_url = base_url.rstrip('/')
+        self.pool_size = pool_size
+        self.timeout = (connect_timeout, read_timeout)
+        self._adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session = requests.Session()
+        self.session.mount('http://', self._adapter)
+        self.session.mount('https://', self._adapter)
+        self._lock = threading.Lock()
+        self.failures = 0
+
+    def request(self, method, path, **kwargs):
+        """Send a request relative to base_url with the default timeouts"""
+        kwargs.setdefault('timeout', self.timeout)
+        try:
+            return self.session.request(method, f"{self.base_url}{path}", **kwargs)
+        except requests.exceptions.RequestException:
+            with self._lock:
+                self.failures += 1
+            raise
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request('POST', path, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+    def stats(self):
+        """Connection reuse counters from the urllib3 pools"""
+        pools = self._adapter.poolmanager.pools
+        opened = sent = 0
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is not None:
+                opened += pool.num_connections
+                sent += pool.num_requests
+        # Connections opened for requests that failed before being sent can
+        # outnumber requests
+        reused = max(sent - opened, 0)
+        return {
+            'pool_size': self.pool_size,
+            'connect_timeout': self.timeout[0],
+            'read_timeout': self.timeout[1],
+            'requests': sent,
+            'connections_opened': opened,
+            'connections_reused': reused,
+            'reuse_rate': reused / sent if sent else 0.0,
+            'failures': self.failures
+        }
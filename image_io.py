@@ -0,0 +1,84 @@
+"""
+Image decoding helpers for the face recognition services
+Decodes uploads at reduced resolution (OpenCV IMREAD_REDUCED_* flags, which
+JPEG decodes natively via DCT scaling) when they are much larger than needed
+"""
+
+import struct
+import cv2
+import numpy as np
+
+# Reduction factor -> OpenCV decode flag
+REDUCED_DECODE_FLAGS = [
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2)
+]
+
+# JPEG start-of-frame markers carrying the image dimensions
+_JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def image_dimensions(data):
+    """
+    Read (width, height) from a JPEG or PNG header without decoding pixels
+
+    Returns:
+        tuple: (width, height) or None for unknown formats / truncated headers
+    """
+    data = bytes(data[:65536]) if not isinstance(data, bytes) else data
+    if data[:8] == b'\x89PNG\r\n\x1a\n' and len(data) >= 24:
+        return struct.unpack('>II', data[16:24])
+
+    if data[:2] != b'\xff\xd8':
+        return None
+
+    i = 2
+    while i + 9 < len(data):
+        if data[i] != 0xFF:
+            i += 1
+            continue
+        marker = data[i + 1]
+        # Fill bytes and standalone markers carry no length field
+        if marker == 0xFF:
+            i += 1
+            continue
+        if marker in (0x01, 0xD8) or 0xD0 <= marker <= 0xD7:
+            i += 2
+            continue
+        if marker in _JPEG_SOF_MARKERS:
+            height, width = struct.unpack('>HH', data[i + 5:i + 9])
+            return width, height
+        length = struct.unpack('>H', data[i + 2:i + 4])[0]
+        i += 2 + length
+    return None
+
+
+def decode_image(data, min_side=None):
+    """
+    Decode an encoded image, reducing resolution when it is larger than needed
+
+    Args:
+        data: Encoded image bytes
+        min_side: Smallest longer side the caller needs; the largest
+                  reduction (2x, 4x, 8x) that still meets it is used
+
+    Returns:
+        tuple: (frame or None, reduction factor)
+    """
+    buffer = np.frombuffer(data, np.uint8)
+    scale, flag = 1, cv2.IMREAD_COLOR
+
+    dims = image_dimensions(data) if min_side else None
+    if dims:
+        longest = max(dims)
+        for factor, reduced_flag in REDUCED_DECODE_FLAGS:
+            if longest // factor >= min_side:
+                scale, flag = factor, reduced_flag
+                break
+
+    frame = cv2.imdecode(buffer, flag)
+    if frame is None and flag != cv2.IMREAD_COLOR:
+        # Some encoders confuse the reduced decoder; fall back to full size
+        scale, frame = 1, cv2.imdecode(buffer, cv2.IMREAD_COLOR)
+    return frame, scale
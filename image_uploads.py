@@ -0,0 +1,154 @@
+"""
+Request body readers for image uploads
+Besides the legacy JSON payloads with base64 images, the Flask services accept
+multipart/form-data with binary image parts and a raw image/* body. Multipart
+bodies are parsed incrementally from the request stream, so enrolment uploads
+are processed part by part instead of being held in memory all at once
+"""
+
+import base64
+import binascii
+import json
+from werkzeug.http import parse_options_header
+from werkzeug.sansio.multipart import Data, Epilogue, Field, File, MultipartDecoder, NeedData
+
+CHUNK_SIZE = 64 * 1024
+
+
+def upload_kind(request):
+    """'multipart', 'raw' (image/* or octet-stream body) or 'json'"""
+    mimetype = request.mimetype or ''
+    if mimetype == 'multipart/form-data':
+        return 'multipart'
+    if mimetype.startswith('image/') or mimetype == 'application/octet-stream':
+        return 'raw'
+    return 'json'
+
+
+def decode_base64_image(value):
+    """Bytes of a base64 image, with or without a data: URL prefix"""
+    return base64.b64decode(value.split(',', 1)[1] if ',' in value else value)
+
+
+def form_bool(value):
+    """Booleans sent as form / query strings ("true", "1", "yes", "on")"""
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 'yes', 'on')
+    return bool(value)
+
+
+def form_json(value):
+    """JSON-valued fields sent as form / query strings"""
+    return json.loads(value) if isinstance(value, str) else value
+
+
+def iter_multipart(request, chunk_size=CHUNK_SIZE):
+    """
+    Parse a multipart/form-data body while it streams in
+
+    Yields:
+        tuple: (part name, filename or None for plain fields, bytes) as soon
+               as each part is complete; only one part is buffered at a time
+    """
+    _, options = parse_options_header(request.content_type)
+    boundary = options.get('boundary')
+    if not boundary:
+        raise ValueError('Missing multipart boundary')
+
+    decoder = MultipartDecoder(boundary.encode('latin-1'))
+    stream = request.stream
+    name = filename = None
+    buffer = bytearray()
+    while True:
+        chunk = stream.read(chunk_size)
+        decoder.receive_data(chunk or None)
+        event = decoder.next_event()
+        while not isinstance(event, (NeedData, Epilogue)):
+            if isinstance(event, File):
+                name, filename, buffer = event.name, event.filename, bytearray()
+            elif isinstance(event, Field):
+                name, filename, buffer = event.name, None, bytearray()
+            elif isinstance(event, Data):
+                buffer += event.data
+                if not event.more_data:
+                    yield name, filename, bytes(buffer)
+            event = decoder.next_event()
+        if isinstance(event, Epilogue) or not chunk:
+            return
+
+
+def read_image_request(request, image_field='image'):
+    """
+    Read a single-image request in any supported encoding
+
+    JSON bodies carry base64 images; multipart and raw bodies carry binary
+    images, with the other parameters as form fields or query arguments.
+
+    Returns:
+        tuple: (fields dict, image bytes or None, {part name: [bytes]} of
+               every binary file part)
+    """
+    kind = upload_kind(request)
+    if kind == 'json':
+        fields = request.get_json() or {}
+        image = fields.get(image_field)
+        return fields, decode_base64_image(image) if image else None, {}
+
+    fields = request.args.to_dict()
+    if kind == 'raw':
+        return fields, request.get_data() or None, {}
+
+    files = {}
+    for name, filename, data in iter_multipart(request):
+        if filename is None:
+            fields[name] = data.decode('utf-8')
+        else:
+            files.setdefault(name, []).append(data)
+    image = files.get(image_field, [None])[0]
+    return fields, image, files
+
+
+def stream_images(request, image_field='images'):
+    """
+    Read a multi-image (enrolment) request without buffering all images
+
+    Multipart form fields must precede the image parts; fields sent after the
+    first image are ignored. Query arguments are merged into the fields.
+
+    Returns:
+        tuple: (fields dict, iterator of image bytes; None for base64
+               strings that do not decode)
+    """
+    kind = upload_kind(request)
+    if kind == 'json':
+        fields = request.get_json() or {}
+
+        def decoded():
+            for image in fields.get(image_field) or []:
+                try:
+                    yield decode_base64_image(image)
+                except (binascii.Error, ValueError, AttributeError):
+                    yield None
+
+        return fields, decoded()
+
+    fields = request.args.to_dict()
+    if kind == 'raw':
+        return fields, iter([request.get_data()])
+
+    parts = iter_multipart(request)
+    first = []
+    for name, filename, data in parts:
+        if name == image_field:
+            first.append(data)
+            break
+        if filename is None:
+            fields[name] = data.decode('utf-8')
+
+    def images():
+        yield from first
+        for name, _, data in parts:
+            if name == image_field:
+                yield data
+
+    return fields, images()
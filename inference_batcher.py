@@ -0,0 +1,124 @@
+"""
+Dynamic micro-batching for model inference
+Concurrent requests submit their inputs to one scheduler thread, which runs
+them through the model as a single batched forward pass
+"""
+
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class MicroBatcher:
+    """
+    Collects inputs from concurrent callers into batches
+
+    A batch is closed once it holds `max_batch` items or `max_latency`
+    seconds have passed since its first request arrived, whichever comes
+    first. The items of one request are never split across batches.
+    """
+
+    def __init__(self, fn, max_batch=32, max_latency=0.005, name="micro-batcher"):
+        """
+        Args:
+            fn: Batched function, list of inputs -> array of outputs (one row per input)
+            max_batch: Items that close a batch immediately
+            max_latency: Seconds the first request of a batch waits for company
+            name: Scheduler thread name
+        """
+        self.fn = fn
+        self.max_batch = max_batch
+        self.max_latency = max_latency
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.items = 0
+        self.largest_batch = 0
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, items):
+        """
+        Queue a request's inputs
+
+        Returns:
+            Future: resolves to the outputs for `items`, in order
+        """
+        future = Future()
+        if not items:
+            future.set_result(np.zeros((0,)))
+            return future
+        self._queue.put((list(items), future))
+        return future
+
+    def __call__(self, items):
+        """Submit inputs and wait for their outputs"""
+        return self.submit(items).result()
+
+    def close(self):
+        """Stop the scheduler thread after the queued requests are served"""
+        self._queue.put(None)
+        self._thread.join()
+
+    def _collect(self, first):
+        """Gather requests behind `first` until the batch is full or too old"""
+        batch = [first]
+        count = len(first[0])
+        deadline = time.monotonic() + self.max_latency
+        while count < self.max_batch:
+            timeout = deadline - time.monotonic()
+            try:
+                request = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if request is None:
+                # Put the stop marker back for the main loop
+                self._queue.put(None)
+                break
+            batch.append(request)
+            count += len(request[0])
+        return batch, count
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            batch, count = self._collect(first)
+
+            inputs = [item for items, _ in batch for item in items]
+            try:
+                outputs = self.fn(inputs)
+            except Exception as e:
+                logger.error(f"Batched inference failed for {count} items: {e}")
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            offset = 0
+            for items, future in batch:
+                future.set_result(outputs[offset:offset + len(items)])
+                offset += len(items)
+
+            with self._lock:
+                self.batches += 1
+                self.items += count
+                self.largest_batch = max(self.largest_batch, count)
+
+    def stats(self):
+        """Batch size counters"""
+        with self._lock:
+            return {
+                'max_batch': self.max_batch,
+                'max_latency_ms': self.max_latency * 1000,
+                'batches': self.batches,
+                'items': self.items,
+                'mean_batch_size': self.items / self.batches if self.batches else 0.0,
+                'largest_batch': self.largest_batch,
+                'queued': self._queue.qsize()
+            }
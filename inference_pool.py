@@ -0,0 +1,114 @@
+"""
+Bounded inference worker pool with admission control
+Detection and embedding run on a fixed number of worker threads behind a
+queue of fixed depth. Work arriving when the queue is full is refused at once
+instead of slowing every in-flight request down
+"""
+
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class PoolSaturated(Exception):
+    """Raised when the admission queue is full"""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Inference queue is full; retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class InferencePool:
+    """
+    Fixed-size worker pool that sheds load past `queue_depth` waiting tasks
+
+    A task is admitted while fewer than `workers + queue_depth` tasks are
+    running or waiting. The time each task spent waiting for a worker is
+    measured and returned with its result.
+    """
+
+    def __init__(self, workers=4, queue_depth=16, name='inference'):
+        """
+        Args:
+            workers: Worker threads (tasks running at once)
+            queue_depth: Tasks allowed to wait for a worker
+            name: Worker thread name prefix
+        """
+        self.workers = workers
+        self.queue_depth = queue_depth
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+        self._lock = threading.Lock()
+        self._admitted = 0
+        self._running = 0
+        self.completed = 0
+        self.rejected = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.total_run = 0.0
+
+    def retry_after(self):
+        """Whole seconds for a full backlog to drain (at least 1)"""
+        mean_run = self.total_run / self.completed if self.completed else 1.0
+        return max(1, math.ceil(mean_run * (self.queue_depth + self.workers) / self.workers))
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Admit a task or refuse it
+
+        Returns:
+            Future: resolves to (fn's result, seconds spent queued)
+
+        Raises:
+            PoolSaturated: The admission queue is full
+        """
+        with self._lock:
+            if self._admitted >= self.workers + self.queue_depth:
+                self.rejected += 1
+                raise PoolSaturated(self.retry_after())
+            self._admitted += 1
+        try:
+            return self.executor.submit(self._run, time.perf_counter(), fn, args, kwargs)
+        except RuntimeError:
+            with self._lock:
+                self._admitted -= 1
+            raise
+
+    def run(self, fn, *args, **kwargs):
+        """Submit a task and wait for (result, seconds spent queued)"""
+        return self.submit(fn, *args, **kwargs).result()
+
+    def _run(self, submitted, fn, args, kwargs):
+        started = time.perf_counter()
+        wait = started - submitted
+        with self._lock:
+            self._running += 1
+        try:
+            return fn(*args, **kwargs), wait
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self._running -= 1
+                self._admitted -= 1
+                self.completed += 1
+                self.total_wait += wait
+                self.max_wait = max(self.max_wait, wait)
+                self.total_run += elapsed
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+    def stats(self):
+        """Occupancy, admission and queue wait counters"""
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'queue_depth': self.queue_depth,
+                'running': self._running,
+                'queued': self._admitted - self._running,
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'mean_queue_wait_ms': round(self.total_wait / self.completed * 1000, 2) if self.completed else 0.0,
+                'max_queue_wait_ms': round(self.max_wait * 1000, 2),
+                'mean_run_ms': round(self.total_run / self.completed * 1000, 2) if self.completed else 0.0
+            }
@@ -0,0 +1,152 @@
+"""
+Per-connection state for streaming recognition
+A streaming client sends camera frames over one long-lived connection. The
+stream keeps its own face tracker, presence buffers and list of students
+already marked, so only new, drifted or stale faces are embedded and each
+student is marked once per stream. A student whose mark fails is confirmed and
+marked again
+"""
+
+import time
+from collections import deque
+import numpy as np
+
+from face_tracker import FaceTracker
+from image_io import decode_image
+
+
+class RecognitionStream:
+    """
+    Tracks faces across the frames of one stream and confirms identities
+
+    A student is confirmed once their track keeps the same identity for
+    `presence_frames` detection rounds, the same rule as the desktop loop.
+    Frames of one stream must be processed one at a time.
+    """
+
+    def __init__(self, face_system, session_id, mode, gallery_fn, fallback_to_global=False,
+                 detect_every=3, reembed_every=15):
+        """
+        Args:
+            face_system: FaceAttendanceSystem used for detection and embedding
+            session_id: Recognition session the stream belongs to
+            mode: Detection mode ("closeup" or "classroom")
+            gallery_fn: Returns the gallery to search (None for the global one)
+            fallback_to_global: Search the global gallery when the session's misses
+            detect_every: Run full detection on every N-th frame
+            reembed_every: Re-embed a tracked face at least every N frames
+        """
+        self.face_system = face_system
+        self.session_id = session_id
+        self.mode = mode
+        self.gallery_fn = gallery_fn
+        self.fallback_to_global = fallback_to_global
+        self.det_size, self.min_side = face_system.detection_plan(mode)
+        self.tracker = FaceTracker(detect_every=detect_every, reembed_every=reembed_every)
+        self.buffers = {}
+        self.reported = set()
+        # Confirmed students whose mark is being sent or queued: student_id -> mark_id
+        self.marking = {}
+        self.frames = 0
+
+    def process(self, data):
+        """
+        Decode one encoded frame and advance tracking and confirmation
+
+        Returns:
+            tuple: (frame event, [(student_id, mean confidence, track_id)]
+                   confirmed and not yet marked or being marked on this
+                   stream); report each mark's result with mark_sent()
+
+        Raises:
+            ValueError: The frame could not be decoded
+        """
+        face_system = self.face_system
+        started = time.perf_counter()
+        frame, scale = decode_image(data, min_side=self.min_side) if data else (None, 1)
+        if frame is None:
+            raise ValueError('Could not decode frame')
+        processing = {'decode_scale': scale, 'decode_ms': round((time.perf_counter() - started) * 1000, 2)}
+
+        started = time.perf_counter()
+        detected = self.tracker.is_detection_frame()
+        if detected:
+            tracks, to_embed, dropped = self.tracker.update(
+                frame, face_system.detect_faces(frame, det_size=self.det_size))
+            for track in dropped:
+                self.buffers.pop(track.track_id, None)
+
+            # Faces failing the quality gate are retried on a later detection
+            to_embed = [track for track in to_embed if face_system.gate_faces(frame, [track.face])[0]]
+            if to_embed:
+                embeddings = face_system.embed_faces(frame, [track.face for track in to_embed])
+                matches = face_system.recognize_faces_batch(
+                    embeddings,
+                    one_to_one=True,
+                    gallery=self.gallery_fn(),
+                    fallback_to_global=self.fallback_to_global
+                )
+                for track, (student_id, confidence) in zip(to_embed, matches):
+                    if student_id != track.student_id:
+                        self.buffers.pop(track.track_id, None)
+                    track.assign(student_id, confidence, self.tracker.frame_index)
+
+            for track in tracks:
+                if track.student_id and track.seen_at == self.tracker.frame_index:
+                    buffer = self.buffers.setdefault(track.track_id, deque(maxlen=face_system.presence_frames))
+                    buffer.append(track.confidence)
+        else:
+            tracks, _, _ = self.tracker.update(frame)
+        processing['step'] = 'detect' if detected else 'track'
+        processing['inference_ms'] = round((time.perf_counter() - started) * 1000, 2)
+
+        faces, confirmed = [], []
+        for track in tracks:
+            buffer = self.buffers.get(track.track_id, ())
+            is_confirmed = bool(track.student_id) and len(buffer) >= face_system.presence_frames
+            faces.append({
+                'track_id': track.track_id,
+                'bbox': (track.bbox * scale).astype(int).tolist(),
+                'student_id': track.student_id,
+                'confidence': float(track.confidence),
+                'confirmed': is_confirmed
+            })
+            if is_confirmed and track.student_id not in self.reported and track.student_id not in self.marking:
+                self.marking[track.student_id] = None
+                confirmed.append((track.student_id, float(np.mean(buffer)), track.track_id))
+
+        self.frames += 1
+        return {
+            'type': 'frame',
+            'frame': self.frames,
+            'faces': faces,
+            'processing': processing
+        }, confirmed
+
+    def mark_sent(self, student_id, result):
+        """
+        Record the result of a confirmed student's attendance mark
+
+        Args:
+            student_id: Student returned as confirmed by process()
+            result: Mark result (success, or pending with a mark_id)
+        """
+        if result.get('pending'):
+            self.marking[student_id] = result['mark_id']
+        elif result.get('success'):
+            self.marking.pop(student_id, None)
+            self.reported.add(student_id)
+        else:
+            self.release(student_id)
+
+    def queued_marks(self):
+        """(student_id, mark_id) of the queued marks not settled yet"""
+        return [(student_id, mark_id) for student_id, mark_id in self.marking.items() if mark_id]
+
+    def release(self, student_id):
+        """Forget a failed mark; the student is marked again once re-confirmed"""
+        self.marking.pop(student_id, None)
+        self.reported.discard(student_id)
+        for track in self.tracker.tracks:
+            if track.student_id == student_id:
+                self.buffers.pop(track.track_id, None)
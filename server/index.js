@@ -3,6 +3,7 @@ import cors from 'cors'
 import jwt from 'jsonwebtoken'
 import QRCode from 'qrcode'
 import http from 'http'
+import net from 'net'
 import { Server as SocketIOServer } from 'socket.io'
 import path from 'path'
 import { fileURLToPath } from 'url'
@@ -14,7 +15,8 @@ const server = http.createServer(app)
 const allowedOrigins = (process.env.CORS_ORIGIN || '*')
   .split(',')
   .map(s => s.trim())
-const io = new SocketIOServer(server, { cors: { origin: allowedOrigins, methods: ['GET','POST'] } })
+// destroyUpgrade: false leaves other upgrade paths (face recognition stream) to their own handlers
+const io = new SocketIOServer(server, { cors: { origin: allowedOrigins, methods: ['GET','POST'] }, destroyUpgrade: false })
 
 // WebSocket connection handling for real-time updates
 io.on('connection', (socket) => {
@@ -3776,6 +3778,37 @@ function calculateDuration(startDate, endDate) {
 // Face Recognition Integration Endpoints
 const FACE_SERVICE_URL = process.env.FACE_SERVICE_URL || 'http://localhost:5001'
 
+// Streaming face recognition: tunnel WebSocket upgrades on /face-recognition/stream
+// to the face service's /recognize/stream (served by face_recognition_asgi.py)
+server.on('upgrade', (req, socket, head) => {
+  const { pathname, search } = new URL(req.url, 'http://localhost')
+  if (pathname.startsWith('/socket.io/')) return
+  if (pathname !== '/face-recognition/stream') {
+    socket.destroy()
+    return
+  }
+
+  const target = new URL(FACE_SERVICE_URL)
+  const upstream = net.connect(Number(target.port) || 80, target.hostname, () => {
+    const headers = []
+    for (let i = 0; i < req.rawHeaders.length; i += 2) {
+      if (req.rawHeaders[i].toLowerCase() !== 'host') {
+        headers.push(`${req.rawHeaders[i]}: ${req.rawHeaders[i + 1]}`)
+      }
+    }
+    upstream.write(`GET /recognize/stream${search} HTTP/1.1\r\nHost: ${target.host}\r\n${headers.join('\r\n')}\r\n\r\n`)
+    if (head && head.length) upstream.write(head)
+    upstream.pipe(socket)
+    socket.pipe(upstream)
+  })
+  upstream.on('error', (err) => {
+    console.warn('[FACE] Recognition stream tunnel error:', err.message)
+    socket.destroy()
+  })
+  socket.on('error', () => upstream.destroy())
+  socket.on('close', () => upstream.destroy())
+})
+
 // Start face recognition session
 app.post('/face-recognition/session/start', async (req, res) => {
   try {
@@ -3845,132 +3878,141 @@ app.post('/face-recognition/session/start', async (req, res) => {
   }
 })
 
-// Handle face recognition attendance
-app.post('/attendance/face-recognition', async (req, res) => {
-  try {
-    const { sessionId, studentId, confidence, source, department, year, timestamp } = req.body
-    
-    if (!sessionId || !studentId) {
-      return res.status(400).json({ error: 'missing_required_fields' })
-    }
-    
-    // Verify session exists and is active
-    const session = sessions.get(sessionId)
-    if (!session) {
-      return res.status(404).json({ error: 'session_not_found' })
-    }
-    
-    if (session.status !== 'active') {
-      return res.status(400).json({ error: 'session_not_active' })
-    }
-    
-    // Check if student is enrolled
-    const enrolled = await dbIsEnrolled(session.courseId, studentId)
-    if (!enrolled) {
-      return res.status(403).json({ error: 'student_not_enrolled' })
-    }
-    
-    const targetDepartment = session.sessionDepartment || department
-    const targetYear = session.sessionYear || year
+// Validate and record one face recognition attendance mark.
+// Shared by the single and bulk routes; returns the HTTP status and body.
+const faceMarkResult = (status, body) => ({ status, body })
 
-    // Check hierarchical access (same as QR scan)
-    const student = await dbGetStudentByRegNo(studentId)
-    if (student) {
-      const studentDept = student.department || 'Computer Science'
-      const studentYear = student.year || '4th Year'
-      
-      if (targetDepartment && targetYear && (studentDept !== targetDepartment || studentYear !== targetYear)) {
-        console.log(`Face recognition access denied: Student ${studentId} (${studentDept} ${studentYear}) tried to access ${targetDepartment} ${targetYear} session`)
-        return res.status(403).json({ 
-          error: 'access_denied',
-          message: `Access denied. This session is for ${targetDepartment} ${targetYear} students only.`,
-          studentDepartment: studentDept,
-          studentYear: studentYear,
-          sessionDepartment: targetDepartment,
-          sessionYear: targetYear
-        })
-      }
-    }
-    
-    if (!session.pendingFace) session.pendingFace = new Map()
-    const pending = session.pendingFace.get(studentId)
-    const now = Date.now()
-    if (!pending) {
-      return res.status(409).json({
-        error: 'qr_step_required',
-        message: 'Please scan the QR code first to unlock face verification.'
-      })
-    }
-    if (pending.expiresAt && now > pending.expiresAt) {
-      session.pendingFace.delete(studentId)
-      return res.status(410).json({
-        error: 'face_window_expired',
-        message: 'Face verification window expired. Please scan the QR code again.'
-      })
-    }
+async function markFaceAttendance(mark) {
+  const { sessionId, studentId, confidence, department, year } = mark
+  
+  if (!sessionId || !studentId) {
+    return faceMarkResult(400, { error: 'missing_required_fields' })
+  }
+  
+  // Verify session exists and is active
+  const session = sessions.get(sessionId)
+  if (!session) {
+    return faceMarkResult(404, { error: 'session_not_found' })
+  }
+  
+  if (session.status !== 'active') {
+    return faceMarkResult(400, { error: 'session_not_active' })
+  }
+  
+  // Check if student is enrolled
+  const enrolled = await dbIsEnrolled(session.courseId, studentId)
+  if (!enrolled) {
+    return faceMarkResult(403, { error: 'student_not_enrolled' })
+  }
+  
+  const targetDepartment = session.sessionDepartment || department
+  const targetYear = session.sessionYear || year
 
-    // Check if already marked present
-    if (session.present.has(studentId)) {
-      return res.status(409).json({ 
-        error: 'already_present',
-        message: 'Student already marked present in this session'
-      })
-    }
-    
-    // Mark present
-    session.present.add(studentId)
-    session.pendingFace.delete(studentId)
+  // Check hierarchical access (same as QR scan)
+  const student = await dbGetStudentByRegNo(studentId)
+  if (student) {
+    const studentDept = student.department || 'Computer Science'
+    const studentYear = student.year || '4th Year'
     
-    // Save to database
-    try {
-      await dbMarkPresent(sessionId, studentId)
-    } catch (dbError) {
-      console.error('Database error marking present:', dbError)
+    if (targetDepartment && targetYear && (studentDept !== targetDepartment || studentYear !== targetYear)) {
+      console.log(`Face recognition access denied: Student ${studentId} (${studentDept} ${studentYear}) tried to access ${targetDepartment} ${targetYear} session`)
+      return faceMarkResult(403, { 
+        error: 'access_denied',
+        message: `Access denied. This session is for ${targetDepartment} ${targetYear} students only.`,
+        studentDepartment: studentDept,
+        studentYear: studentYear,
+        sessionDepartment: targetDepartment,
+        sessionYear: targetYear
+      })
     }
-    
-    const markedAt = new Date().toISOString()
-    
-    // Broadcast attendance update
-    io.to(`session:${sessionId}`).emit('face_recognition_attendance', {
-      sessionId,
-      studentId,
-      confidence,
-      markedAt,
-      countPresent: session.present.size,
-      countRemaining: Math.max(0, session.enrolled.size - session.present.size)
-    })
-
-    io.to(`session:${sessionId}`).emit('scan_confirmed', {
-      sessionId,
-      countPresent: session.present.size,
-      countRemaining: Math.max(0, session.enrolled.size - session.present.size)
+  }
+  
+  // Check if already marked present (before the QR step, which is consumed on success,
+  // so a resent mark reports already_present)
+  if (session.present.has(studentId)) {
+    return faceMarkResult(409, { 
+      error: 'already_present',
+      message: 'Student already marked present in this session'
     })
-    
-    // Broadcast to admin panel
-    broadcastAdminUpdate('face_attendance_marked', {
-      sessionId,
-      studentId,
-      confidence,
-      source: 'face_recognition',
-      markedAt,
-      timestamp: Date.now()
+  }
+  
+  if (!session.pendingFace) session.pendingFace = new Map()
+  const pending = session.pendingFace.get(studentId)
+  const now = Date.now()
+  if (!pending) {
+    return faceMarkResult(409, {
+      error: 'qr_step_required',
+      message: 'Please scan the QR code first to unlock face verification.'
     })
-    
-    console.log(`Face recognition attendance: Student ${studentId} marked present in session ${sessionId} (${targetDepartment || 'Unknown'} ${targetYear || 'Unknown'}) (confidence: ${confidence})`)
-    
-    return res.json({
-      success: true,
-      status: 'present',
-      sessionId,
-      studentId,
-      markedAt,
-      confidence,
-      source: 'face_recognition',
-      sessionDepartment: targetDepartment,
-      sessionYear: targetYear,
-      message: 'Attendance marked successfully via face recognition'
+  }
+  if (pending.expiresAt && now > pending.expiresAt) {
+    session.pendingFace.delete(studentId)
+    return faceMarkResult(410, {
+      error: 'face_window_expired',
+      message: 'Face verification window expired. Please scan the QR code again.'
     })
-    
+  }
+
+  // Mark present
+  session.present.add(studentId)
+  session.pendingFace.delete(studentId)
+  
+  // Save to database
+  try {
+    await dbMarkPresent(sessionId, studentId)
+  } catch (dbError) {
+    console.error('Database error marking present:', dbError)
+  }
+  
+  const markedAt = new Date().toISOString()
+  
+  // Broadcast attendance update
+  io.to(`session:${sessionId}`).emit('face_recognition_attendance', {
+    sessionId,
+    studentId,
+    confidence,
+    markedAt,
+    countPresent: session.present.size,
+    countRemaining: Math.max(0, session.enrolled.size - session.present.size)
+  })
+
+  io.to(`session:${sessionId}`).emit('scan_confirmed', {
+    sessionId,
+    countPresent: session.present.size,
+    countRemaining: Math.max(0, session.enrolled.size - session.present.size)
+  })
+  
+  // Broadcast to admin panel
+  broadcastAdminUpdate('face_attendance_marked', {
+    sessionId,
+    studentId,
+    confidence,
+    source: 'face_recognition',
+    markedAt,
+    timestamp: Date.now()
+  })
+  
+  console.log(`Face recognition attendance: Student ${studentId} marked present in session ${sessionId} (${targetDepartment || 'Unknown'} ${targetYear || 'Unknown'}) (confidence: ${confidence})`)
+  
+  return faceMarkResult(200, {
+    success: true,
+    status: 'present',
+    sessionId,
+    studentId,
+    markedAt,
+    confidence,
+    source: 'face_recognition',
+    sessionDepartment: targetDepartment,
+    sessionYear: targetYear,
+    message: 'Attendance marked successfully via face recognition'
+  })
+}
+
+// Handle face recognition attendance
+app.post('/attendance/face-recognition', async (req, res) => {
+  try {
+    const { status, body } = await markFaceAttendance(req.body || {})
+    return res.status(status).json(body)
   } catch (error) {
     console.error('Face recognition attendance error:', error)
     return res.status(500).json({ 
@@ -3980,6 +4022,40 @@ app.post('/attendance/face-recognition', async (req, res) => {
   }
 })
 
+// Handle a batch of face recognition marks (the face service's write-behind queue).
+// Each result carries the mark's id and the status the single-mark route would return.
+const FACE_BULK_MAX_MARKS = Number(process.env.FACE_BULK_MAX_MARKS || 500)
+
+app.post('/attendance/face-recognition/bulk', async (req, res) => {
+  const { marks } = req.body || {}
+  if (!Array.isArray(marks) || marks.length === 0) {
+    return res.status(400).json({ error: 'missing_marks' })
+  }
+  if (marks.length > FACE_BULK_MAX_MARKS) {
+    return res.status(413).json({
+      error: 'too_many_marks',
+      message: `At most ${FACE_BULK_MAX_MARKS} marks per request`
+    })
+  }
+
+  // Marks are applied in order so duplicates within a batch resolve like separate requests
+  const results = []
+  for (const mark of marks) {
+    const id = mark && mark.id
+    try {
+      const { status, body } = await markFaceAttendance(mark || {})
+      results.push({ ...body, id, status, success: status === 200 })
+    } catch (error) {
+      console.error('Face recognition bulk attendance error:', error)
+      results.push({ id, status: 500, success: false, error: 'internal_error' })
+    }
+  }
+
+  const marked = results.filter(result => result.success).length
+  console.log(`Face recognition bulk attendance: ${marked}/${results.length} marks recorded`)
+  return res.json({ success: true, count: results.length, marked, results })
+})
+
 // Get face recognition service status
 app.get('/face-recognition/status', async (req, res) => {
   try {
@@ -4111,6 +4187,21 @@ app.post('/face-recognition/recognize', async (req, res) => {
   }
 })
 
+// Delivery status of a write-behind attendance mark (pending, marked, rejected or failed)
+app.get('/face-recognition/attendance/marks/:markId', async (req, res) => {
+  try {
+    const response = await fetch(`${FACE_SERVICE_URL}/attendance/marks/${encodeURIComponent(req.params.markId)}`)
+    const result = await response.json()
+    return res.status(response.status).json(result)
+  } catch (error) {
+    console.error('Face recognition mark status proxy error:', error)
+    return res.status(503).json({
+      error: 'service_unavailable',
+      message: 'Cannot connect to face recognition service'
+    })
+  }
+})
+
 // Get enrolled students for face recognition
 app.get('/face-recognition/students', async (req, res) => {
   try {
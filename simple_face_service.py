@@ -6,12 +6,13 @@ Uses basic OpenCV face detection instead of insightface
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 import cv2
-import base64
 import numpy as np
 import json
 import os
 from datetime import datetime
 import logging
+from image_uploads import read_image_request, stream_images
+from http_client import PooledHTTPClient
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -23,6 +24,12 @@ CORS(app, origins=["http://localhost:5173", "http://localhost:3000", "http://loc
 # Configuration
 SERVICE_PORT = int(os.getenv('FACE_SERVICE_PORT', '5001'))
 MAIN_SERVER_URL = os.getenv('MAIN_SERVER_URL', 'http://localhost:3001')
+main_server = PooledHTTPClient(
+    MAIN_SERVER_URL,
+    pool_size=int(os.getenv('MAIN_SERVER_POOL_SIZE', '10')),
+    connect_timeout=float(os.getenv('MAIN_SERVER_CONNECT_TIMEOUT', '2')),
+    read_timeout=float(os.getenv('MAIN_SERVER_READ_TIMEOUT', '5'))
+)
 DATA_DIR = "face_data"
 ENROLLED_STUDENTS_FILE = os.path.join(DATA_DIR, "enrolled_students.json")
 
@@ -159,6 +166,7 @@ def health_check():
         'using': 'OpenCV Haar Cascades' + (' + LBPH Face Recognizer' if face_recognizer is not None else ' + Histogram Matching'),
         'recognizer_trained': face_recognizer_trained,
         'enrolled_count': len(load_enrolled_students()),
+        'main_server_http': main_server.stats(),
         'timestamp': datetime.now().isoformat()
     })
 
@@ -191,19 +199,19 @@ def enroll_student():
         "email": "student@example.com",
         "images": ["base64_image1", "base64_image2", ...]
     }
+    or multipart/form-data with the same fields followed by binary "images"
+    parts, or a raw image/jpeg body with the fields as query arguments
     """
     try:
-        data = request.get_json()
+        data, images = stream_images(request, 'images')
         student_id = data.get('student_id')
         student_name = data.get('name', student_id)
         department = data.get('department', 'Unknown')
         email = data.get('email', '')
-        images_b64 = data.get('images', [])
         
         logger.info(f"Enrolling student: {student_name} ({student_id})")
-        logger.info(f"Received {len(images_b64)} images")
         
-        if not student_id or not images_b64:
+        if not student_id:
             return jsonify({
                 'error': 'invalid_request',
                 'message': 'Missing student_id or images'
@@ -215,12 +223,15 @@ def enroll_student():
         
         faces_detected = 0
         images_saved = 0
+        images_received = 0
         
-        # Process each image
-        for i, img_b64 in enumerate(images_b64):
+        # Process each image as it arrives
+        for i, img_data in enumerate(images):
+            images_received += 1
             try:
-                # Decode base64 image
-                img_data = base64.b64decode(img_b64.split(',')[1] if ',' in img_b64 else img_b64)
+                if not img_data:
+                    logger.warning(f"Could not decode image {i+1}")
+                    continue
                 nparr = np.frombuffer(img_data, np.uint8)
                 frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
                 
@@ -246,11 +257,18 @@ def enroll_student():
                 logger.error(f"Error processing image {i+1}: {e}")
                 continue
         
+        logger.info(f"Received {images_received} images")
+        if images_received == 0:
+            return jsonify({
+                'error': 'invalid_request',
+                'message': 'Missing student_id or images'
+            }), 400
+        
         if faces_detected == 0:
             return jsonify({
                 'error': 'no_faces_detected',
                 'message': 'No faces were detected in the provided images. Please ensure good lighting and face visibility.',
-                'images_processed': len(images_b64),
+                'images_processed': images_received,
                 'faces_found': 0
             }), 400
         
@@ -288,7 +306,7 @@ def enroll_student():
             'message': f'Successfully enrolled {student_name}',
             'student_id': student_id,
             'name': student_name,
-            'images_processed': len(images_b64),
+            'images_processed': images_received,
             'faces_detected': faces_detected,
             'images_saved': images_saved
         }), 200
@@ -313,8 +331,7 @@ def mark_attendance(session_id, student_id, department, year):
             'year': year,
             'timestamp': datetime.now().isoformat()
         }
-        import requests
-        resp = requests.post(f"{MAIN_SERVER_URL}/attendance/face-recognition", json=payload, timeout=5)
+        resp = main_server.post('/attendance/face-recognition', json=payload)
         if resp.status_code == 200:
             return True, resp.json()
         try:
@@ -334,20 +351,20 @@ def recognize_faces():
     - Detects face
     - If expected_student_id provided and enrolled, treat as recognized
     - Marks attendance via main server endpoint
+    Accepts JSON with a base64 "image", multipart/form-data with a binary
+    "image" part, or a raw image/jpeg body with the fields as query arguments
     """
     try:
-        data = request.get_json()
-        image_b64 = data.get('image')
+        data, img_data, _ = read_image_request(request, 'image')
         expected_id = str(data.get('expected_student_id') or '').strip()
         session_id = data.get('session_id') or ''
         department = data.get('department') or 'Computer Science'
         year = data.get('year') or '4th Year'
         
-        if not image_b64:
+        if not img_data:
             return jsonify({'error': 'Missing image'}), 400
         
         # Decode and detect faces
-        img_data = base64.b64decode(image_b64.split(',')[1] if ',' in image_b64 else image_b64)
         nparr = np.frombuffer(img_data, np.uint8)
         frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
         
@@ -1,6 +1,33 @@
 import React, { useRef, useEffect, useState, useCallback } from 'react'
 import { apiPost, apiGet } from './api.js'
 
+// Upper bound on frames sent over the recognition stream
+const STREAM_MAX_FPS = 10
+// Queued (write-behind) attendance marks are polled until the main system
+// has recorded or rejected them
+const MARK_POLL_INTERVAL_MS = 500
+const MARK_POLL_TIMEOUT_MS = 30000
+
+// Final outcome of a queued mark: { status: 'marked' | 'rejected' | 'failed' | 'pending', ... }
+// ('pending' only when the mark is still undelivered at the timeout)
+async function waitForMark(markId) {
+  const deadline = Date.now() + MARK_POLL_TIMEOUT_MS
+  while (Date.now() < deadline) {
+    await new Promise(resolve => setTimeout(resolve, MARK_POLL_INTERVAL_MS))
+    try {
+      const response = await fetch(`/face-recognition/attendance/marks/${encodeURIComponent(markId)}`)
+      const outcome = await response.json()
+      if (!response.ok) {
+        return { status: 'failed', message: outcome.error || outcome.message }
+      }
+      if (outcome.status !== 'pending') return outcome
+    } catch (error) {
+      console.warn('Failed to check attendance mark:', error)
+    }
+  }
+  return { status: 'pending', message: 'Attendance is still being recorded. Check the attendance list shortly.' }
+}
+
 export default function FaceRecognitionCamera({ 
   sessionId, 
   courseId = '21CS701',
@@ -23,6 +50,9 @@ export default function FaceRecognitionCamera({
   })
   const [serviceStatus, setServiceStatus] = useState(null)
   const recognitionIntervalRef = useRef(null)
+  const recognitionSocketRef = useRef(null)
+  // Set while a queued attendance mark is being confirmed
+  const pendingMarkRef = useRef(false)
   const streamRef = useRef(null)
 
   // Check face recognition service status
@@ -114,6 +144,150 @@ export default function FaceRecognitionCamera({
     }
   }, [sessionId, courseId, department, year])
 
+  // Stop polling and close the recognition stream
+  const stopRecognitionLoop = useCallback(() => {
+    if (recognitionIntervalRef.current) {
+      clearInterval(recognitionIntervalRef.current)
+      recognitionIntervalRef.current = null
+    }
+    if (recognitionSocketRef.current) {
+      const socket = recognitionSocketRef.current
+      recognitionSocketRef.current = null
+      socket.close()
+    }
+  }, [])
+
+  // Attendance marked: report it and close the camera
+  const finishRecognition = useCallback((result) => {
+    setRecognitionState(prev => ({
+      ...prev,
+      isProcessing: false,
+      lastRecognition: result.student_id,
+      confidence: result.confidence,
+      message: 'Face detected, attendance marked'
+    }))
+
+    // Stop recognition
+    stopRecognitionLoop()
+
+    if (onRecognitionSuccess) {
+      onRecognitionSuccess({
+        studentId: result.student_id,
+        confidence: result.confidence,
+        markedAt: result.marked_at,
+        alreadyMarked: result.already_marked
+      })
+    }
+
+    // Auto-close after success
+    setTimeout(() => {
+      if (onClose) onClose()
+    }, 3000)
+  }, [stopRecognitionLoop, onRecognitionSuccess, onClose])
+
+  // Recognized, but the mark is only queued: report success once it is recorded
+  const settleQueuedMark = useCallback(async (result) => {
+    pendingMarkRef.current = true
+    setRecognitionState(prev => ({ ...prev, message: 'Face recognized, attendance queued...' }))
+    const outcome = await waitForMark(result.mark_id)
+    pendingMarkRef.current = false
+    if (outcome.status === 'marked') {
+      finishRecognition({
+        ...result,
+        marked_at: outcome.marked_at,
+        already_marked: outcome.error === 'already_present'
+      })
+    } else {
+      const message = outcome.message || outcome.error || 'Attendance logging failed.'
+      setRecognitionState(prev => ({ ...prev, isProcessing: false, message }))
+      if (onRecognitionError) onRecognitionError(message)
+    }
+  }, [finishRecognition, onRecognitionError])
+
+  // Stream frames over a WebSocket; the server tracks faces across frames and
+  // pushes events, so each frame skips the per-request setup of /recognize.
+  // Resolves false when the stream cannot be opened.
+  const startRecognitionStream = useCallback(() => new Promise((resolve) => {
+    const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:'
+    const params = new URLSearchParams({ session_id: sessionId })
+    const socket = new WebSocket(`${protocol}//${window.location.host}/face-recognition/stream?${params}`)
+    recognitionSocketRef.current = socket
+    let ready = false
+    let lastSent = 0
+
+    // One frame in flight: the next is captured once the previous is answered
+    const sendFrame = (delay = 0) => {
+      const wait = Math.max(delay, lastSent + 1000 / STREAM_MAX_FPS - Date.now(), 0)
+      setTimeout(() => {
+        const video = videoRef.current
+        const canvas = canvasRef.current
+        if (socket.readyState !== WebSocket.OPEN || !video || !canvas) return
+        canvas.width = video.videoWidth
+        canvas.height = video.videoHeight
+        canvas.getContext('2d').drawImage(video, 0, 0, canvas.width, canvas.height)
+        canvas.toBlob((blob) => {
+          if (blob && socket.readyState === WebSocket.OPEN) {
+            lastSent = Date.now()
+            socket.send(blob)
+          }
+        }, 'image/jpeg', 0.8)
+      }, wait)
+    }
+
+    socket.onmessage = (message) => {
+      const event = JSON.parse(message.data)
+      if (event.type === 'ready') {
+        ready = true
+        resolve(true)
+        sendFrame()
+      } else if (event.type === 'frame') {
+        const face = event.faces[0]
+        // Keep the "queued" message up while a mark is being confirmed
+        if (!pendingMarkRef.current) {
+          setRecognitionState(prev => ({
+            ...prev,
+            confidence: face && face.student_id ? face.confidence : 0,
+            message: !face
+              ? 'No face detected. Please position your face in the camera.'
+              : face.student_id ? 'Face detected, verifying...' : "Didn't recognize your face"
+          }))
+        }
+        sendFrame()
+      } else if (event.type === 'recognized') {
+        setRecognitionState(prev => ({ ...prev, message: 'Face recognized, marking attendance...' }))
+      } else if (event.type === 'attendance') {
+        if (event.success) {
+          finishRecognition(event)
+        } else if (event.attendance_status === 'pending' && event.mark_id) {
+          // Frames keep flowing while the queued mark is delivered
+          settleQueuedMark(event)
+        } else {
+          setRecognitionState(prev => ({ ...prev, message: event.message || 'Attendance logging failed.' }))
+          if (onRecognitionError) onRecognitionError(event.message || 'Attendance logging failed.')
+        }
+      } else if (event.type === 'overloaded') {
+        sendFrame(event.retry_after * 1000)
+      } else if (event.type === 'error' && ready) {
+        console.warn('Recognition stream error:', event.message)
+        sendFrame()
+      }
+    }
+
+    socket.onclose = () => {
+      // Closed by stopRecognitionLoop: nothing to fall back to or report
+      const stopped = recognitionSocketRef.current !== socket
+      if (!stopped) recognitionSocketRef.current = null
+      if (!ready) {
+        resolve(stopped)
+      } else if (!stopped) {
+        setRecognitionState(prev => ({
+          ...prev,
+          message: 'Recognition stream closed. Click Start to continue.'
+        }))
+      }
+    }
+  }), [sessionId, finishRecognition, settleQueuedMark, onRecognitionError])
+
   // Capture and process frame
   const captureAndRecognize = useCallback(async () => {
     if (!videoRef.current || !canvasRef.current || !isActive || recognitionState.isProcessing) {
@@ -159,34 +333,10 @@ export default function FaceRecognitionCamera({
 
       if (result.success && result.student_id) {
         // Recognition successful
-        setRecognitionState(prev => ({
-          ...prev,
-          isProcessing: false,
-          lastRecognition: result.student_id,
-          confidence: result.confidence,
-          message: 'Face detected, attendance marked'
-        }))
-
-        // Stop recognition
-        if (recognitionIntervalRef.current) {
-          clearInterval(recognitionIntervalRef.current)
-          recognitionIntervalRef.current = null
-        }
-
-        if (onRecognitionSuccess) {
-          onRecognitionSuccess({
-            studentId: result.student_id,
-            confidence: result.confidence,
-            markedAt: result.marked_at,
-            alreadyMarked: result.already_marked
-          })
-        }
-
-        // Auto-close after success
-        setTimeout(() => {
-          if (onClose) onClose()
-        }, 3000)
-
+        finishRecognition(result)
+      } else if (result.attendance_status === 'pending' && result.mark_id) {
+        // isProcessing stays set, so no new frame is sent until the mark settles
+        await settleQueuedMark(result)
       } else if (result.faces_detected === 0) {
         setRecognitionState(prev => ({
           ...prev,
@@ -215,14 +365,13 @@ export default function FaceRecognitionCamera({
         onRecognitionError('Recognition service error')
       }
     }
-  }, [isActive, recognitionState.isProcessing, sessionId, onRecognitionSuccess, onRecognitionError, onClose])
+  }, [isActive, recognitionState.isProcessing, sessionId, finishRecognition, settleQueuedMark, onRecognitionError])
 
   // Start/stop recognition loop
-  const toggleRecognition = useCallback(() => {
-    if (recognitionIntervalRef.current) {
+  const toggleRecognition = useCallback(async () => {
+    if (recognitionIntervalRef.current || recognitionSocketRef.current) {
       // Stop recognition
-      clearInterval(recognitionIntervalRef.current)
-      recognitionIntervalRef.current = null
+      stopRecognitionLoop()
       setRecognitionState(prev => ({
         ...prev,
         message: 'Recognition paused. Click Start to continue.'
@@ -233,9 +382,12 @@ export default function FaceRecognitionCamera({
         ...prev,
         message: 'Scanning for faces...'
       }))
-      recognitionIntervalRef.current = setInterval(captureAndRecognize, 2000) // Every 2 seconds - optimized for fast recognition
+      // Prefer the streaming endpoint; poll /recognize when it is unavailable
+      if (!(await startRecognitionStream())) {
+        recognitionIntervalRef.current = setInterval(captureAndRecognize, 2000) // Every 2 seconds - optimized for fast recognition
+      }
     }
-  }, [captureAndRecognize])
+  }, [captureAndRecognize, startRecognitionStream, stopRecognitionLoop])
 
   // Initialize everything
   useEffect(() => {
@@ -247,10 +399,10 @@ export default function FaceRecognitionCamera({
 
   // Auto-start recognition when camera is ready
   useEffect(() => {
-    if (isActive && status === 'ready' && !recognitionIntervalRef.current) {
+    if (isActive && status === 'ready' && !recognitionIntervalRef.current && !recognitionSocketRef.current) {
       // Auto-start recognition after 2 seconds
       setTimeout(() => {
-        if (!recognitionIntervalRef.current) {
+        if (!recognitionIntervalRef.current && !recognitionSocketRef.current) {
           toggleRecognition()
         }
       }, 2000)
@@ -263,6 +415,9 @@ export default function FaceRecognitionCamera({
       if (recognitionIntervalRef.current) {
         clearInterval(recognitionIntervalRef.current)
       }
+      if (recognitionSocketRef.current) {
+        recognitionSocketRef.current.close()
+      }
       if (streamRef.current) {
         streamRef.current.getTracks().forEach(track => track.stop())
       }
@@ -355,12 +510,12 @@ export default function FaceRecognitionCamera({
             onClick={toggleRecognition}
             disabled={!isActive || status !== 'ready'}
             className={`flex-1 py-2 px-4 rounded-lg font-medium ${
-              recognitionIntervalRef.current
+              recognitionIntervalRef.current || recognitionSocketRef.current
                 ? 'bg-red-500 hover:bg-red-600 text-white'
                 : 'bg-blue-500 hover:bg-blue-600 text-white disabled:bg-gray-300'
             }`}
           >
-            {recognitionIntervalRef.current ? 'Stop Recognition' : 'Start Recognition'}
+            {recognitionIntervalRef.current || recognitionSocketRef.current ? 'Stop Recognition' : 'Start Recognition'}
           </button>
           
           <button
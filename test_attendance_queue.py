@@ -0,0 +1,187 @@
+"""
+Write-behind attendance queue: delivery outcomes, 5xx retry with backoff and
+replay of the on-disk spool after a restart
+"""
+
+import json
+import threading
+import time
+
+import pytest
+import requests
+
+from attendance_queue import AttendanceQueue
+
+
+class FakeResponse:
+    def __init__(self, status_code, body=None):
+        self.status_code = status_code
+        self.body = body or {}
+        self.text = json.dumps(self.body)
+
+    def json(self):
+        return self.body
+
+
+class FakeMainServer:
+    """
+    Bulk route answering each mark by calling `reply(mark, call_number)`
+
+    reply returns a per-item result dict, or raises for a failed request.
+    """
+
+    def __init__(self, reply):
+        self.reply = reply
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def post(self, path, json=None):
+        with self.lock:
+            self.calls.append((time.monotonic(), json['marks']))
+            call = len(self.calls)
+        results = [dict(self.reply(mark, call), id=mark['id']) for mark in json['marks']]
+        return FakeResponse(200, {'results': results})
+
+
+def marked(mark, call):
+    return {'status': 201, 'success': True, 'marked_at': 'now'}
+
+
+def make_queue(tmp_path, server, **options):
+    options = dict({'flush_interval': 0.01, 'backoff_base': 0.05, 'max_attempts': 4}, **options)
+    return AttendanceQueue(server, str(tmp_path / 'spool.jsonl'), **options)
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def settled(queue, mark_id):
+    return lambda: (queue.status(mark_id) or {}).get('status', 'pending') != 'pending'
+
+
+def test_marks_are_batched_and_delivered(tmp_path):
+    results = []
+    server = FakeMainServer(marked)
+    queue = make_queue(tmp_path, server, flush_interval=0.1,
+                       on_result=lambda mark, outcome: results.append((mark['studentId'], outcome['status'])))
+    queue.start()
+    try:
+        ids = [queue.enqueue({'studentId': f's{i}'}) for i in range(3)]
+        assert wait_for(lambda: all(settled(queue, mark_id)() for mark_id in ids))
+    finally:
+        queue.close()
+
+    assert [queue.status(mark_id)['status'] for mark_id in ids] == ['marked'] * 3
+    assert queue.status(ids[0])['marked_at'] == 'now'
+    assert len(server.calls) == 1
+    assert sorted(results) == [('s0', 'marked'), ('s1', 'marked'), ('s2', 'marked')]
+    assert queue.stats()['marked'] == 3
+    assert queue.status('unknown') is None
+
+
+@pytest.mark.parametrize('reply, status', [
+    ({'status': 409, 'success': False, 'error': 'already_present'}, 'marked'),
+    ({'status': 404, 'success': False, 'error': 'not_enrolled'}, 'rejected'),
+])
+def test_final_replies_below_500(tmp_path, reply, status):
+    server = FakeMainServer(lambda mark, call: reply)
+    queue = make_queue(tmp_path, server).start()
+    try:
+        mark_id = queue.enqueue({'studentId': 's1'})
+        assert wait_for(settled(queue, mark_id))
+    finally:
+        queue.close()
+    assert queue.status(mark_id)['status'] == status
+    assert queue.status(mark_id)['http_status'] == reply['status']
+    # Final outcomes are never retried
+    assert len(server.calls) == 1
+
+
+def test_5xx_items_are_retried_with_backoff(tmp_path):
+    def flaky(mark, call):
+        if call < 3:
+            return {'status': 503, 'success': False, 'error': 'busy'}
+        return marked(mark, call)
+
+    server = FakeMainServer(flaky)
+    queue = make_queue(tmp_path, server, backoff_base=0.05).start()
+    try:
+        mark_id = queue.enqueue({'studentId': 's1'})
+        assert wait_for(settled(queue, mark_id))
+    finally:
+        queue.close()
+
+    assert queue.status(mark_id)['status'] == 'marked'
+    assert queue.stats()['retries'] == 2
+    sent_at = [at for at, _ in server.calls]
+    # Exponential backoff: 0.05s, then 0.1s
+    assert sent_at[1] - sent_at[0] >= 0.05
+    assert sent_at[2] - sent_at[1] >= 0.1
+
+
+def test_network_errors_give_up_after_max_attempts(tmp_path):
+    results = []
+
+    class Unreachable:
+        calls = 0
+
+        def post(self, path, json=None):
+            Unreachable.calls += 1
+            raise requests.exceptions.ConnectionError('connection refused')
+
+    queue = make_queue(tmp_path, Unreachable(), backoff_base=0.01, max_attempts=3,
+                       on_result=lambda mark, outcome: results.append(outcome['status'])).start()
+    try:
+        mark_id = queue.enqueue({'studentId': 's1'})
+        assert wait_for(settled(queue, mark_id))
+    finally:
+        queue.close()
+
+    assert queue.status(mark_id)['status'] == 'failed'
+    assert 'connection refused' in queue.status(mark_id)['error']
+    assert Unreachable.calls == 3
+    assert results == ['failed']
+
+
+def test_spooled_marks_are_replayed_after_restart(tmp_path):
+    down = FakeMainServer(lambda mark, call: {'status': 500, 'success': False})
+    queue = make_queue(tmp_path, down, backoff_base=10.0).start()
+    try:
+        first = queue.enqueue({'studentId': 's1'})
+        second = queue.enqueue({'studentId': 's2'})
+        assert wait_for(lambda: down.calls)
+    finally:
+        # Undelivered marks stay in the spool
+        queue.close(timeout=0.5)
+    assert queue.status(first)['status'] == 'pending'
+
+    # A mark whose delivery was recorded before the crash is not resent
+    delivered_id = 'delivered'
+    with open(tmp_path / 'spool.jsonl', 'ab') as f:
+        f.write((json.dumps({'op': 'add', 'id': delivered_id, 'mark': {'studentId': 's0'}}) + "\n").encode())
+        f.write((json.dumps({'op': 'done', 'id': delivered_id}) + "\n").encode())
+        # Torn final record from the crash
+        f.write(b'{"op": "add", "id": "torn", "ma')
+
+    server = FakeMainServer(marked)
+    restarted = make_queue(tmp_path, server).start()
+    try:
+        assert wait_for(lambda: all(settled(restarted, mark_id)() for mark_id in (first, second)))
+    finally:
+        restarted.close()
+
+    resent = [mark['studentId'] for _, marks in server.calls for mark in marks]
+    assert sorted(resent) == ['s1', 's2']
+    assert restarted.status(first)['status'] == 'marked'
+    assert restarted.status(delivered_id) is None
+
+    # Everything delivered: a second restart has nothing to resend
+    again = FakeMainServer(marked)
+    make_queue(tmp_path, again).start().close()
+    assert again.calls == []
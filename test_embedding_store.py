@@ -0,0 +1,187 @@
+"""
+Crash safety of the memory-mapped embedding store: interrupted appends, torn
+journal records, checkpoints and migration of a legacy embeddings.pkl
+"""
+
+import json
+import os
+import pickle
+
+import numpy as np
+import pytest
+
+from embedding_store import EmbeddingStore
+
+DIM = 8
+
+
+def make_student(seed, captures=3, **metadata):
+    rng = np.random.default_rng(seed)
+    all_embeddings = list(rng.normal(size=(captures, DIM)).astype(np.float32))
+    return dict({'embedding': np.mean(all_embeddings, axis=0),
+                 'all_embeddings': all_embeddings,
+                 'num_images': captures}, **metadata)
+
+
+def assert_same_student(stored, expected):
+    np.testing.assert_array_equal(stored['embedding'], expected['embedding'])
+    np.testing.assert_array_equal(np.asarray(stored['all_embeddings']), np.asarray(expected['all_embeddings']))
+    assert stored['num_images'] == expected['num_images']
+
+
+def reopen(store):
+    store.close()
+    return EmbeddingStore(store.data_dir).load()
+
+
+def test_put_and_reload(tmp_path):
+    store = EmbeddingStore(str(tmp_path))
+    students = {'a': make_student(1, name='Ann'), 'b': make_student(2, captures=5)}
+    store.put_many(students)
+    store.put('c', make_student(3))
+
+    loaded = reopen(store)
+    assert sorted(loaded) == ['a', 'b', 'c']
+    for student_id, student_data in dict(students, c=make_student(3)).items():
+        assert_same_student(loaded[student_id], student_data)
+    assert loaded['a']['name'] == 'Ann'
+
+
+def test_failed_put_is_rolled_back(tmp_path, monkeypatch):
+    store = EmbeddingStore(str(tmp_path))
+    store.put('a', make_student(1))
+    committed = os.path.getsize(store.data_file)
+
+    def fail(*records):
+        raise OSError('disk full')
+
+    with monkeypatch.context() as patch:
+        patch.setattr(store, '_journal_locked', fail)
+        with pytest.raises(OSError):
+            store.put('b', make_student(2))
+    # The rows written before the journal failed are cut off again
+    assert os.path.getsize(store.data_file) == committed
+
+    # A later put lands at the committed end and reads back its own rows
+    stored = store.put('c', make_student(3))
+    assert_same_student(stored, make_student(3))
+    loaded = reopen(store)
+    assert sorted(loaded) == ['a', 'c']
+    assert_same_student(loaded['c'], make_student(3))
+
+
+def test_rows_past_the_last_record_are_truncated(tmp_path):
+    store = EmbeddingStore(str(tmp_path))
+    store.put('a', make_student(1))
+    committed = os.path.getsize(store.data_file)
+    store.close()
+    # Crash after the rows were appended but before their journal record
+    with open(store.data_file, 'ab') as f:
+        f.write(make_student(2)['embedding'].tobytes())
+
+    store = EmbeddingStore(str(tmp_path))
+    assert sorted(store.load()) == ['a']
+    assert os.path.getsize(store.data_file) == committed
+    store.put('b', make_student(3))
+    loaded = reopen(store)
+    assert_same_student(loaded['a'], make_student(1))
+    assert_same_student(loaded['b'], make_student(3))
+
+
+def test_delete_survives_reload(tmp_path):
+    store = EmbeddingStore(str(tmp_path))
+    store.put_many({'a': make_student(1), 'b': make_student(2)})
+    assert store.delete('a')
+    assert not store.delete('a')
+    assert sorted(reopen(store)) == ['b']
+
+
+def test_migrate_pickle(tmp_path):
+    students = {'a': make_student(1, name='Ann'), 'b': make_student(2, captures=4)}
+    pickle_path = tmp_path / 'embeddings.pkl'
+    with open(pickle_path, 'wb') as f:
+        pickle.dump(students, f)
+
+    store = EmbeddingStore(str(tmp_path))
+    migrated = store.migrate_pickle(str(pickle_path))
+    assert not pickle_path.exists()
+    assert (tmp_path / 'embeddings.pkl.migrated').exists()
+    for student_id, student_data in students.items():
+        assert_same_student(migrated[student_id], student_data)
+
+    loaded = reopen(store)
+    assert sorted(loaded) == ['a', 'b']
+    for student_id, student_data in students.items():
+        assert_same_student(loaded[student_id], student_data)
+    assert loaded['a']['name'] == 'Ann'
+
+
+def test_torn_journal_tail_is_dropped(tmp_path):
+    store = EmbeddingStore(str(tmp_path))
+    store.put_many({'a': make_student(1), 'b': make_student(2)})
+    store.close()
+    good_bytes = os.path.getsize(store.journal_file)
+    # Crash halfway through writing the next record
+    with open(store.journal_file, 'ab') as f:
+        f.write(b'{"op": "delete", "id": "a", "se')
+
+    store = EmbeddingStore(str(tmp_path))
+    loaded = store.load()
+    assert sorted(loaded) == ['a', 'b']
+    assert os.path.getsize(store.journal_file) == good_bytes
+    # New records append cleanly after the dropped tail
+    store.put('c', make_student(3))
+    loaded = reopen(store)
+    assert sorted(loaded) == ['a', 'b', 'c']
+    assert_same_student(loaded['c'], make_student(3))
+
+
+def test_checkpoint_then_reload(tmp_path):
+    store = EmbeddingStore(str(tmp_path))
+    store.put_many({'a': make_student(1), 'b': make_student(2)})
+    store.delete('a')
+    store.checkpoint()
+    assert store.stats()['journal_records'] == 0
+    assert os.path.getsize(store.journal_file) == 0
+
+    # Records after the checkpoint are replayed on top of the index
+    store.put('c', make_student(3))
+    loaded = reopen(store)
+    assert sorted(loaded) == ['b', 'c']
+    assert_same_student(loaded['b'], make_student(2))
+    assert_same_student(loaded['c'], make_student(3))
+
+
+def test_background_checkpoint(tmp_path):
+    store = EmbeddingStore(str(tmp_path), compact_threshold=3)
+    for i in range(5):
+        store.put(f's{i}', make_student(i))
+    store.close()
+    # The compactor folded the first records into the index
+    with open(store.index_file) as f:
+        assert json.load(f)['journal_seq'] >= 3
+    assert store.stats()['journal_records'] < 3
+
+    loaded = EmbeddingStore(str(tmp_path)).load()
+    assert sorted(loaded) == [f's{i}' for i in range(5)]
+    for i in range(5):
+        assert_same_student(loaded[f's{i}'], make_student(i))
+
+
+def test_checkpoint_rewrites_mostly_dead_data_file(tmp_path):
+    store = EmbeddingStore(str(tmp_path))
+    store.put_many({'big': make_student(1, captures=1100), 'a': make_student(2)})
+    old_data_file = store.data_file
+    store.delete('big')
+    store.checkpoint()
+
+    # Live rows moved to the next generation and the old file is gone
+    assert store.stats()['generation'] == 2
+    assert store.stats()['dead_rows'] == 0
+    assert store.data_file != old_data_file
+    assert not os.path.exists(old_data_file)
+    store.put('b', make_student(3))
+    loaded = reopen(store)
+    assert sorted(loaded) == ['a', 'b']
+    assert_same_student(loaded['a'], make_student(2))
+    assert_same_student(loaded['b'], make_student(3))
@@ -0,0 +1,174 @@
+"""
+Accuracy parity of compact gallery storage and the IVF index against exact
+float32 search
+"""
+
+import numpy as np
+import pytest
+
+from face_gallery import FaceGallery, l2_normalize
+from face_index import create_index
+
+DIM = 512
+NUM_STUDENTS = 300
+CAPTURES = 5
+
+
+def make_students(seed=0):
+    rng = np.random.default_rng(seed)
+    students = {}
+    for i in range(NUM_STUDENTS):
+        identity = rng.normal(size=DIM)
+        captures = l2_normalize(identity + rng.normal(size=(CAPTURES, DIM)) * 0.6)
+        students[f"s{i:03d}"] = {'embedding': captures.mean(axis=0), 'all_embeddings': list(captures)}
+    return students
+
+
+def make_probes(students, seed=1):
+    """Noisy captures of every 7th student, plus their true ids"""
+    rng = np.random.default_rng(seed)
+    ids = sorted(students)[::7]
+    probes = np.stack([students[sid]['all_embeddings'][0] + rng.normal(size=DIM) * 0.02 for sid in ids])
+    return ids, probes.astype(np.float32)
+
+
+def top1(gallery, probes):
+    results = [gallery.match(probe) for probe in probes]
+    return [sid for sid, _ in results], np.array([score for _, score in results])
+
+
+@pytest.fixture(scope='module')
+def students():
+    return make_students()
+
+
+@pytest.fixture(scope='module')
+def exact(students):
+    gallery = FaceGallery(storage='float32')
+    gallery.build(students)
+    return gallery
+
+
+def test_int8_matches_exact_float32(students, exact):
+    _, probes = make_probes(students)
+    gallery = FaceGallery(storage='int8')
+    gallery.build(students)
+
+    exact_ids, exact_scores = top1(exact, probes)
+    ids, scores = top1(gallery, probes)
+    assert ids == exact_ids
+    # The best students are re-ranked at full precision
+    np.testing.assert_allclose(scores, exact_scores, atol=1e-5)
+    assert gallery.nbytes < exact.nbytes / 3
+
+
+def test_int8_without_rerank_stays_close(students, exact):
+    _, probes = make_probes(students)
+    gallery = FaceGallery(storage='int8', rerank_k=0)
+    gallery.build(students)
+
+    exact_ids, exact_scores = top1(exact, probes)
+    ids, scores = top1(gallery, probes)
+    assert ids == exact_ids
+    np.testing.assert_allclose(scores, exact_scores, atol=0.01)
+
+
+@pytest.mark.parametrize('storage', ['float32', 'int8'])
+def test_ivf_matches_exact_float32(students, exact, storage):
+    true_ids, probes = make_probes(students)
+    gallery = FaceGallery(index=create_index('ivf', nlist=16, nprobe=16, min_rows=100), storage=storage)
+    gallery.build(students)
+    assert gallery.index.trained
+
+    exact_ids, exact_scores = top1(exact, probes)
+    ids, scores = top1(gallery, probes)
+    assert ids == exact_ids == true_ids
+    np.testing.assert_allclose(scores, exact_scores, atol=1e-5)
+
+
+@pytest.mark.parametrize('storage', ['float32', 'int8'])
+def test_ivf_incremental_add_matches_rebuild(students, storage):
+    ids = sorted(students)
+    index_options = {'nlist': 16, 'nprobe': 16, 'min_rows': 100}
+    incremental = FaceGallery(index=create_index('ivf', **index_options), storage=storage)
+    incremental.build({sid: students[sid] for sid in ids[:-10]})
+    for sid in ids[-10:]:
+        incremental.add(sid, students[sid])
+    rebuilt = FaceGallery(index=create_index('ivf', **index_options), storage=storage)
+    rebuilt.build(students)
+
+    _, probes = make_probes({sid: students[sid] for sid in ids[-10:]})
+    # Same centroids: the incremental gallery did not outgrow its training
+    np.testing.assert_array_equal(incremental.index.centroids.shape, rebuilt.index.centroids.shape)
+    for probe in probes:
+        inc_ids, inc_scores = incremental.student_scores(probe)
+        reb_ids, reb_scores = rebuilt.student_scores(probe)
+        inc = dict(zip(inc_ids, inc_scores))
+        for sid, score in zip(reb_ids, reb_scores):
+            if sid in inc and sid in ids[-10:]:
+                assert inc[sid] == pytest.approx(score, abs=1e-6)
+        assert incremental.match(probe)[0] == rebuilt.match(probe)[0]
+
+
+def test_float16_storage_is_rejected():
+    with pytest.raises(ValueError):
+        FaceGallery(storage='float16')
+
+
+@pytest.mark.parametrize('storage', ['float32', 'int8'])
+def test_incremental_updates_match_a_fresh_build(students, storage):
+    rng = np.random.default_rng(2)
+    ids = sorted(students)
+    gallery = FaceGallery(storage=storage)
+    gallery.build({sid: students[sid] for sid in ids[:100]})
+    enrolled = {sid: students[sid] for sid in ids[:100]}
+    for step in range(400):
+        sid = ids[rng.integers(len(ids))]
+        if sid in enrolled and rng.random() < 0.5:
+            assert gallery.remove(sid)
+            del enrolled[sid]
+        else:
+            # Re-enrolling replaces the student's rows (with a different row count)
+            captures = l2_normalize(np.stack(students[sid]['all_embeddings'][:3])
+                                    + rng.normal(size=(3, DIM)) * 0.1)
+            data = {'embedding': captures.mean(axis=0), 'all_embeddings': list(captures)}
+            gallery.add(sid, data)
+            enrolled[sid] = data
+    assert not gallery.remove('never-enrolled')
+
+    fresh = FaceGallery(storage=storage)
+    fresh.build(enrolled)
+    assert sorted(gallery.student_ids) == sorted(enrolled)
+    assert gallery.num_rows == fresh.num_rows
+    _, probes = make_probes(students)
+    got_ids, got = gallery.student_score_matrix(probes)
+    want_ids, want = fresh.student_score_matrix(probes)
+    order = [got_ids.index(sid) for sid in want_ids]
+    np.testing.assert_allclose(got[:, order], want, atol=1e-6)
+
+
+def test_enrolment_appends_without_copying_the_matrix(students):
+    ids = sorted(students)
+    gallery = FaceGallery()
+    gallery.build({sid: students[sid] for sid in ids[:200]})
+    buffer = gallery._buffer
+    for sid in ids[200:220]:
+        gallery.add(sid, students[sid])
+    # Spare capacity absorbed the new rows
+    assert gallery._buffer is buffer
+    assert len(gallery) == 220
+
+
+def test_published_matrix_is_never_rewritten(students):
+    ids = sorted(students)
+    gallery = FaceGallery()
+    gallery.build({sid: students[sid] for sid in ids[:50]})
+    matrix = gallery._state[0]
+    before = matrix.copy()
+    # A reader holding the old snapshot keeps seeing the same rows
+    for sid in ids[:40]:
+        gallery.remove(sid)
+    for sid in ids[50:80]:
+        gallery.add(sid, students[sid])
+    np.testing.assert_array_equal(matrix, before)
+    assert gallery.num_rows < gallery._buffer.shape[0]
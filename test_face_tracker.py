@@ -0,0 +1,112 @@
+"""
+Track-by-detection: IoU association, re-embedding triggers and dropping
+tracks that lose their face
+"""
+
+import types
+
+import numpy as np
+import pytest
+
+from face_tracker import FaceTracker, box_iou
+
+FRAME = np.zeros((240, 320, 3), dtype=np.uint8)
+
+
+def face(x1, y1, x2, y2):
+    return types.SimpleNamespace(bbox=np.array([x1, y1, x2, y2], dtype=np.float32), kps=None)
+
+
+def detect(tracker, *faces):
+    return tracker.update(FRAME, list(faces))
+
+
+def test_box_iou():
+    assert box_iou([0, 0, 10, 10], [0, 0, 10, 10]) == pytest.approx(1.0)
+    assert box_iou([0, 0, 10, 10], [5, 0, 15, 10]) == pytest.approx(50 / 150)
+    assert box_iou([0, 0, 10, 10], [20, 20, 30, 30]) == 0.0
+    assert box_iou([0, 0, 0, 0], [0, 0, 0, 0]) == 0.0
+
+
+def test_new_faces_start_tracks_that_need_embedding():
+    tracker = FaceTracker()
+    assert tracker.is_detection_frame()
+    tracks, to_embed, dropped = detect(tracker, face(10, 10, 60, 60), face(200, 10, 250, 60))
+    assert len(tracks) == 2
+    assert to_embed == tracks
+    assert dropped == []
+    assert len({track.track_id for track in tracks}) == 2
+
+
+def test_overlapping_detections_keep_their_track():
+    tracker = FaceTracker(detect_every=1)
+    (left, right), _, _ = detect(tracker, face(10, 10, 60, 60), face(200, 10, 250, 60))
+    for track in (left, right):
+        track.assign('s1', 0.9, tracker.frame_index)
+
+    # Both faces moved a little; detections arrive in the other order
+    tracks, to_embed, _ = detect(tracker, face(205, 12, 255, 62), face(14, 12, 64, 62))
+    assert tracks == [left, right]
+    assert left.bbox.tolist() == [14, 12, 64, 62]
+    assert right.bbox.tolist() == [205, 12, 255, 62]
+    # Embedded recently and close to the embedded box: no re-embedding
+    assert to_embed == []
+
+
+def test_greedy_association_prefers_the_highest_iou():
+    tracker = FaceTracker(detect_every=1)
+    (track,), _, _ = detect(tracker, face(0, 0, 100, 100))
+    tracks, to_embed, _ = detect(tracker, face(40, 0, 140, 100), face(5, 0, 105, 100))
+    assert track.bbox.tolist() == [5, 0, 105, 100]
+    # The weaker overlap becomes a new track
+    assert len(tracks) == 2
+    assert [t for t in to_embed if t is not track] == [tracks[1]]
+
+
+def test_drifted_and_stale_tracks_are_reembedded():
+    tracker = FaceTracker(detect_every=1, drift_iou=0.5, reembed_every=3)
+    (track,), _, _ = detect(tracker, face(0, 0, 100, 100))
+    track.assign('s1', 0.9, tracker.frame_index)
+
+    # Still the same track (IoU >= 0.3) but far from where it was embedded
+    _, to_embed, _ = detect(tracker, face(30, 0, 130, 100))
+    _, to_embed_again, _ = detect(tracker, face(45, 0, 145, 100))
+    assert to_embed == []
+    assert to_embed_again == [track]
+    track.assign('s1', 0.9, tracker.frame_index)
+
+    # Not re-confirmed for reembed_every frames
+    results = [detect(tracker, face(45, 0, 145, 100))[1] for _ in range(3)]
+    assert results == [[], [], [track]]
+
+
+def test_tracks_without_faces_are_dropped_after_max_misses():
+    tracker = FaceTracker(detect_every=1, max_misses=2)
+    (track,), _, _ = detect(tracker, face(10, 10, 60, 60))
+    for _ in range(2):
+        tracks, _, dropped = detect(tracker)
+        assert tracks == [track] and dropped == []
+    assert track.misses == 2
+
+    tracks, _, dropped = detect(tracker)
+    assert tracks == [] and dropped == [track]
+
+
+def test_a_matched_detection_resets_misses():
+    tracker = FaceTracker(detect_every=1, max_misses=1)
+    (track,), _, _ = detect(tracker, face(10, 10, 60, 60))
+    detect(tracker)
+    detect(tracker, face(12, 10, 62, 60))
+    assert track.misses == 0
+    tracks, _, dropped = detect(tracker)
+    assert tracks == [track] and dropped == []
+
+
+def test_detection_cadence():
+    tracker = FaceTracker(detect_every=3)
+    detect(tracker, face(10, 10, 60, 60))
+    cadence = []
+    for _ in range(6):
+        cadence.append(tracker.is_detection_frame())
+        tracker.update(FRAME)
+    assert cadence == [False, False, True, False, False, True]
@@ -0,0 +1,116 @@
+"""
+Micro-batching of concurrent inference requests: batch gathering, the batch
+size and latency cutoffs and error propagation
+"""
+
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from inference_batcher import MicroBatcher
+
+
+class RecordingModel:
+    """Batched fn returning 10x its inputs; the first batch can be held back"""
+
+    def __init__(self, hold_first=False):
+        self.batches = []
+        self.release = threading.Event()
+        self.started = threading.Event()
+        if not hold_first:
+            self.release.set()
+
+    def __call__(self, inputs):
+        self.batches.append(list(inputs))
+        self.started.set()
+        self.release.wait(5)
+        return np.asarray(inputs) * 10
+
+
+def submit_behind_held_batch(batcher, model, requests):
+    """Queue `requests` while the scheduler is busy with a first batch"""
+    first = batcher.submit([0])
+    assert model.started.wait(5)
+    futures = [batcher.submit(items) for items in requests]
+    model.release.set()
+    assert first.result(5).tolist() == [0]
+    return [future.result(5).tolist() for future in futures]
+
+
+def test_concurrent_requests_share_a_batch():
+    model = RecordingModel(hold_first=True)
+    batcher = MicroBatcher(model, max_batch=32, max_latency=0.05)
+    try:
+        results = submit_behind_held_batch(batcher, model, [[1, 2], [3], [4, 5, 6]])
+    finally:
+        batcher.close()
+
+    assert results == [[10, 20], [30], [40, 50, 60]]
+    assert model.batches == [[0], [1, 2, 3, 4, 5, 6]]
+    stats = batcher.stats()
+    assert stats['batches'] == 2
+    assert stats['items'] == 7
+    assert stats['largest_batch'] == 6
+
+
+def test_full_batch_closes_without_splitting_requests():
+    model = RecordingModel(hold_first=True)
+    batcher = MicroBatcher(model, max_batch=4, max_latency=0.5)
+    try:
+        started = time.monotonic()
+        results = submit_behind_held_batch(batcher, model, [[1, 2], [3, 4], [5, 6], [7, 8], [9]])
+        elapsed = time.monotonic() - started
+    finally:
+        batcher.close()
+
+    assert results == [[10, 20], [30, 40], [50, 60], [70, 80], [90]]
+    assert model.batches[1:] == [[1, 2, 3, 4], [5, 6, 7, 8], [9]]
+    # Full batches do not wait out max_latency; only the lone first batch and
+    # the last partial one do (0.5s each)
+    assert elapsed < 1.5
+
+
+def test_lone_request_waits_at_most_max_latency():
+    model = RecordingModel()
+    batcher = MicroBatcher(model, max_batch=32, max_latency=0.05)
+    try:
+        started = time.monotonic()
+        assert batcher([7]).tolist() == [70]
+        elapsed = time.monotonic() - started
+        time.sleep(0.1)
+        assert batcher([8]).tolist() == [80]
+    finally:
+        batcher.close()
+
+    assert 0.04 <= elapsed < 1.0
+    # The second request came after the first batch closed
+    assert model.batches == [[7], [8]]
+
+
+def test_failed_batch_fails_every_request():
+    def broken(inputs):
+        raise RuntimeError('model crashed')
+
+    batcher = MicroBatcher(broken, max_latency=0.01)
+    try:
+        futures = [batcher.submit([1]), batcher.submit([2, 3])]
+        for future in futures:
+            with pytest.raises(RuntimeError, match='model crashed'):
+                future.result(5)
+        # The scheduler keeps serving after a failure
+        with pytest.raises(RuntimeError):
+            batcher([4])
+    finally:
+        batcher.close()
+
+
+def test_empty_request_skips_the_model():
+    model = RecordingModel()
+    batcher = MicroBatcher(model)
+    try:
+        assert len(batcher([])) == 0
+    finally:
+        batcher.close()
+    assert model.batches == []
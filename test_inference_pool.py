@@ -0,0 +1,95 @@
+"""
+Admission control of the bounded inference pool: shedding load with
+PoolSaturated and the Retry-After estimate
+"""
+
+import threading
+import time
+
+import pytest
+
+from inference_pool import InferencePool, PoolSaturated
+
+
+def blocked_pool(workers, queue_depth):
+    """A pool whose admitted tasks all wait on the returned event"""
+    pool = InferencePool(workers=workers, queue_depth=queue_depth)
+    release = threading.Event()
+    futures = [pool.submit(release.wait, 5) for _ in range(workers + queue_depth)]
+    deadline = time.monotonic() + 5
+    while pool.stats()['running'] < workers and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return pool, release, futures
+
+
+def test_full_queue_raises_pool_saturated():
+    pool, release, futures = blocked_pool(workers=1, queue_depth=2)
+    try:
+        with pytest.raises(PoolSaturated) as refused:
+            pool.submit(time.sleep, 0)
+        assert refused.value.retry_after >= 1
+        stats = pool.stats()
+        assert stats['rejected'] == 1
+        assert stats['running'] == 1
+        assert stats['queued'] == 2
+    finally:
+        release.set()
+        results = [future.result(5) for future in futures]
+        pool.shutdown()
+
+    assert [result for result, _ in results] == [True] * 3
+    # Queued tasks report the time they waited for the worker
+    assert all(wait >= 0 for _, wait in results)
+    assert pool.stats()['completed'] == 3
+
+
+def test_admission_reopens_as_tasks_finish():
+    pool, release, futures = blocked_pool(workers=2, queue_depth=0)
+    try:
+        with pytest.raises(PoolSaturated):
+            pool.submit(time.sleep, 0)
+        release.set()
+        for future in futures:
+            future.result(5)
+        assert pool.run(lambda: 'done')[0] == 'done'
+    finally:
+        pool.shutdown()
+
+
+def test_failed_tasks_release_their_slot():
+    pool = InferencePool(workers=1, queue_depth=0)
+
+    def broken():
+        raise ValueError('bad frame')
+
+    try:
+        for _ in range(3):
+            with pytest.raises(ValueError, match='bad frame'):
+                pool.run(broken)
+        assert pool.stats()['completed'] == 3
+        assert pool.stats()['rejected'] == 0
+    finally:
+        pool.shutdown()
+
+
+def test_retry_after_defaults_to_one_second_per_task():
+    pool = InferencePool(workers=2, queue_depth=6)
+    try:
+        # No measurements yet: 1s per task, (6 + 2) tasks over 2 workers
+        assert pool.retry_after() == 4
+    finally:
+        pool.shutdown()
+
+
+def test_retry_after_follows_measured_run_time():
+    pool = InferencePool(workers=1, queue_depth=3)
+    try:
+        pool.run(time.sleep, 0.3)
+        # A full backlog of 4 tasks at ~0.3s each drains in ~1.2s, rounded up
+        assert pool.retry_after() == 2
+        pool.run(time.sleep, 0.001)
+        pool.run(time.sleep, 0.001)
+        # Mean run ~0.1s: 4 tasks drain within a second, the minimum
+        assert pool.retry_after() == 1
+    finally:
+        pool.shutdown()